@@ -0,0 +1,276 @@
+import asyncio
+import functools
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from fastapi import HTTPException
+
+from tracing import span
+
+# Admission control and per-resource concurrency limits.
+# Each limited resource has a bulkhead: at most `limit` callers use it at once, up to `queue`
+# more wait in FIFO order, and a waiter gives up at its deadline. Requests beyond that fail
+# fast instead of piling more work onto a store that is already saturated:
+# - 429 Too Many Requests when the queue is full
+# - 503 Service Unavailable when the deadline passes while queued
+# Both carry Retry-After, estimated from the queue depth and the recent hold time of a slot.
+#
+# Resources:
+# - requests: /query, /explore and /modify as a whole, admitted by AdmissionMiddleware
+# - gemini: generate_content calls
+# - mysql / mongodb: query and modification round trips (a streamed MySQL query holds its slot
+#   until the stream is closed)
+# - firebase: full node downloads and writes
+# Cache hits never take a slot. Active, queued, admitted and shed counts are on /metrics.
+
+# limit: concurrent holders; queue: waiters beyond that; max_wait_s: longest wait in the queue
+# request_deadline_s: total time budget of an admitted request; backend waits never outlive it
+# retry_after_s: bounds of the Retry-After estimate
+# The endpoints run in the threadpool (40 threads by default), so requests.limit stays below it
+ADMISSION_CONFIG = {
+    "resources": {
+        "requests": {"limit": 32, "queue": 64, "max_wait_s": 10.0},
+        "gemini": {"limit": 8, "queue": 32, "max_wait_s": 10.0},
+        "mysql": {"limit": 10, "queue": 40, "max_wait_s": 5.0},
+        "mongodb": {"limit": 10, "queue": 40, "max_wait_s": 5.0},
+        "firebase": {"limit": 3, "queue": 12, "max_wait_s": 8.0}
+    },
+    "admitted_paths": ("/query", "/explore", "/modify", "/modify/batch"),
+    "request_deadline_s": 30.0,
+    "retry_after_s": (1, 30)
+}
+
+# Monotonic deadline of the current request, set by AdmissionMiddleware
+_deadline: ContextVar[Optional[float]] = ContextVar("admission_deadline", default=None)
+
+
+class Overloaded(HTTPException):
+
+    # Raised when a resource sheds a caller; FastAPI turns it into the 429/503 response.
+
+    def __init__(self, resource: str, reason: str, retry_after: int):
+        status_code = 429 if reason == "queue_full" else 503
+        detail = (f"Queue for {resource} is full, retry later" if reason == "queue_full"
+                  else f"Timed out queued for {resource}, retry later")
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+        self.resource = resource
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Bulkhead:
+
+    # Counting semaphore with a bounded FIFO queue. A released slot is handed straight to
+    # the oldest waiter, so late arrivals cannot overtake the queue. Threads wait on an
+    # Event (acquire), coroutines on a Future (acquire_async). A waiter still in the queue
+    # has not been granted a slot; both checks happen under the lock.
+
+    def __init__(self, name: str, limit: int, queue: int, max_wait_s: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.max_wait_s = max_wait_s
+        self.active = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "deadline": 0}
+        self.wait_seconds = 0.0
+        # Exponentially weighted hold time of a slot, for Retry-After
+        self.hold_seconds = 0.0
+        self._waiters = deque()  # callables that hand a released slot to their waiter
+        self._lock = threading.Lock()
+
+    def _wait_budget(self) -> float:
+        deadline = _deadline.get()
+        if deadline is None:
+            return self.max_wait_s
+        return min(self.max_wait_s, deadline - time.monotonic())
+
+    def retry_after(self) -> int:
+        low, high = ADMISSION_CONFIG["retry_after_s"]
+        expected = self.hold_seconds * (len(self._waiters) + 1) / max(self.limit, 1)
+        return int(min(high, max(low, math.ceil(expected))))
+
+    def _shed(self, reason: str) -> Overloaded:
+        # Called with the lock held
+        self.shed[reason] += 1
+        return Overloaded(self.name, reason, self.retry_after())
+
+    def _try_enter(self, waiter: Callable[[], None]) -> bool:
+        # Takes a free slot, or queues the waiter; raises when the queue is full
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self._wait_budget() <= 0:
+                raise self._shed("deadline")
+            if len(self._waiters) >= self.queue:
+                raise self._shed("queue_full")
+            self._waiters.append(waiter)
+            self.peak_waiting = max(self.peak_waiting, len(self._waiters))
+            return False
+
+    def _give_up(self, waiter: Callable[[], None], waited: float) -> None:
+        # The waiter's deadline passed: leave the queue unless the slot arrived in the meantime
+        with self._lock:
+            self.wait_seconds += waited
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                self.admitted += 1
+                return
+            raise self._shed("deadline")
+
+    def _admitted_after(self, waited: float) -> None:
+        with self._lock:
+            self.admitted += 1
+            self.wait_seconds += waited
+
+    def acquire(self) -> None:
+        granted = threading.Event()
+        grant = granted.set
+        if self._try_enter(grant):
+            return
+        started = time.perf_counter()
+        with span("queue", resource=self.name):
+            if granted.wait(max(self._wait_budget(), 0)):
+                self._admitted_after(time.perf_counter() - started)
+                return
+            self._give_up(grant, time.perf_counter() - started)
+
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant() -> None:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        if self._try_enter(grant):
+            return
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max(self._wait_budget(), 0))
+            self._admitted_after(time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            self._give_up(grant, time.perf_counter() - started)
+        except asyncio.CancelledError:
+            # Client went away while queued: pass on a slot that was already granted
+            with self._lock:
+                if grant in self._waiters:
+                    self._waiters.remove(grant)
+                    raise
+            self.release(0.0)
+            raise
+
+    def release(self, held: float) -> None:
+        with self._lock:
+            if held:
+                self.hold_seconds = held if self.hold_seconds == 0 else 0.8 * self.hold_seconds + 0.2 * held
+            if self._waiters:
+                self._waiters.popleft()()
+            else:
+                self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "waiting": len(self._waiters),
+                "peak_waiting": self.peak_waiting,
+                "admitted": self.admitted,
+                "shed_queue_full": self.shed["queue_full"],
+                "shed_deadline": self.shed["deadline"],
+                "wait_seconds": self.wait_seconds
+            }
+
+
+BULKHEADS = {
+    name: Bulkhead(name, settings["limit"], settings["queue"], settings["max_wait_s"])
+    for name, settings in ADMISSION_CONFIG["resources"].items()
+}
+
+
+@contextmanager
+def admit(resource: str) -> Iterator[None]:
+
+    # Holds a slot of `resource` for the enclosed block, waiting for one if needed.
+    # Raises Overloaded when the caller is shed.
+
+    bulkhead = BULKHEADS[resource]
+    bulkhead.acquire()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        bulkhead.release(time.perf_counter() - started)
+
+
+def limited(resource: str) -> Callable:
+
+    # Decorator form of admit() for connector functions.
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with admit(resource):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class AdmissionMiddleware:
+
+    # ASGI middleware: admits /query, /explore and /modify through the "requests" bulkhead
+    # and sets the request deadline that backend waits are bounded by. A shed request is
+    # answered here with 429/503 and Retry-After.
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in ADMISSION_CONFIG["admitted_paths"]:
+            await self.app(scope, receive, send)
+            return
+        token = _deadline.set(time.monotonic() + ADMISSION_CONFIG["request_deadline_s"])
+        bulkhead = BULKHEADS["requests"]
+        try:
+            try:
+                await bulkhead.acquire_async()
+            except Overloaded as e:
+                # Lets MetricsMiddleware label the response with its path even though no route ran
+                scope["admission_shed"] = e.resource
+                await send_overloaded(e, send)
+                return
+            started = time.perf_counter()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                bulkhead.release(time.perf_counter() - started)
+        finally:
+            _deadline.reset(token)
+
+
+async def send_overloaded(error: Overloaded, send) -> None:
+    body = json.dumps({"detail": error.detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": error.status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(error.retry_after).encode())
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def admission_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: bulkhead.stats() for name, bulkhead in BULKHEADS.items()}
@@ -1,18 +1,42 @@
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 
 import uvicorn
 import re
 import json
+import logging
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from google import genai
-from database.mysql_connector import query_mysql, validate_table_exists, get_table_schema, modify_mysql
-from database.mongodb_connector import query_mongodb, get_collection, get_database, convert_objectid_to_str, COLLECTIONS, modify_mongodb
-from database.firebase_connector import query_firebase, get_reference, initialize_firebase, modify_firebase
+from database.mysql_connector import query_mysql, validate_table_exists, get_table_schema, modify_mysql, modify_mysql_batch, MySQLStream, MYSQL_STREAM_CONFIG
+from database.mongodb_connector import query_mongodb, stream_mongodb, get_collection, get_database, convert_objectid_to_str, COLLECTIONS, modify_mongodb, modify_mongodb_batch
+from database.firebase_connector import query_firebase, get_reference, initialize_firebase, modify_firebase, modify_firebase_batch, list_firebase_keys, sample_firebase_children, start_firebase_mirror
+from database.firebase_mirror import firebase_mirror
+from database.geo_index import InvalidNearQuery, find_near, parse_near, start_geo_index
+from database.text_index import InvalidSearchQuery, find_text, parse_search, start_text_index
+from database.amenity_index import AmenityMatch, InvalidAmenityQuery, find_amenities, parse_amenities, start_amenity_index
+from database.aggregate_store import InvalidAggregateQuery, find_aggregates, parse_aggregate, start_aggregate_store
+from database.schema_catalog import schema_catalog
+from database.slow_query_log import slow_query_log, set_nl_query
+from database.replication_log import replication_log, REPLICATION_CONFIG
+from database.write_journal import (write_journal, WriteBehindRejected, WRITE_BEHIND_CONFIG,
+                                     keyed_mysql_write, keyed_mongodb_write, keyed_firebase_write)
+from fast_json import FastJSONResponse, dumps, iter_json_array
+from columnar import columnar_results
+from admission import AdmissionMiddleware, Overloaded, admit
+from circuit_breaker import CircuitOpen, describe, outage_reason
+from metrics import MetricsMiddleware, LLM_RETRIES, stage, render_metrics
+from tracing import TracingMiddleware, configure_logging, lazy_json, trace_store, traces_summary
 from firebase_admin import db
 
+configure_logging()
+logger = logging.getLogger("chatdb.app")
+
 app = FastAPI()
 
 # Enable CORS for all origins and methods to support frontend-backend communication
@@ -24,9 +48,77 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Concurrency limits for /query, /explore and /modify; sheds with 429/503 when saturated (see admission.py)
+app.add_middleware(AdmissionMiddleware)
+# Per-request stage timings (Server-Timing header) and request counters for /metrics
+app.add_middleware(MetricsMiddleware)
+# Request ids and sampled traces (/debug/traces); added last so it wraps the metrics middleware
+app.add_middleware(TracingMiddleware)
+
+@app.on_event("startup")
+def load_schema_catalog():
+    # Introspect all stores once in the background so startup is not blocked by an unreachable store;
+    # /explore falls back to live introspection until a store's snapshot is available
+    schema_catalog.refresh_in_background()
+
+@app.on_event("startup")
+def start_write_behind():
+    # Replays write-behind journal entries that were not applied before the last shutdown
+    if WRITE_BEHIND_CONFIG["enabled"]:
+        write_journal.start()
+
+@app.on_event("shutdown")
+def stop_write_behind():
+    write_journal.stop()
+
+@app.on_event("startup")
+def start_mirror():
+    # Subscribes to /listings and /hosts so Firebase queries read from memory (see firebase_mirror.py)
+    start_firebase_mirror()
+
+@app.on_event("shutdown")
+def stop_mirror():
+    firebase_mirror.stop()
+
+@app.on_event("startup")
+def build_geo_index():
+    # Near queries use MySQL's SPATIAL index until the in-process grid is built (see geo_index.py)
+    start_geo_index()
+
+@app.on_event("startup")
+def build_text_index():
+    # Text searches use MySQL's FULLTEXT index until the inverted index is built (see text_index.py)
+    start_text_index()
+
+@app.on_event("startup")
+def build_amenity_index():
+    # Amenity filters query the amenities collection until the bitmap index is built (see amenity_index.py)
+    start_amenity_index()
+
+@app.on_event("startup")
+def build_aggregate_store():
+    # Aggregate questions go to the base stores until the aggregate table is built (see aggregate_store.py)
+    start_aggregate_store()
+
+@app.on_event("startup")
+def start_replication():
+    # Propagates shared-field changes that were recorded but not applied before the last shutdown
+    if REPLICATION_CONFIG["enabled"]:
+        replication_log.start()
+
+@app.on_event("shutdown")
+def stop_replication():
+    replication_log.stop()
+
 class QueryRequest(BaseModel):
     query: str
     db_type: Optional[str] = None
+    # MongoDB-only queries: stream undecoded BSON documents straight into the response
+    raw_bson: bool = False
+    # MySQL-only queries: stream rows from an unbuffered cursor, capped by MYSQL_STREAM_CONFIG
+    stream: bool = False
+    # "columnar" returns column names once with per-column value arrays (see columnar.py)
+    format: Optional[str] = None
 
 class ExploreRequest(BaseModel):
     query: str
@@ -34,7 +126,30 @@ class ExploreRequest(BaseModel):
 
 class ModificationRequest(BaseModel):
     modification: str
-    db_type: Optional[str] = None 
+    db_type: Optional[str] = None
+    # Journal keyed updates and acknowledge with 202, applying them in the background (see write_journal.py)
+    write_behind: bool = False
+
+class BatchModificationItem(BaseModel):
+    # Either a natural language modification, or pre-structured modifications in the
+    # format convert_nl_to_modification returns ("mysql", "mongodb", "firebase")
+    modification: Optional[str] = None
+    db_type: Optional[str] = None
+    mysql: Optional[Any] = None
+    mongodb: Optional[Any] = None
+    firebase: Optional[Any] = None
+
+class BatchModificationRequest(BaseModel):
+    items: List[BatchModificationItem]
+    # Applies to items without their own db_type
+    db_type: Optional[str] = None
+
+# max_items: largest accepted batch
+# translation_workers: NL items translated at once (Gemini admission limits still apply)
+BATCH_MODIFY_CONFIG = {
+    "max_items": 1000,
+    "translation_workers": 4
+}
 
 # Removes markdown code fences (``` or ```python) from AI-generated responses
 def remove_code_fences(text: str) -> str:
@@ -66,7 +181,9 @@ def convert_nl_to_query(nl_query: str, max_attempts: int = 3) -> Dict[str, Any]:
 
         prompt = f"""
             You are given a natural language query: "{nl_query}"
-            You must produce a valid JSON object with exactly three keys: "mysql", "mongodb", and "firebase".
+            You must produce a valid JSON object with exactly three keys: "mysql", "mongodb", and "firebase",
+            plus optional "near", "search", "amenities" and "aggregate" keys for questions about location,
+            keywords, amenities or per-neighbourhood statistics (see below).
 
             Below are the database schemas and a description of the data in each field:
 
@@ -97,10 +214,12 @@ def convert_nl_to_query(nl_query: str, max_attempts: int = 3) -> Dict[str, Any]:
             - beds: INT
             - description: TEXT
             - neighborhood_overview: TEXT
+              (description and neighborhood_overview share a FULLTEXT index)
             - neighbourhood_cleansed: VARCHAR(100)
             - neighbourhood_group_cleansed: VARCHAR(100)
             - latitude: DOUBLE
             - longitude: DOUBLE
+            - location: POINT SRID 4326, generated from longitude/latitude, with a SPATIAL index
             - host_id: BIGINT (foreign key to Hosts)
             
             Note: The MySQL database does NOT contain price information. Price data is only in Firebase.
@@ -258,6 +377,47 @@ def convert_nl_to_query(nl_query: str, max_attempts: int = 3) -> Dict[str, Any]:
                   "price": {{"$lt": 150}}
                 }}
               }}
+              Conditions on "pricing" and "availability" fields can use $lt, $lte, $gt, $gte, $eq, $ne,
+              $in (a list of values) and $between ([low, high], inclusive), e.g. {{"price": {{"$between": [100, 200]}}}}.
+
+            - "near" (only when the query asks for listings near a place or within a distance of it):
+              {{ "latitude": 34.0522, "longitude": -118.2437, "radius_km": 1 }}
+              Use the coordinates of the place named in the query (the listings are in the Los Angeles area).
+              For "the N closest/nearest", give "k": N instead of, or as well as, "radius_km".
+              The backend finds the matching listings with a spatial index and restricts all three queries
+              to them, so do NOT filter or compute distances on latitude/longitude/location in the other queries;
+              write them for the remaining conditions only.
+
+            - "search" (only when the query looks for listings by words in their description or
+              neighborhood, e.g. "listings with a rooftop view", "quiet places near the beach"):
+              {{ "text": "rooftop view" }}
+              Put the descriptive keywords in "text"; add "k": N for "the N best matches". The backend ranks
+              the listings by relevance and restricts all three queries to the matches, so do not repeat
+              the keywords in the other queries. Never use LIKE '%...%' on description or neighborhood_overview;
+              if a text condition must be in the MySQL query, use
+              MATCH(description, neighborhood_overview) AGAINST ('words' IN NATURAL LANGUAGE MODE).
+
+            - "amenities" (only when the query asks for listings with or without amenities, e.g.
+              "with wifi and a pool but no smoking"):
+              {{ "all": ["wifi", "pool"], "any": [], "none": ["smoking allowed"] }}
+              "all" lists required amenities, "any" amenities of which at least one is required and "none"
+              excluded ones. A name matches every amenity containing its words ("parking" matches
+              "Free street parking"). The backend resolves the filter with an amenity index and restricts
+              all three queries to the matches, so do NOT query the amenities collection, $lookup it or
+              use $all/$in on amenities for these conditions; write the other queries for the rest.
+
+            - "aggregate" (only for counts, sums, averages, minimums or maximums over listings per
+              neighbourhood and/or room type, or over all listings, e.g. "count listings per neighbourhood",
+              "average rating by neighbourhood with at least 5 listings"):
+              {{ "group_by": ["neighbourhood_cleansed"], "metrics": ["count", "avg_rating"],
+                 "having": {{ "count": {{ "$gte": 5 }} }}, "sort": {{ "avg_rating": -1 }}, "limit": 10 }}
+              "group_by" takes "neighbourhood_cleansed" and/or "room_type" (or nothing, for one overall row).
+              "metrics": "count" (listings) or <op>_<field>, op one of count, sum, avg, min, max and field one of
+              rating (review_scores_rating), price, availability_30, availability_60, availability_90, availability_365.
+              "where" may restrict neighbourhood_cleansed and/or room_type to a value or a list of values;
+              "having" filters on requested metrics with the Firebase operators above; "sort" uses 1 / -1.
+              The backend answers it from precomputed aggregates when it can; still write the three queries
+              for the same question, which are used otherwise.
 
             IMPORTANT: For a query about price, you must use the Firebase database only. MySQL and MongoDB do not have price information.
 
@@ -282,10 +442,13 @@ def convert_nl_to_query(nl_query: str, max_attempts: int = 3) -> Dict[str, Any]:
             ANALYZE THE QUERY CAREFULLY. If it's asking for specific MongoDB features like PROJECTION, MATCH, GROUP, SORT, LIMIT, SKIP, etc., make sure to include those in your MongoDB query.
         """
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-        )
+        if attempt > 0:
+            LLM_RETRIES.inc(purpose="query")
+        with admit("gemini"), stage("llm", desc=f"attempt {attempt + 1}"):
+            response = client.models.generate_content(
+                model="gemini-2.0-flash",
+                contents=prompt,
+            )
     
         if not response or not response.candidates:
             attempt += 1
@@ -306,7 +469,7 @@ def convert_nl_to_query(nl_query: str, max_attempts: int = 3) -> Dict[str, Any]:
             pass
         attempt += 1
 
-    print("Invalid JSON from AI after multiple attempts:", candidate_text)
+    logger.error("Invalid JSON from AI after multiple attempts: %s", candidate_text)
     return {}
 
 # Use Gemini to classify the user's query as schema exploration or general data query
@@ -354,10 +517,11 @@ def identify_schema_exploration_query(query: str) -> Dict[str, Any]:
         If the user is clearly asking about MongoDB collections or Firebase nodes, set db_type appropriately.
     """
     
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt,
-    )
+    with admit("gemini"), stage("llm_explore"):
+        response = client.models.generate_content(
+            model="gemini-2.0-flash",
+            contents=prompt,
+        )
     
     if not response or not response.candidates:
         return {"query_type": "GENERAL_QUERY"}
@@ -446,17 +610,14 @@ def get_firebase_nodes() -> List[str]:
     """Get available top-level nodes in Firebase."""
     print("Getting Firebase nodes...")
     try:
-        initialize_firebase()
-        ref = db.reference("/")
-        data = ref.get()
-        print(f"Firebase root data type: {type(data)}")
+        # Shallow read: only the top-level keys are downloaded, not the data below them
+        nodes = list_firebase_keys("/")
         
-        if isinstance(data, dict):
-            nodes = list(data.keys())
+        if nodes is not None:
             print(f"Found {len(nodes)} Firebase nodes: {nodes}")
             return nodes
         else:
-            print(f"Firebase root data is not a dictionary: {type(data)}")
+            print("Firebase root data is not a dictionary")
             # Return default nodes if we can't get actual data
             return ["listings", "hosts"]
     except Exception as e:
@@ -468,13 +629,12 @@ def get_firebase_nodes() -> List[str]:
 def get_firebase_schema(node_path: str) -> Dict[str, Any]:
     print(f"Getting Firebase schema for path: {node_path}")
     try:
-        initialize_firebase()
         # Firebase expects paths to start with a slash
         if not node_path.startswith("/"):
             node_path = f"/{node_path}"
             
-        ref = db.reference(node_path)
-        data = ref.get()
+        # Only the first child (by key) is needed to infer the structure
+        data = sample_firebase_children(node_path, 1)
         print(f"Firebase data for {node_path}: {type(data)}")
         
         # If no data is found, return a sample schema
@@ -564,12 +724,11 @@ def get_firebase_schema(node_path: str) -> Dict[str, Any]:
 def get_firebase_sample(node_path: str, count: int = 5) -> List[Dict[str, Any]]:
     print(f"Getting Firebase sample data for path: {node_path}, count: {count}")
     try:
-        initialize_firebase()
         if not node_path.startswith("/"):
             node_path = f"/{node_path}"
             
-        ref = db.reference(node_path)
-        data = ref.get()
+        # Bounded read of the first `count` children instead of the whole node
+        data = sample_firebase_children(node_path, count)
         print(f"Firebase data type for {node_path}: {type(data)}")
         
         results = []
@@ -582,7 +741,7 @@ def get_firebase_sample(node_path: str, count: int = 5) -> List[Dict[str, Any]]:
             ]
         
         if isinstance(data, dict):
-            sample_keys = list(data.keys())[:count]
+            sample_keys = list(data.keys())
             print(f"Sample keys: {sample_keys}")
             for key in sample_keys:
                 sample = data[key]
@@ -610,8 +769,9 @@ api_key = "GOOGLE_GEMINI_API_KEY"  # Placeholder for the API key
 # This value must be replaced with actual credential before deployment
 
 @app.post("/explore")
-async def explore_database(request: ExploreRequest):
+def explore_database(request: ExploreRequest):
 
+    set_nl_query(request.query)
     try:
         # Classify the exploration query and extract parameters
         exploration = identify_schema_exploration_query(request.query)
@@ -622,7 +782,9 @@ async def explore_database(request: ExploreRequest):
         
         if query_type == "LIST_TABLES":
             if db_type == "mongodb":
-                collections = get_mongodb_collections()
+                collections = schema_catalog.list_tables("mongodb")
+                if collections is None:
+                    collections = get_mongodb_collections()
                 return {
                     "exploration_type": "collections",
                     "db_type": "mongodb",
@@ -630,7 +792,9 @@ async def explore_database(request: ExploreRequest):
                     "data": collections
                 }
             elif db_type == "firebase":
-                nodes = get_firebase_nodes()
+                nodes = schema_catalog.list_tables("firebase")
+                if not nodes:
+                    nodes = get_firebase_nodes()
                 return {
                     "exploration_type": "nodes",
                     "db_type": "firebase",
@@ -638,7 +802,9 @@ async def explore_database(request: ExploreRequest):
                     "data": nodes
                 }
             else:  # Default to MySQL
-                tables = get_mysql_tables()
+                tables = schema_catalog.list_tables("mysql")
+                if tables is None:
+                    tables = get_mysql_tables()
                 return {
                     "exploration_type": "tables",
                     "db_type": "mysql",
@@ -657,12 +823,15 @@ async def explore_database(request: ExploreRequest):
             if db_type == "mongodb":
                 # Allow any collection name in MongoDB
                 try:
-                    schema = get_mongodb_schema(table_name)
+                    schema = schema_catalog.table_schema("mongodb", table_name)
+                    if schema is None:
+                        schema = get_mongodb_schema(table_name)
                     return {
                         "exploration_type": "schema",
                         "db_type": "mongodb",
                         "message": f"Schema for collection '{table_name}'",
-                        "data": schema
+                        "data": schema,
+                        "row_count": schema_catalog.row_count("mongodb", table_name)
                     }
                 except Exception as e:
                     return {
@@ -671,12 +840,15 @@ async def explore_database(request: ExploreRequest):
                     }
             elif db_type == "firebase":
                 try:
-                    schema = get_firebase_schema(table_name)
+                    schema = schema_catalog.table_schema("firebase", table_name)
+                    if schema is None:
+                        schema = get_firebase_schema(table_name)
                     return {
                         "exploration_type": "schema",
                         "db_type": "firebase",
                         "message": f"Schema for Firebase path '{table_name}'",
-                        "data": schema
+                        "data": schema,
+                        "row_count": schema_catalog.row_count("firebase", table_name)
                     }
                 except Exception as e:
                     return {
@@ -684,18 +856,21 @@ async def explore_database(request: ExploreRequest):
                         "message": f"Error accessing Firebase path '{table_name}': {str(e)}"
                     }
             else:  # Default to MySQL
-                if not validate_table_exists(table_name):
-                    return {
-                        "exploration_type": "error",
-                        "message": f"Table '{table_name}' does not exist"
-                    }
-                    
-                schema = get_table_schema(table_name)
+                schema = schema_catalog.table_schema("mysql", table_name)
+                if schema is None:
+                    # Not in the catalogue yet (or created since the last refresh), ask MySQL directly
+                    if not validate_table_exists(table_name):
+                        return {
+                            "exploration_type": "error",
+                            "message": f"Table '{table_name}' does not exist"
+                        }
+                    schema = get_table_schema(table_name)
                 return {
                     "exploration_type": "schema",
                     "db_type": "mysql",
                     "message": f"Schema for table '{table_name}'",
-                    "data": schema
+                    "data": schema,
+                    "row_count": schema_catalog.row_count("mysql", table_name)
                 }
             
         elif query_type == "SAMPLE_DATA":
@@ -757,21 +932,327 @@ async def explore_database(request: ExploreRequest):
             
         else:
             # If not a schema exploration query, process as a general query
-            return await process_query(QueryRequest(query=request.query, db_type=db_type))
+            return process_query(QueryRequest(query=request.query, db_type=db_type))
             
+    except (Overloaded, CircuitOpen):
+        raise
     except Exception as e:
         print(f"Exploration error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def stream_mongodb_response(converted_queries: Dict[str, Any], mongo_query: Any) -> StreamingResponse:
+
+    # Passthrough mode for MongoDB-only queries: the cursor returns RawBSONDocument rows
+    # and each one is decoded and written just before it is sent, batch by batch, so the full
+    # result is never held, as BSON or as Python dicts. "merged" is left out since it would
+    # repeat every row.
+
+    raw_docs = stream_mongodb(mongo_query)
+    head = dumps({"converted_queries": converted_queries})[:-1] + b',"results":{"mongodb":'
+
+    def body():
+        yield head
+        yield from iter_json_array(raw_docs)
+        yield b"}}"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+def stream_mysql_response(converted_queries: Dict[str, Any], sql_query: str) -> StreamingResponse:
+
+    # Streaming mode for MySQL-only queries: chunks of rows flow from the unbuffered cursor
+    # through the encoder into the response. The byte cap is checked on the encoded output;
+    # closing the chunk generator early kills the query on the server.
+    # "truncated" reports whether the row or byte cap cut the result short.
+
+    stream = MySQLStream(sql_query)
+    chunks = stream.chunks()
+    with stage("mysql", desc="first chunk", backend="mysql"):
+        first_chunk = next(chunks, None)  # runs the query now, so SQL errors still become a 500 response
+    head = dumps({"converted_queries": converted_queries})[:-1] + b',"results":{"mysql":['
+    max_bytes = MYSQL_STREAM_CONFIG["max_bytes"]
+
+    def body():
+        yield head
+        bytes_sent = 0
+        separator = b""
+        chunk = first_chunk
+        try:
+            while chunk is not None:
+                encoded = dumps(chunk)[1:-1]
+                if bytes_sent + len(encoded) > max_bytes:
+                    stream.truncated = True
+                    break
+                yield separator + encoded
+                bytes_sent += len(encoded)
+                separator = b","
+                chunk = next(chunks, None)
+        finally:
+            chunks.close()
+        yield b']},"truncated":' + (b"true" if stream.truncated else b"false") + b"}"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+def merge_result_refs(results: Dict[str, Any]) -> Dict[str, List[Optional[int]]]:
+
+    # Joins MySQL and MongoDB rows on the listing id (MySQL "id" = MongoDB "_id"), plus the
+    # Firebase row with the same id when there is one. Returns, per backend, the index of the
+    # source row for each merged row (None where Firebase has no match), so the merged rows
+    # can be built from, or in the columnar format point at, the per-backend results.
+
+    if not (results.get("mysql") and results.get("mongodb")):
+        return {}
+    mysql_index = {str(item["id"]): i for i, item in enumerate(results["mysql"]) if "id" in item}
+    fb_index = {}
+    if results.get("firebase"):
+        for i, item in enumerate(results["firebase"]):
+            fb_index.setdefault(str(item.get("id", "")), i)
+    refs = {"mysql": [], "mongodb": [], "firebase": []}
+    for mongo_idx, mongo_item in enumerate(results["mongodb"]):
+        mongo_id = str(mongo_item.get("_id", ""))
+        if mongo_id in mysql_index:
+            refs["mysql"].append(mysql_index[mongo_id])
+            refs["mongodb"].append(mongo_idx)
+            refs["firebase"].append(fb_index.get(mongo_id))
+    return refs if refs["mysql"] else {}
+
+def build_merged_rows(results: Dict[str, Any], merged_refs: Dict[str, List[Optional[int]]]) -> List[Dict[str, Any]]:
+
+    # Builds each merged row from the source rows merge_result_refs matched;
+    # later backends win on shared keys (mysql < mongodb < firebase).
+
+    mysql_rows, mongo_rows, firebase_rows = results.get("mysql"), results.get("mongodb"), results.get("firebase")
+    merged_results = []
+    for mysql_idx, mongo_idx, fb_idx in zip(merged_refs["mysql"], merged_refs["mongodb"], merged_refs["firebase"]):
+        merged_item = {**mysql_rows[mysql_idx], **mongo_rows[mongo_idx]}
+        if fb_idx is not None:
+            merged_item.update(firebase_rows[fb_idx])
+        merged_results.append(merged_item)
+    return merged_results
+
+def query_response(
+    request: QueryRequest,
+    converted_queries: Dict[str, Any],
+    results: Dict[str, Any],
+    merged_refs: Optional[Dict[str, List[Optional[int]]]] = None,
+    merged_source: Optional[str] = None,
+    degraded: Optional[Dict[str, str]] = None) -> FastJSONResponse:
+
+    # Encodes /query results in the requested format. The columnar format references
+    # merged rows by source index instead of repeating them.
+    # "degraded" lists the backends that were skipped, so the results are partial.
+    # "freshness" says whether Firebase results came from the live mirror and how current it is.
+
+    with stage("encode"):
+        if request.format == "columnar":
+            body = {"converted_queries": converted_queries, "format": "columnar",
+                    "results": columnar_results(results, merged_refs, merged_source)}
+        else:
+            body = {"converted_queries": converted_queries, "results": results}
+        if degraded:
+            body["degraded"] = degraded
+        if "firebase" in results:
+            body["freshness"] = {"firebase": firebase_mirror.freshness("listings")}
+        return FastJSONResponse(body)
+
+def overlay_pending_writes(results: Dict[str, Any]) -> None:
+    # Read-your-writes: rows with write-behind writes that are not applied yet show the written values
+    for backend in ("mysql", "mongodb", "firebase"):
+        if backend in results:
+            results[backend] = write_journal.overlay(backend, results[backend])
+
+def call_backend(backend: str, degraded: Dict[str, str], query_fn: Callable, *args, **kwargs) -> Optional[Any]:
+
+    # Runs one backend call of a multi-backend /query. When the backend is unavailable
+    # (circuit open, or an outage error) the reason is added to `degraded` and None is
+    # returned; any other error propagates as before.
+
+    try:
+        return query_fn(*args, **kwargs)
+    except Exception as e:
+        reason = outage_reason(e)
+        if reason is None:
+            raise
+        logger.warning("Skipping %s: %s", backend, reason)
+        degraded[backend] = reason
+        return None
+
+def pushdown_mysql_ids(mysql_query: str, listing_ids: List[Any]) -> str:
+
+    # Inserts an `id IN (...)` filter for the given listing ids into a MySQL query.
+    # An empty list matches nothing.
+
+    if not listing_ids:
+        ids_sql = "NULL"
+    elif all(isinstance(id, int) for id in listing_ids):
+        ids_sql = ", ".join(str(id) for id in listing_ids)
+    else:
+        ids_sql = ", ".join(f"'{id}'" for id in listing_ids)
+    
+    if " WHERE " in mysql_query.upper():
+        return mysql_query.replace(" WHERE ", f" WHERE id IN ({ids_sql}) AND ", 1)
+    elif " LIMIT " in mysql_query.upper():
+        return mysql_query.replace(" LIMIT ", f" WHERE id IN ({ids_sql}) LIMIT ", 1)
+    elif ";" in mysql_query:
+        return mysql_query.replace(";", f" WHERE id IN ({ids_sql});", 1)
+    else:
+        return f"{mysql_query} WHERE id IN ({ids_sql})"
+
+def restrict_to_listings(converted_queries: Dict[str, Any], listing_ids: List[Any]) -> None:
+
+    # Restricts the MySQL, MongoDB and Firebase queries of a converted query to the given
+    # listings. Restrictions combine, so a near query and a text search both apply.
+
+    with stage("pushdown"):
+        if isinstance(converted_queries.get("mysql"), str) and converted_queries["mysql"].strip():
+            converted_queries["mysql"] = pushdown_mysql_ids(converted_queries["mysql"], listing_ids)
+
+        mongo_query = converted_queries.get("mongodb")
+        if isinstance(mongo_query, str):
+            try:
+                mongo_query = json.loads(mongo_query)
+            except json.JSONDecodeError:
+                mongo_query = None
+        if isinstance(mongo_query, dict):
+            id_field = "listing_id" if mongo_query.get("collection") in ["amenities", "media"] else "_id"
+            id_filter = {id_field: {"$in": listing_ids}}
+            if isinstance(mongo_query.get("aggregate"), list):
+                mongo_query["aggregate"] = [{"$match": id_filter}] + mongo_query["aggregate"]
+            else:
+                mongo_filter = mongo_query.get("filter") or {}
+                mongo_query["filter"] = {"$and": [mongo_filter, id_filter]} if id_field in mongo_filter else {**mongo_filter, **id_filter}
+            converted_queries["mongodb"] = mongo_query
+
+        firebase_query = converted_queries.get("firebase")
+        if isinstance(firebase_query, str):
+            try:
+                firebase_query = json.loads(firebase_query)
+            except json.JSONDecodeError:
+                firebase_query = None
+        # A converted query without a Firebase query (absent or "") does not get one
+        if isinstance(firebase_query, dict):
+            keys = [str(listing_id) for listing_id in listing_ids]
+            if isinstance(firebase_query.get("keys"), list):
+                allowed = {str(key) for key in firebase_query["keys"]}
+                keys = [key for key in keys if key in allowed]
+            converted_queries["firebase"] = {**firebase_query, "keys": keys}
+
+def restrict_to_near(converted_queries: Dict[str, Any]) -> Optional[Dict[str, float]]:
+
+    # Resolves the optional "near" object of a converted query (see geo_index.py) and restricts
+    # the backend queries to the listings found. Returns the distance in km of each listing
+    # found by id, or None when the query has no "near" object.
+
+    if not converted_queries.get("near"):
+        return None
+    near = parse_near(converted_queries["near"])
+    found, source = find_near(near)
+    converted_queries["near"] = {**near, "source": source, "matches": len(found)}
+    restrict_to_listings(converted_queries, [listing_id for _, listing_id in found])
+    return {str(listing_id): round(distance / 1000, 3) for distance, listing_id in found}
+
+def restrict_to_search(converted_queries: Dict[str, Any]) -> Optional[Dict[str, float]]:
+
+    # Resolves the optional "search" object of a converted query (see text_index.py) and
+    # restricts the backend queries to the listings found. Returns the relevance of each
+    # listing found by id, or None when the query has no "search" object.
+
+    if not converted_queries.get("search"):
+        return None
+    search = parse_search(converted_queries["search"])
+    found, source = find_text(search)
+    converted_queries["search"] = {**search, "source": source, "matches": len(found)}
+    restrict_to_listings(converted_queries, [listing_id for _, listing_id in found])
+    return {str(listing_id): round(score, 4) for score, listing_id in found}
+
+def restrict_to_amenities(converted_queries: Dict[str, Any]) -> Optional[AmenityMatch]:
+
+    # Resolves the optional "amenities" filter of a converted query (see amenity_index.py).
+    # Up to max_pushdown matching listings are pushed into the backend queries by id; a larger
+    # match is returned instead, for filter_to_amenities to apply to the backend rows.
+
+    if not converted_queries.get("amenities"):
+        return None
+    spec = parse_amenities(converted_queries["amenities"])
+    match, source = find_amenities(spec)
+    converted_queries["amenities"] = {**spec, "source": source, "matches": match.count}
+    if match.listing_ids is not None:
+        restrict_to_listings(converted_queries, match.listing_ids)
+        return None
+    return match
+
+def filter_to_amenities(results: Dict[str, Any], match: Optional[AmenityMatch]) -> None:
+    # Drops listing rows outside a match too large to push down; rows without a listing id (e.g. aggregates) stay
+    if match is None:
+        return
+    with stage("amenity_filter"):
+        for backend, id_fields in (("mysql", ("id",)), ("mongodb", ("listing_id", "_id")), ("firebase", ("id",))):
+            if isinstance(results.get(backend), list):
+                kept = []
+                for row in results[backend]:
+                    listing_id = next((row[field] for field in id_fields if isinstance(row, dict) and row.get(field) is not None), None)
+                    if listing_id is None or match.contains(listing_id):
+                        kept.append(row)
+                results[backend] = kept
+
+def answer_from_aggregates(converted_queries: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+
+    # Resolves the optional "aggregate" object of a converted query (see aggregate_store.py).
+    # Returns its rows, or None when the base stores must answer: there is no "aggregate" object,
+    # the query also filters listings by place, keywords or amenities, or the table is not built yet.
+
+    if not converted_queries.get("aggregate"):
+        return None
+    spec = parse_aggregate(converted_queries["aggregate"])
+    if any(converted_queries.get(key) for key in ("near", "search", "amenities")):
+        rows = None
+    else:
+        rows = find_aggregates(spec)
+    converted_queries["aggregate"] = {**spec, "source": "aggregate_store" if rows is not None else "base_stores"}
+    return rows
+
+def order_by_rank(rows: List[Dict[str, Any]], ranks: Dict[str, float], field: str, descending: bool = False) -> List[Dict[str, Any]]:
+    # Ranked listings first, each with its rank under `field`; rows that are not listings (e.g. aggregates) come last
+    placed = []
+    for row in rows:
+        rank = ranks.get(str(row.get("id", row.get("_id"))))
+        placed.append((rank is None, -rank if descending and rank is not None else rank or 0.0,
+                       row if rank is None else {**row, field: rank}))
+    placed.sort(key=lambda entry: entry[:2])
+    return [row for _, _, row in placed]
+
+def order_merged(rows: List[Dict[str, Any]], distances: Optional[Dict[str, float]],
+                 relevance: Optional[Dict[str, float]]) -> List[Dict[str, Any]]:
+    # Most relevant first for a text search, nearest first for a near query (distance decides when both)
+    if relevance is not None:
+        rows = order_by_rank(rows, relevance, "relevance", descending=True)
+    if distances is not None:
+        rows = order_by_rank(rows, distances, "distance_km")
+    return rows
+
 @app.post("/query")
-async def process_query(request: QueryRequest):
+def process_query(request: QueryRequest):
+    # A plain def endpoint runs in the threadpool, so a request blocked on Gemini or a
+    # database does not hold up the event loop; admission.py bounds the concurrency.
+    # Results are encoded in a single pass by FastJSONResponse (ObjectId, Decimal, dates and NaN included),
+    # so the MongoDB rows skip convert_objectid_to_str and FastAPI skips jsonable_encoder
+    set_nl_query(request.query)
     try:
         converted_queries = convert_nl_to_query(request.query)
         if not converted_queries:
-            return {
+            return FastJSONResponse({
                 "message": "No valid queries could be generated for this request.",
                 "converted_queries": {}
-            }
+            })
+        # Per-neighbourhood statistics come from the aggregate table, without querying the base stores
+        aggregate_rows = answer_from_aggregates(converted_queries)
+        if aggregate_rows is not None:
+            return query_response(request, converted_queries, {"aggregate": aggregate_rows, "merged": aggregate_rows},
+                                  merged_source="aggregate")
+        # Listings near a place (geo index), matching keywords (text index) or with the requested
+        # amenities (amenity index) are found first, then every backend query is restricted to them
+        distances = restrict_to_near(converted_queries)
+        relevance = restrict_to_search(converted_queries)
+        amenity_match = restrict_to_amenities(converted_queries)
         
         results = {}
         nl_lower = request.query.lower()
@@ -780,6 +1261,9 @@ async def process_query(request: QueryRequest):
         if request.db_type:
             # Only query the specified database type
             if request.db_type == "mysql" and "mysql" in converted_queries:
+                # Streamed rows are not post-filtered, so an amenity match too large to push down is not streamed
+                if request.stream and amenity_match is None:
+                    return stream_mysql_response(converted_queries, converted_queries["mysql"])
                 results["mysql"] = query_mysql(converted_queries["mysql"])
             elif request.db_type == "mongodb" and "mongodb" in converted_queries:
                 mongo_query = converted_queries["mongodb"]
@@ -788,7 +1272,9 @@ async def process_query(request: QueryRequest):
                         mongo_query = json.loads(mongo_query)
                     except json.JSONDecodeError:
                         mongo_query = {}
-                results["mongodb"] = query_mongodb(mongo_query)
+                if request.raw_bson and amenity_match is None:
+                    return stream_mongodb_response(converted_queries, mongo_query)
+                results["mongodb"] = query_mongodb(mongo_query, convert=False)
             elif request.db_type == "firebase" and "firebase" in converted_queries:
                 firebase_query = converted_queries["firebase"]
                 if isinstance(firebase_query, str):
@@ -800,15 +1286,23 @@ async def process_query(request: QueryRequest):
                 if fb_result is not None:
                     results["firebase"] = fb_result
             
+            filter_to_amenities(results, amenity_match)
+            overlay_pending_writes(results)
             # Add the requested database results to merged results
             if request.db_type in results and results[request.db_type]:
                 results["merged"] = results[request.db_type]
+                merged_source = request.db_type
             else:
                 results["merged"] = []
+                merged_source = None
+            if request.format != "columnar":
+                results["merged"] = order_merged(results["merged"], distances, relevance)
                 
-            return {"converted_queries": converted_queries, "results": results}
+            return query_response(request, converted_queries, results, merged_source=merged_source)
             
-        # If no specific db_type was provided, continue with the original logic
+        # If no specific db_type was provided, continue with the original logic.
+        # A backend that is down (or whose circuit is open) is skipped and reported in "degraded"
+        degraded = {}
         if "firebase" in converted_queries:
             firebase_query = converted_queries["firebase"]
             if isinstance(firebase_query, str):
@@ -816,42 +1310,31 @@ async def process_query(request: QueryRequest):
                     firebase_query = json.loads(firebase_query)
                 except json.JSONDecodeError:
                     firebase_query = None
-            fb_result = query_firebase("listings", firebase_query)
+            fb_result = call_backend("firebase", degraded, query_firebase, "listings", firebase_query)
             if fb_result is not None:
                 results["firebase"] = fb_result
                 
                 listing_ids = []
-                for item in fb_result:
-                    if "id" in item and item["id"] is not None:
-                        try:
-                            listing_ids.append(int(item["id"]))
-                        except (ValueError, TypeError):
-                            listing_ids.append(str(item["id"]).strip())
+                with stage("pushdown"):
+                    for item in fb_result:
+                        if "id" in item and item["id"] is not None:
+                            try:
+                                listing_ids.append(int(item["id"]))
+                            except (ValueError, TypeError):
+                                listing_ids.append(str(item["id"]).strip())
                 
                 if listing_ids:
                     if "mysql" in converted_queries:
                         mysql_query = converted_queries["mysql"]
                         
                         if listing_ids:
-                            if all(isinstance(id, int) for id in listing_ids):
-                                ids_sql = ", ".join(str(id) for id in listing_ids)
-                            else:
-                                ids_sql = ", ".join(f"'{id}'" for id in listing_ids)
-                            
-                            # Insert the listing_ids filter into the MySQL query
-                            if " WHERE " in mysql_query.upper():
-                                mysql_query = mysql_query.replace(" WHERE ", f" WHERE id IN ({ids_sql}) AND ", 1)
-                            elif " LIMIT " in mysql_query.upper():
-                                mysql_query = mysql_query.replace(" LIMIT ", f" WHERE id IN ({ids_sql}) LIMIT ", 1)
-                            elif ";" in mysql_query:
-                                mysql_query = mysql_query.replace(";", f" WHERE id IN ({ids_sql});", 1)
-                            else:
-                                mysql_query = f"{mysql_query} WHERE id IN ({ids_sql})"
+                            with stage("pushdown"):
+                                mysql_query = pushdown_mysql_ids(mysql_query, listing_ids)
                         
                         try:
-                            results["mysql"] = query_mysql(mysql_query)
+                            results["mysql"] = call_backend("mysql", degraded, query_mysql, mysql_query) or []
                         except Exception as e:
-                            print(f"MySQL query error: {str(e)}")
+                            logger.error("MySQL query error: %s", e)
                             results["mysql"] = []
                         
                     if "mongodb" in converted_queries:
@@ -868,21 +1351,22 @@ async def process_query(request: QueryRequest):
                                 
                                 # Filter MongoDB query by listing_ids, handling collection-specific keys
                                 if listing_ids:
-                                    if "filter" in mongo_query:
-                                        mongo_query["filter"]["_id"] = {"$in": listing_ids}
-                                    else:
-                                        mongo_query["filter"] = {"_id": {"$in": listing_ids}}
-                                        
-                                    if collection in ["amenities", "media"]:
-                                        mongo_query["filter"]["listing_id"] = {"$in": listing_ids}
-                                        if "_id" in mongo_query["filter"]:
-                                            del mongo_query["filter"]["_id"]
+                                    with stage("pushdown"):
+                                        if "filter" in mongo_query:
+                                            mongo_query["filter"]["_id"] = {"$in": listing_ids}
+                                        else:
+                                            mongo_query["filter"] = {"_id": {"$in": listing_ids}}
+                                            
+                                        if collection in ["amenities", "media"]:
+                                            mongo_query["filter"]["listing_id"] = {"$in": listing_ids}
+                                            if "_id" in mongo_query["filter"]:
+                                                del mongo_query["filter"]["_id"]
                             
-                            print(f"MongoDB query: {json.dumps(mongo_query, default=str)}")
-                            results["mongodb"] = query_mongodb(mongo_query)
-                            print(f"MongoDB results count: {len(results['mongodb'])}")
+                            logger.debug("MongoDB query: %s", lazy_json(mongo_query))
+                            results["mongodb"] = call_backend("mongodb", degraded, query_mongodb, mongo_query, convert=False) or []
+                            logger.debug("MongoDB results count: %s", len(results['mongodb']))
                         except Exception as e:
-                            print(f"MongoDB query error: {str(e)}")
+                            logger.error("MongoDB query error: %s", e)
                             results["mongodb"] = []
         
         if not results.get("firebase") or not listing_ids:
@@ -900,14 +1384,18 @@ async def process_query(request: QueryRequest):
                 query_firebase_needed = False
 
             if query_mysql_needed and "mysql" in converted_queries:
-                results["mysql"] = query_mysql(converted_queries["mysql"])
+                mysql_rows = call_backend("mysql", degraded, query_mysql, converted_queries["mysql"])
+                if mysql_rows is not None:
+                    results["mysql"] = mysql_rows
             
             if query_mongodb_needed and "mongodb" in converted_queries:
                 try:
                     mongo_query = converted_queries["mongodb"]
                     if isinstance(mongo_query, str):
                         mongo_query = json.loads(mongo_query)
-                    results["mongodb"] = query_mongodb(mongo_query)
+                    mongo_rows = call_backend("mongodb", degraded, query_mongodb, mongo_query, convert=False)
+                    if mongo_rows is not None:
+                        results["mongodb"] = mongo_rows
                 except json.JSONDecodeError:
                     results["mongodb"] = []
             
@@ -918,38 +1406,31 @@ async def process_query(request: QueryRequest):
                         firebase_query = json.loads(firebase_query)
                     except json.JSONDecodeError:
                         firebase_query = None
-                fb_result = query_firebase("listings", firebase_query)
+                fb_result = call_backend("firebase", degraded, query_firebase, "listings", firebase_query)
                 if fb_result is not None:
                     results["firebase"] = fb_result
         
-        merged_results = []
-        # Merge results from MySQL and MongoDB using listing id as the join key
-        if "mysql" in results and "mongodb" in results and results["mysql"] and results["mongodb"]:
-            mysql_data = {str(item["id"]): item for item in results["mysql"] if "id" in item}
-            for mongo_item in results["mongodb"]:
-                mongo_id = str(mongo_item.get("_id", ""))
-                if mongo_id in mysql_data:
-                    merged_item = {**mysql_data[mongo_id], **mongo_item}
-                    if "firebase" in results:
-                        fb_item = next((item for item in results["firebase"] if str(item.get("id", "")) == mongo_id), None)
-                        if fb_item:
-                            merged_item.update(fb_item)
-                    merged_results.append(merged_item)
-
-        # Prefer merged results if available, otherwise fallback to the most complete single source
-        if merged_results:
-            results["merged"] = merged_results
-        else:
-            if "firebase" in results and results["firebase"]:
-                results["merged"] = results["firebase"]
-            elif "mysql" in results and results["mysql"]:
-                results["merged"] = results["mysql"] 
-            elif "mongodb" in results and results["mongodb"]:
-                results["merged"] = results["mongodb"]
+        filter_to_amenities(results, amenity_match)
+        overlay_pending_writes(results)
+        with stage("merge"):
+            merged_refs = merge_result_refs(results)
+            merged_source = None
+            # Prefer merged results if available, otherwise fallback to the most complete single source
+            if merged_refs:
+                # The columnar format only sends the row indexes, so the merged rows are not built for it
+                results["merged"] = build_merged_rows(results, merged_refs) if request.format != "columnar" else []
             else:
-                results["merged"] = []
+                for backend in ("firebase", "mysql", "mongodb"):
+                    if backend in results and results[backend]:
+                        merged_source = backend
+                        break
+                results["merged"] = results[merged_source] if merged_source else []
+            if request.format != "columnar":
+                results["merged"] = order_merged(results["merged"], distances, relevance)
         
-        return {"converted_queries": converted_queries, "results": results}
+        return query_response(request, converted_queries, results, merged_refs, merged_source, degraded)
+    except (Overloaded, CircuitOpen, InvalidNearQuery, InvalidSearchQuery, InvalidAmenityQuery, InvalidAggregateQuery):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1086,16 +1567,23 @@ def convert_nl_to_modification(nl_modification: str) -> dict:
         "key": "<string id>",
         "data": {{…}}        // for insert/update
         }}
+    • To modify several listings at once, replace "key" with one of:
+        "keys": ["<id>", ...]                   // explicit ids
+        "where": {{ "pricing": {{ "price": {{ "$gt": 200 }} }} }}   // Firebase fields (pricing/availability), $lt/$lte/$gt/$gte/$eq/$ne/$in/$between
+        "where_sql": "SELECT id FROM Listings WHERE ..."          // predicates on MySQL columns (neighbourhood, room type, ...)
+    • For relative changes ("raise cleaning_fee by 10"), use "operation": "update" with
+        "increment": {{ "cleaning_fee": 10 }} (negative to decrease) instead of "data".
     • If Firebase isn't affected, set `"firebase":""`.
         
         Now, convert the following natural language modification command:
     '{nl_modification}'
     """
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt,
-    )
+    with admit("gemini"), stage("llm_modify"):
+        response = client.models.generate_content(
+            model="gemini-2.0-flash",
+            contents=prompt,
+        )
     if not response or not response.candidates:
         return {}
     candidate = response.candidates[0]
@@ -1105,20 +1593,102 @@ def convert_nl_to_modification(nl_modification: str) -> dict:
 
     try:
         clean_modifications = json.loads(remove_code_fences(generated_modifications))
-        print(f"Generated modifications: {clean_modifications}")
+        logger.debug("Generated modifications: %s", clean_modifications)
         return clean_modifications if isinstance(clean_modifications, dict) else {}
     except json.JSONDecodeError:
-        print("Invalid JSON from AI (modification):", generated_modifications)
+        logger.error("Invalid JSON from AI (modification): %s", generated_modifications)
         return {}
 
+def parse_mongodb_modification(mongo_mod_val: Any) -> tuple:
+
+    # Parses a MongoDB modification (JSON string or dict) into (collection, modification),
+    # inferring a missing "operation" from the fields present.
+
+    if isinstance(mongo_mod_val, str):
+        try:
+            logger.debug("Parsing MongoDB modification from string: %s", mongo_mod_val)
+            mongo_mod = json.loads(mongo_mod_val)
+        except json.JSONDecodeError as ex:
+            logger.error("Error parsing MongoDB JSON: %s", ex)
+            raise HTTPException(400, f"Bad MongoDB mod JSON: {ex}")
+    elif isinstance(mongo_mod_val, dict):
+        mongo_mod = mongo_mod_val
+    else:
+        logger.warning("Unexpected MongoDB modification type: %s", type(mongo_mod_val))
+        raise HTTPException(400, "Unsupported MongoDB mod format.")
+    
+    # If the operation type is missing, try to infer it from the fields
+    if "operation" not in mongo_mod:
+        logger.warning("Adding missing 'operation' field to MongoDB modification")
+        if "document" in mongo_mod or "documents" in mongo_mod:
+            mongo_mod["operation"] = "insert"
+        elif "update" in mongo_mod:
+            mongo_mod["operation"] = "update"
+        elif "filter" in mongo_mod:
+            mongo_mod["operation"] = "delete"
+        else:
+            raise HTTPException(400, "Cannot determine MongoDB operation type")
+
+    collection = "listings_meta"
+    # Use a different collection if specified
+    if "collection" in mongo_mod:
+        collection = mongo_mod.pop("collection")
+    return collection, mongo_mod
+
+def parse_firebase_modification(fb_mod_val: Any) -> Dict[str, Any]:
+    if isinstance(fb_mod_val, str):
+        try:
+            return json.loads(fb_mod_val)
+        except json.JSONDecodeError as ex:
+            raise HTTPException(400, f"Bad Firebase mod JSON: {ex}")
+    elif isinstance(fb_mod_val, dict):
+        return fb_mod_val
+    raise HTTPException(400, "Unsupported Firebase mod format.")
+
+def firebase_target_keys(firebase_mod: Dict[str, Any]) -> Optional[List[str]]:
+
+    # Explicit "keys" of a Firebase modification plus the listing ids selected by "where_sql",
+    # a MySQL SELECT for predicates Firebase does not store (neighbourhood, room type, ...).
+    # None when the modification targets a single key or a Firebase "where".
+
+    keys = firebase_mod.get("keys")
+    where_sql = firebase_mod.get("where_sql")
+    if not where_sql:
+        return keys
+    if not isinstance(where_sql, str) or not re.match(r"\s*select\b", where_sql, re.IGNORECASE):
+        raise HTTPException(400, "where_sql must be a SELECT statement")
+    rows = query_mysql(where_sql.strip().rstrip(";"))
+    ids = [str(row.get("id", next(iter(row.values())))) for row in rows if row]
+    return list(keys or []) + ids
+
+def apply_firebase_modification(firebase_mod: Dict[str, Any]) -> Dict[str, Any]:
+    return modify_firebase(
+        "listings",
+        firebase_mod.get("key", ""),
+        firebase_mod.get("operation"),
+        firebase_mod.get("data", {}),
+        keys=firebase_target_keys(firebase_mod),
+        where=firebase_mod.get("where"),
+        increment=firebase_mod.get("increment")
+    )
+
+def mysql_modification_statements(mysql_mod: Any) -> List[str]:
+    # Statements of a MySQL modification given as one string (split on ";") or a list
+    if isinstance(mysql_mod, str):
+        return [stmt.strip() for stmt in mysql_mod.split(";") if stmt.strip()]
+    if isinstance(mysql_mod, (list, tuple)):
+        return [stmt.strip() for stmt in mysql_mod if isinstance(stmt, str) and stmt.strip()]
+    return []
+
 @app.post("/modify")
-async def process_modification(request: ModificationRequest):
+def process_modification(request: ModificationRequest):
+    set_nl_query(request.modification)
     try:
-        print(f"Processing modification request: {request.modification}")
+        logger.debug("Processing modification request: %s", request.modification)
         converted_modifications = convert_nl_to_modification(request.modification)
         db_choice = request.db_type.lower() if request.db_type else None
-        print(f"Selected database type: {db_choice}")
-        print(f"Converted modifications: {converted_modifications}")
+        logger.debug("Selected database type: %s", db_choice)
+        logger.debug("Converted modifications: %s", converted_modifications)
 
         if not converted_modifications:
             return {
@@ -1132,7 +1702,10 @@ async def process_modification(request: ModificationRequest):
             if db_choice in converted_modifications and converted_modifications[db_choice]:
                 filtered_mods[db_choice] = converted_modifications[db_choice]
             converted_modifications = filtered_mods
-            print(f"Filtered modifications for {db_choice}: {converted_modifications}")
+            logger.debug("Filtered modifications for %s: %s", db_choice, converted_modifications)
+
+        if request.write_behind:
+            return queue_write_behind(converted_modifications)
 
         results = {}
 
@@ -1140,11 +1713,12 @@ async def process_modification(request: ModificationRequest):
         if "mysql" in converted_modifications:
             mysql_mod = converted_modifications["mysql"]
             if isinstance(mysql_mod, str) and mysql_mod.strip():
-                print(f"Executing MySQL modification: {mysql_mod}")
+                logger.debug("Executing MySQL modification: %s", mysql_mod)
                 # Ensure MySQL statements are properly formatted
                 if not mysql_mod.strip().endswith(';'):
                     mysql_mod = mysql_mod.strip() + ';'
                 results["mysql"] = modify_mysql(mysql_mod)
+                replicate_shared_fields(mysql_modification_statements(mysql_mod))
             elif isinstance(mysql_mod, (list, tuple)) and mysql_mod:
                 # Format and execute each statement in a batch
                 formatted_stmts = []
@@ -1155,72 +1729,36 @@ async def process_modification(request: ModificationRequest):
                         formatted_stmts.append(stmt)
                 
                 if formatted_stmts:
-                    print(f"Executing MySQL modifications (multiple): {formatted_stmts}")
+                    logger.debug("Executing MySQL modifications (multiple): %s", formatted_stmts)
                     results["mysql"] = modify_mysql(formatted_stmts)
+                    replicate_shared_fields(formatted_stmts)
                 else:
-                    print("No valid MySQL statements after formatting")
+                    logger.warning("No valid MySQL statements after formatting")
                     results["mysql"] = {"message": "No valid MySQL modification statements"}
             else:
-                print(f"Skipping MySQL modification - invalid format: {type(mysql_mod)}")
-                print(f"Value: {mysql_mod}")
+                logger.debug("Skipping MySQL modification - invalid format: %s (value: %r)", type(mysql_mod), mysql_mod)
                 results["mysql"] = {"message": "No valid MySQL modification provided"}
 
         # MongoDB: executes modification instructions on the specified collection
         if "mongodb" in converted_modifications:
             mongo_mod_val = converted_modifications.get("mongodb")
             if mongo_mod_val:
-                if isinstance(mongo_mod_val, str):
-                    try:
-                        print(f"Parsing MongoDB modification from string: {mongo_mod_val}")
-                        mongo_mod = json.loads(mongo_mod_val)
-                    except json.JSONDecodeError as ex:
-                        print(f"Error parsing MongoDB JSON: {str(ex)}")
-                        raise HTTPException(400, f"Bad MongoDB mod JSON: {ex}")
-                elif isinstance(mongo_mod_val, dict):
-                    mongo_mod = mongo_mod_val
-                else:
-                    print(f"Unexpected MongoDB modification type: {type(mongo_mod_val)}")
-                    raise HTTPException(400, "Unsupported MongoDB mod format.")
-                
-                # If the operation type is missing, try to infer it from the fields
-                if "operation" not in mongo_mod:
-                    print("Adding missing 'operation' field to MongoDB modification")
-                    if "document" in mongo_mod or "documents" in mongo_mod:
-                        mongo_mod["operation"] = "insert"
-                    elif "update" in mongo_mod:
-                        mongo_mod["operation"] = "update"
-                    elif "filter" in mongo_mod:
-                        mongo_mod["operation"] = "delete"
-                    else:
-                        raise HTTPException(400, "Cannot determine MongoDB operation type")
-
-                collection = "listings_meta"
-                # Use a different collection if specified
-                if "collection" in mongo_mod:
-                    collection = mongo_mod.pop("collection")
-                
-                print(f"Executing MongoDB modification on collection {collection}: {json.dumps(mongo_mod, default=str)}")
+                collection, mongo_mod = parse_mongodb_modification(mongo_mod_val)
+                logger.debug("Executing MongoDB modification on collection %s: %s", collection, lazy_json(mongo_mod))
+                mongo_write = keyed_mongodb_write(collection, mongo_mod)
                 results["mongodb"] = modify_mongodb(mongo_mod, collection)
+                if mongo_write:
+                    replication_log.record([mongo_write])
 
         # Firebase: executes modification on the listings node
         if db_choice is None or db_choice == "firebase":
             fb_mod_val = converted_modifications.get("firebase")
             if fb_mod_val:
-                if isinstance(fb_mod_val, str):
-                    try:
-                        firebase_mod = json.loads(fb_mod_val)
-                    except json.JSONDecodeError as ex:
-                        raise HTTPException(400, f"Bad Firebase mod JSON: {ex}")
-                elif isinstance(fb_mod_val, dict):
-                    firebase_mod = fb_mod_val
-                else:
-                    raise HTTPException(400, "Unsupported Firebase mod format.")
-
-                op  = firebase_mod.get("operation")
-                key = firebase_mod.get("key", "")
-                data = firebase_mod.get("data", {})
-                results["firebase"] = modify_firebase("listings", key, op, data)
+                firebase_mod = parse_firebase_modification(fb_mod_val)
+                results["firebase"] = apply_firebase_modification(firebase_mod)
 
+    except (Overloaded, CircuitOpen, WriteBehindRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1229,5 +1767,220 @@ async def process_modification(request: ModificationRequest):
         "results": results
     }
 
+def replicate_shared_fields(mysql_stmts: List[str]) -> None:
+    # Records the shared fields (see replication_log.py) among applied keyed MySQL updates
+    writes = [write for write in map(keyed_mysql_write, mysql_stmts) if write]
+    if writes:
+        replication_log.record(writes)
+
+def queue_write_behind(converted_modifications: Dict[str, Any]) -> FastJSONResponse:
+
+    # Journals the modifications as keyed writes and acknowledges them with 202. Rejects the
+    # whole request when any part is not a keyed update, so nothing is half-queued.
+
+    if not WRITE_BEHIND_CONFIG["enabled"]:
+        raise WriteBehindRejected("Write-behind is disabled")
+    writes, rejected = [], []
+    candidates = [(keyed_mysql_write(stmt), f"mysql: {stmt}")
+                  for stmt in mysql_modification_statements(converted_modifications.get("mysql"))]
+    if converted_modifications.get("mongodb"):
+        mongo_val = converted_modifications["mongodb"]
+        collection, mongo_mod = parse_mongodb_modification(dict(mongo_val) if isinstance(mongo_val, dict) else mongo_val)
+        candidates.append((keyed_mongodb_write(collection, mongo_mod), "mongodb: not an update of one document by _id"))
+    if converted_modifications.get("firebase"):
+        firebase_mod = parse_firebase_modification(converted_modifications["firebase"])
+        candidates.append((keyed_firebase_write("listings", firebase_mod), "firebase: not an update of one listing by key"))
+    for write, reason in candidates:
+        if write is None:
+            rejected.append(reason)
+        else:
+            writes.append(write)
+    if rejected or not writes:
+        raise WriteBehindRejected(
+            "Only keyed updates can be written behind; send this modification without write_behind. "
+            + "; ".join(rejected or ["no modifications"]))
+    seq = write_journal.append(writes)
+    return FastJSONResponse({
+        "converted_modifications": converted_modifications,
+        "write_behind": {"status": "queued", "seq": seq, "writes": len(writes)}
+    }, status_code=202)
+
+@app.post("/modify/batch")
+def process_modification_batch(request: BatchModificationRequest):
+    # Applies many modifications with one batched call per backend instead of one call per
+    # statement: MySQL executemany in a single transaction, one unordered MongoDB bulk_write
+    # per collection and one Firebase multi-path update. Items are reported one by one, and
+    # each backend with its time and items per second.
+    if not request.items:
+        raise HTTPException(400, "No modifications provided")
+    if len(request.items) > BATCH_MODIFY_CONFIG["max_items"]:
+        raise HTTPException(400, f"At most {BATCH_MODIFY_CONFIG['max_items']} modifications per batch")
+    started = time.perf_counter()
+    items = [{"index": i, "results": {}} for i in range(len(request.items))]
+
+    # Translate the NL items, a few Gemini calls at a time
+    with ThreadPoolExecutor(max_workers=BATCH_MODIFY_CONFIG["translation_workers"]) as pool:
+        translations = {}
+        for i, item in enumerate(request.items):
+            structured = {db: getattr(item, db) for db in ("mysql", "mongodb", "firebase") if getattr(item, db) is not None}
+            if structured:
+                items[i]["converted_modifications"] = structured
+            elif item.modification:
+                translations[i] = pool.submit(contextvars.copy_context().run, convert_nl_to_modification, item.modification)
+            else:
+                items[i]["error"] = "Provide a modification or at least one of mysql, mongodb, firebase"
+        for i, future in translations.items():
+            try:
+                items[i]["converted_modifications"] = future.result() or {}
+            except Exception as e:
+                items[i]["error"] = f"Translation failed: {describe(e)}"
+    translation_seconds = time.perf_counter() - started
+
+    # Group the modifications per backend, remembering which item each one came from
+    mysql_stmts, mysql_owners, mongo_mods, firebase_mods, firebase_fan_outs = [], [], [], [], []
+    for i, entry in enumerate(items):
+        mods = entry.get("converted_modifications")
+        if not mods:
+            continue
+        db_choice = (request.items[i].db_type or request.db_type or "").lower() or None
+        if db_choice:
+            mods = {db_choice: mods[db_choice]} if mods.get(db_choice) else {}
+            entry["converted_modifications"] = mods
+        if mods.get("mysql"):
+            stmts = mysql_modification_statements(mods["mysql"])
+            mysql_stmts.extend(stmts)
+            mysql_owners.extend([i] * len(stmts))
+        try:
+            if mods.get("mongodb"):
+                mongo_val = mods["mongodb"]
+                # Parsing pops "collection"; keep the echoed modification intact
+                collection, mongo_mod = parse_mongodb_modification(dict(mongo_val) if isinstance(mongo_val, dict) else mongo_val)
+                mongo_mods.append((i, collection, mongo_mod))
+        except HTTPException as e:
+            entry["results"]["mongodb"] = {"status": "error", "error": e.detail}
+        try:
+            if mods.get("firebase"):
+                firebase_mod = parse_firebase_modification(mods["firebase"])
+                if any(firebase_mod.get(field) is not None for field in ("keys", "where", "where_sql", "increment")):
+                    # Multi-key modifications are already one fan-out update each
+                    firebase_fan_outs.append((i, firebase_mod))
+                else:
+                    firebase_mods.append((i, firebase_mod.get("operation"), firebase_mod.get("key", ""), firebase_mod.get("data", {})))
+        except HTTPException as e:
+            entry["results"]["firebase"] = {"status": "error", "error": e.detail}
+
+    backends = {}
+
+    def run_backend(backend: str, owners: List[int], call: Callable) -> Optional[Dict[str, Any]]:
+        # Runs one backend's batch; a failure marks all of that backend's items
+        call_started = time.perf_counter()
+        try:
+            summary = call()
+        except Exception as e:
+            summary = None
+            for i in owners:
+                items[i]["results"][backend] = {"status": "error", "error": describe(e)}
+        elapsed = time.perf_counter() - call_started
+        item_count = len(set(owners))
+        backends[backend] = {
+            "items": item_count,
+            "seconds": round(elapsed, 4),
+            "items_per_second": round(item_count / elapsed, 1) if elapsed > 0 else None,
+            "succeeded": summary is not None
+        }
+        return summary
+
+    if mysql_stmts:
+        summary = run_backend("mysql", mysql_owners, lambda: modify_mysql_batch(mysql_stmts))
+        if summary is not None:
+            backends["mysql"].update(summary)
+            replicate_shared_fields(mysql_stmts)
+            for i in set(mysql_owners):
+                items[i]["results"]["mysql"] = {"status": "ok"}
+    if mongo_mods:
+        summary = run_backend("mongodb", [m[0] for m in mongo_mods], lambda: modify_mongodb_batch(mongo_mods))
+        if summary is not None:
+            backends["mongodb"]["collections"] = summary["collections"]
+            for i, _, _ in mongo_mods:
+                error = summary["errors"].get(i)
+                items[i]["results"]["mongodb"] = {"status": "error", "error": error} if error else {"status": "ok"}
+            replication_log.record([
+                write for write in (keyed_mongodb_write(collection, mod) for i, collection, mod in mongo_mods
+                                    if i not in summary["errors"]) if write
+            ])
+    if firebase_mods:
+        summary = run_backend("firebase", [m[0] for m in firebase_mods], lambda: modify_firebase_batch("listings", firebase_mods))
+        if summary is not None:
+            backends["firebase"]["paths"] = summary["paths"]
+            for i, _, _, _ in firebase_mods:
+                error = summary["errors"].get(i)
+                items[i]["results"]["firebase"] = ({"status": "error", "error": error} if error
+                                                   else {"status": "ok", "key": summary["keys"][i]})
+    for i, firebase_mod in firebase_fan_outs:
+        try:
+            result = apply_firebase_modification(firebase_mod)
+            items[i]["results"]["firebase"] = {"status": "ok", "keys": result.get("keys", [result.get("key")])}
+        except Exception as e:
+            items[i]["results"]["firebase"] = {"status": "error", "error": describe(e)}
+
+    total_seconds = time.perf_counter() - started
+    failed = sum(1 for entry in items if entry.get("error") or any(r["status"] == "error" for r in entry["results"].values()))
+    return FastJSONResponse({
+        "items": items,
+        "backends": backends,
+        "summary": {
+            "items": len(items),
+            "failed": failed,
+            "translation_seconds": round(translation_seconds, 4),
+            "total_seconds": round(total_seconds, 4),
+            "items_per_second": round(len(items) / total_seconds, 1) if total_seconds > 0 else None
+        }
+    })
+
+@app.get("/debug/traces")
+def debug_traces(limit: int = 50):
+    # Summaries of the most recent and the slowest sampled traces (see tracing.py)
+    return FastJSONResponse(traces_summary(limit))
+
+@app.get("/debug/traces/{trace_id}")
+def debug_trace(trace_id: str):
+    trace = trace_store.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found (not sampled or already evicted)")
+    return FastJSONResponse(trace.to_dict())
+
+@app.get("/debug/slow-queries")
+def debug_slow_queries(by: str = "total_ms", limit: int = 20, backend: Optional[str] = None):
+    # Slow queries grouped by shape and ranked by total_ms, max_ms, avg_ms or count,
+    # each with its slowest occurrence (plan included) and the NL requests behind it
+    return FastJSONResponse({"ranked_by": by, "queries": slow_query_log.rank(by, limit, backend)})
+
+@app.delete("/debug/slow-queries")
+def clear_slow_queries():
+    slow_query_log.clear()
+    return {"message": "Slow query log cleared"}
+
+@app.get("/debug/write-behind")
+def write_behind_status():
+    # Pending and flushed write-behind writes, flush lag, and the writes the stores rejected
+    return FastJSONResponse({**write_journal.stats(), "dead_letters": list(write_journal.dead_letters)})
+
+@app.get("/debug/replication")
+def replication_status():
+    # Shared-field changes recorded, applied and pending, and the propagation lag
+    return FastJSONResponse(replication_log.stats())
+
+@app.post("/debug/replication/replay")
+def replay_replication(from_seq: int = 1):
+    # Re-applies the replication log from `from_seq` on (idempotent: the logged values are absolute)
+    replication_log.replay(from_seq)
+    return FastJSONResponse({"message": f"Replaying replication log from seq {max(from_seq, 1)}"}, status_code=202)
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape endpoint: request/stage latency histograms, backend errors,
+    # LLM retries and query cache hit ratios
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__": 
     uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,202 @@
+import functools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Type
+
+from fastapi import HTTPException
+
+logger = logging.getLogger("chatdb.circuit")
+
+# Per-backend circuit breakers.
+# A backend that keeps failing with outage errors (connection refused, timeouts, broken
+# credentials) is cut off for a while instead of making every request wait for its timeouts:
+# - closed: calls go through; `failure_threshold` consecutive outages open the circuit
+# - open: calls fail at once with CircuitOpen (503 + Retry-After) for `open_s`
+# - half-open: after that, `half_open_probes` calls are let through as probes. A probe that
+#   reaches the backend closes the circuit; a probe that fails reopens it for twice as long,
+#   up to `max_open_s`
+# Errors of the query itself (bad SQL, invalid filters) mean the backend answered, so they
+# count as successes. Each connector says which errors are outages (is_*_outage).
+# /query keeps answering from the healthy backends while one is open and lists the skipped
+# ones under "degraded".
+
+CIRCUIT_CONFIG = {
+    "failure_threshold": 5,
+    "open_s": 10.0,
+    "max_open_s": 120.0,
+    "half_open_probes": 1
+}
+
+BACKEND_NAMES = {"mysql": "MySQL", "mongodb": "MongoDB", "firebase": "Firebase"}
+
+
+class CircuitOpen(HTTPException):
+
+    # Raised instead of calling a backend whose circuit is open.
+
+    def __init__(self, backend: str, retry_after: int, last_error: Optional[str]):
+        detail = f"{BACKEND_NAMES.get(backend, backend)} is unavailable (circuit open)"
+        if last_error:
+            detail += f": {last_error}"
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(retry_after)})
+        self.backend = backend
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_for = CIRCUIT_CONFIG["open_s"]
+        self.probes = 0
+        self.last_error: Optional[str] = None
+        self.opened_total = 0
+        self.rejected_total = 0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+
+        # Raises CircuitOpen when the call must not go through; returns whether it is a probe.
+
+        with self._lock:
+            if self.state == "closed":
+                return False
+            now = time.monotonic()
+            if self.state == "open":
+                remaining = self.opened_at + self.open_for - now
+                if remaining > 0:
+                    self.rejected_total += 1
+                    raise CircuitOpen(self.name, max(1, math.ceil(remaining)), self.last_error)
+                self.state = "half_open"
+                self.probes = 0
+                logger.info("%s circuit half-open, probing", self.name)
+            if self.probes >= CIRCUIT_CONFIG["half_open_probes"]:
+                self.rejected_total += 1
+                raise CircuitOpen(self.name, 1, self.last_error)
+            self.probes += 1
+            return True
+
+    def record_success(self, probe: bool) -> None:
+        with self._lock:
+            if probe and self.state == "half_open":
+                logger.info("%s circuit closed", self.name)
+                self.state = "closed"
+                self.open_for = CIRCUIT_CONFIG["open_s"]
+            if self.state == "closed":
+                self.failures = 0
+
+    def record_failure(self, probe: bool, error: BaseException) -> None:
+        with self._lock:
+            self.last_error = describe(error)[:200]
+            if probe and self.state == "half_open":
+                self._open(min(self.open_for * 2, CIRCUIT_CONFIG["max_open_s"]))
+            elif self.state == "closed":
+                self.failures += 1
+                if self.failures >= CIRCUIT_CONFIG["failure_threshold"]:
+                    self._open(CIRCUIT_CONFIG["open_s"])
+
+    def trip(self, error: BaseException) -> None:
+
+        # Opens the circuit without waiting for more failures (e.g. credentials that cannot load).
+
+        with self._lock:
+            self.last_error = describe(error)[:200]
+            if self.state != "open":
+                self._open(self.open_for if self.state == "half_open" else CIRCUIT_CONFIG["open_s"])
+
+    def _open(self, open_for: float) -> None:
+        # Called with the lock held
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.open_for = open_for
+        self.failures = 0
+        self.opened_total += 1
+        logger.warning("%s circuit open for %.0fs after: %s", self.name, open_for, self.last_error)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opened_total": self.opened_total,
+                "rejected_total": self.rejected_total,
+                "last_error": self.last_error
+            }
+
+
+CIRCUITS = {backend: CircuitBreaker(backend) for backend in BACKEND_NAMES}
+
+
+def describe(error: BaseException) -> str:
+    # str() of an HTTPException is empty, its message is in .detail
+    return str(error.detail) if isinstance(error, HTTPException) else str(error)
+
+def caused_by(error: BaseException, types: Tuple[Type[BaseException], ...]) -> bool:
+
+    # Whether `error` or an exception it was raised from/while handling is one of `types`.
+    # The connectors convert driver errors into HTTPException inside their except blocks,
+    # so the driver error is still reachable through __context__.
+
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, types):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+@contextmanager
+def guard(backend: str, is_outage: Callable[[BaseException], bool]) -> Iterator[None]:
+
+    # Runs the enclosed backend call through the backend's circuit. An outage error leaving
+    # the block is tagged with error.backend_outage so /query can degrade instead of failing.
+
+    breaker = CIRCUITS[backend]
+    probe = breaker.before_call()
+    try:
+        yield
+    except Exception as e:
+        if is_outage(e):
+            breaker.record_failure(probe, e)
+            e.backend_outage = backend
+        else:
+            breaker.record_success(probe)
+        raise
+    except BaseException:
+        breaker.record_success(probe)
+        raise
+    else:
+        breaker.record_success(probe)
+
+def guarded(backend: str, is_outage: Callable[[BaseException], bool]) -> Callable:
+
+    # Decorator form of guard() for connector functions.
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with guard(backend, is_outage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def outage_reason(error: BaseException) -> Optional[str]:
+
+    # Why a backend call should be skipped rather than fail the request: its circuit is
+    # open or it failed with an outage error. None for any other error.
+
+    if isinstance(error, CircuitOpen):
+        return error.detail
+    backend = getattr(error, "backend_outage", None)
+    if backend is None:
+        return None
+    return f"{BACKEND_NAMES.get(backend, backend)} is unavailable: {describe(error)}"
+
+def circuit_stats() -> Dict[str, Dict[str, Any]]:
+    return {backend: breaker.stats() for backend, breaker in CIRCUITS.items()}
@@ -0,0 +1,87 @@
+from typing import Any, Dict, List, Optional
+
+# Columnar encoding of /query results (request field format="columnar").
+# Column names are sent once, values as one array per column, and repetitive
+# string columns (room_type, neighbourhood_cleansed, ...) as indexes into a
+# per-column dictionary:
+# {
+#   "length": 3,
+#   "columns": [{"name": "id", "type": "int"},
+#               {"name": "room_type", "type": "string", "dictionary": ["Entire home/apt", "Private room"]}],
+#   "values": [[101, 102, 103], [0, 1, 0]]
+# }
+# A row missing a column gets null in that column.
+
+# dictionary_max_ratio: dictionary-encode a string column when distinct values <= ratio * rows
+# dictionary_min_rows: smaller results are not worth a dictionary
+COLUMNAR_CONFIG = {
+    "dictionary_max_ratio": 0.5,
+    "dictionary_min_rows": 8
+}
+
+TYPE_NAMES = {
+    bool: "bool",
+    int: "int",
+    float: "float",
+    str: "string",
+    list: "array",
+    dict: "object"
+}
+
+def column_type(values: List[Any]) -> str:
+
+    # Names the JSON type of a column from the distinct Python types in it.
+    # Types without a JSON counterpart (dates, Decimal, ObjectId) are reported
+    # as "string"/"float" the way fast_json writes them.
+
+    types = {type(v) for v in values if v is not None}
+    if not types:
+        return "null"
+    names = {TYPE_NAMES.get(t) or ("float" if t.__name__ == "Decimal" else "string") for t in types}
+    if names == {"int", "float"}:
+        return "float"
+    return names.pop() if len(names) == 1 else "mixed"
+
+def to_columnar(rows: List[Dict[str, Any]], dictionary: bool = True) -> Dict[str, Any]:
+    keys = list(dict.fromkeys(key for row in rows for key in row))
+    columns = []
+    values = []
+    dictionary_limit = len(rows) * COLUMNAR_CONFIG["dictionary_max_ratio"]
+    for key in keys:
+        column = [row.get(key) for row in rows]
+        meta = {"name": key, "type": column_type(column)}
+        if dictionary and meta["type"] == "string" and len(rows) >= COLUMNAR_CONFIG["dictionary_min_rows"]:
+            codes = {}
+            for value in column:
+                if value is not None and value not in codes:
+                    codes[value] = len(codes)
+                    if len(codes) > dictionary_limit:
+                        break
+            if len(codes) <= dictionary_limit:
+                meta["dictionary"] = list(codes)
+                column = [codes[value] if value is not None else None for value in column]
+        columns.append(meta)
+        values.append(column)
+    return {"length": len(rows), "columns": columns, "values": values}
+
+def columnar_results(
+    results: Dict[str, Any],
+    merged_refs: Optional[Dict[str, List[Optional[int]]]] = None,
+    merged_source: Optional[str] = None,
+    dictionary: bool = True) -> Dict[str, Any]:
+
+    # Encodes every backend's rows as columns. "merged" is not re-sent: it either names
+    # the backend whose rows it equals ({"source": "mysql"}) or lists, per backend,
+    # the row index each merged row was built from ({"rows": {"mysql": [0, 4], ...}}).
+
+    encoded = {
+        backend: to_columnar(rows, dictionary) if isinstance(rows, list) else rows
+        for backend, rows in results.items() if backend != "merged"
+    }
+    if merged_refs:
+        encoded["merged"] = {"rows": merged_refs}
+    elif merged_source:
+        encoded["merged"] = {"source": merged_source}
+    else:
+        encoded["merged"] = {"rows": {}}
+    return encoded
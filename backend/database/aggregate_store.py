@@ -0,0 +1,415 @@
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from database.derived_index import DerivedIndex
+from database.firebase_connector import get_reference, initialize_firebase, on_firebase_write
+from database.firebase_mirror import firebase_mirror
+from database.firebase_query import as_number, compile_condition
+from database.mysql_connector import get_connection, on_mysql_write
+from database.query_cache import firebase_node_root, sql_write_tables
+from database.write_journal import keyed_mysql_write
+from metrics import register_collector, stage
+
+logger = logging.getLogger("chatdb.aggregate_store")
+
+# Materialised neighbourhood aggregates.
+# Analytic questions such as "count listings per neighbourhood" or "average rating by
+# neighbourhood with at least 5 listings" are answered from an in-process table of count, sum,
+# min and max per neighbourhood_cleansed x room_type cell, instead of a GROUP BY / $group over
+# the base stores. A cell combines the stores: the group columns come from MySQL Listings,
+# ratings from MySQL Reviews, prices and availability from the Firebase listings node.
+# Each listing's values are kept, so a write only moves the listings it changes between cells.
+# Keyed MySQL UPDATEs (see write_journal.keyed_mysql_write) and Firebase writes through this
+# backend are applied as they commit. Other writes to Listings or Reviews (INSERT, DELETE,
+# UPDATE ... WHERE on another column, rolled back batches) rebuild the table in the background,
+# as does age, which picks up writes made outside the backend (see derived_index.py).
+
+# refresh_interval_s: age after which the table is rebuilt even without writes
+AGGREGATE_STORE_CONFIG = {
+    "enabled": True,
+    "refresh_interval_s": 600
+}
+
+GROUP_FIELDS = ("neighbourhood_cleansed", "room_type")
+
+# Measure -> Reviews column / path under a Firebase listing
+MYSQL_MEASURES = {"rating": "review_scores_rating"}
+FIREBASE_MEASURES = {
+    "price": ("pricing", "price"),
+    "availability_30": ("availability", "availability_30"),
+    "availability_60": ("availability", "availability_60"),
+    "availability_90": ("availability", "availability_90"),
+    "availability_365": ("availability", "availability_365")
+}
+MEASURES = tuple(MYSQL_MEASURES) + tuple(FIREBASE_MEASURES)
+OPERATIONS = ("count", "sum", "avg", "min", "max")
+
+Cell = Tuple[Optional[str], Optional[str]]
+
+
+class InvalidAggregateQuery(HTTPException):
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=400, detail=f"Invalid aggregate query: {detail}")
+
+
+def parse_metric(metric: Any) -> Tuple[str, Optional[str]]:
+    # "count" counts listings; "<op>_<measure>" (e.g. "avg_rating") aggregates a measure
+    if metric == "count":
+        return "count", None
+    op, _, measure = str(metric).partition("_")
+    if op not in OPERATIONS or measure not in MEASURES:
+        raise InvalidAggregateQuery(
+            f"unknown metric {metric!r}; use count or <op>_<field> with op in {', '.join(OPERATIONS)} "
+            f"and field in {', '.join(MEASURES)}")
+    return op, measure
+
+def parse_aggregate(spec: Any) -> Dict[str, Any]:
+
+    # Validates an aggregate object from the converted query:
+    #   {"group_by": ["neighbourhood_cleansed"], "metrics": ["count", "avg_rating"],
+    #    "where": {"room_type": "Entire home/apt"}, "having": {"count": {"$gte": 5}},
+    #    "sort": {"avg_rating": -1}, "limit": 10}
+
+    if not isinstance(spec, dict):
+        raise InvalidAggregateQuery("expected an object")
+    group_by = spec.get("group_by") or []
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    if not isinstance(group_by, list) or any(field not in GROUP_FIELDS for field in group_by):
+        raise InvalidAggregateQuery(f"group_by takes {' and/or '.join(GROUP_FIELDS)}")
+    metrics = spec.get("metrics") or ["count"]
+    if not isinstance(metrics, list):
+        raise InvalidAggregateQuery("metrics must be a list")
+    for metric in metrics:
+        parse_metric(metric)
+    where = spec.get("where") or {}
+    if not isinstance(where, dict) or any(field not in GROUP_FIELDS for field in where):
+        raise InvalidAggregateQuery(f"where takes {' and/or '.join(GROUP_FIELDS)}")
+    having = spec.get("having") or {}
+    if not isinstance(having, dict) or any(metric not in metrics for metric in having):
+        raise InvalidAggregateQuery("having conditions must be on requested metrics")
+    try:
+        for metric, condition in having.items():
+            compile_condition(metric, condition)
+    except ValueError as e:
+        raise InvalidAggregateQuery(str(e))
+    sort = spec.get("sort") or {}
+    if not isinstance(sort, dict) or any(field not in metrics and field not in group_by for field in sort):
+        raise InvalidAggregateQuery("sort fields must be grouped fields or requested metrics")
+    limit = spec.get("limit")
+    if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 0):
+        raise InvalidAggregateQuery(f"limit must be a non-negative integer, got {limit!r}")
+    return {"group_by": list(dict.fromkeys(group_by)), "metrics": list(dict.fromkeys(metrics)), "where": where,
+            "having": having, "sort": sort, "limit": limit}
+
+
+class Stats:
+
+    # count / sum / min / max of one measure over one cell. Removing the current min or max
+    # leaves it unknown until the next read rescans the cell.
+
+    __slots__ = ("count", "total", "low", "high", "stale")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.low = None
+        self.high = None
+        self.stale = False
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if not self.stale:
+            self.low = value if self.low is None or value < self.low else self.low
+            self.high = value if self.high is None or value > self.high else self.high
+
+    def remove(self, value: float) -> None:
+        self.count -= 1
+        self.total -= value
+        if self.count == 0:
+            self.total, self.low, self.high, self.stale = 0, None, None, False
+        elif value == self.low or value == self.high:
+            self.stale = True
+
+
+class AggregateTable:
+
+    # Mutable: writes are applied in place under the table's lock, which readers also take.
+
+    def __init__(self):
+        self.listings: Dict[str, Dict[str, Any]] = {}  # listing id -> group fields, "listed" and measures
+        self.cells: Dict[Cell, Set[str]] = {}
+        self.stats: Dict[Cell, Dict[str, Stats]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cell_of(entry: Dict[str, Any]) -> Optional[Cell]:
+        # Only listings with a MySQL row belong to a cell
+        if not entry.get("listed"):
+            return None
+        return tuple(entry.get(field) for field in GROUP_FIELDS)
+
+    def _add(self, listing_id: str, entry: Dict[str, Any]) -> None:
+        cell = self.cell_of(entry)
+        if cell is None:
+            return
+        self.cells.setdefault(cell, set()).add(listing_id)
+        stats = self.stats.setdefault(cell, {measure: Stats() for measure in MEASURES})
+        for measure in MEASURES:
+            if entry.get(measure) is not None:
+                stats[measure].add(entry[measure])
+
+    def _remove(self, listing_id: str, entry: Dict[str, Any]) -> None:
+        cell = self.cell_of(entry)
+        if cell is None:
+            return
+        members = self.cells[cell]
+        members.discard(listing_id)
+        if not members:
+            del self.cells[cell]
+            del self.stats[cell]
+            return
+        for measure in MEASURES:
+            if entry.get(measure) is not None:
+                self.stats[cell][measure].remove(entry[measure])
+
+    def apply(self, changes: Dict[str, Dict[str, Any]], create: bool = True) -> "AggregateTable":
+
+        # Sets fields of listings ({listing id: {"room_type": ..., "price": ...}}) and moves them
+        # between cells. With create=False, changes to listings the table does not know are ignored
+        # (an UPDATE of a missing row changes nothing).
+
+        with self._lock:
+            for listing_id, fields in changes.items():
+                old = self.listings.get(listing_id)
+                if old is None and not create:
+                    continue
+                new = {**(old or {}), **fields}
+                if old is not None:
+                    self._remove(listing_id, old)
+                self.listings[listing_id] = new
+                self._add(listing_id, new)
+        return self
+
+    def _current(self, cell: Cell, measure: str) -> Stats:
+        stats = self.stats[cell][measure]
+        if stats.stale:
+            values = [self.listings[listing_id][measure] for listing_id in self.cells[cell]
+                      if self.listings[listing_id].get(measure) is not None]
+            stats.low, stats.high, stats.stale = min(values), max(values), False
+        return stats
+
+    def query(self, spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+
+        # Result rows of a parsed aggregate object: the cells matching "where" are rolled up to
+        # the group_by fields, then "having", "sort" and "limit" apply.
+
+        positions = [GROUP_FIELDS.index(field) for field in spec["group_by"]]
+        allowed = {}
+        for field, values in spec["where"].items():
+            values = values if isinstance(values, list) else [values]
+            allowed[GROUP_FIELDS.index(field)] = {str(value).casefold() for value in values}
+        metrics = [(metric, *parse_metric(metric)) for metric in spec["metrics"]]
+        measures = {measure for _, _, measure in metrics if measure is not None}
+
+        groups: Dict[tuple, Dict[str, Any]] = {}
+        with self._lock:
+            for cell, members in self.cells.items():
+                if any(cell[position] is None or cell[position].casefold() not in values
+                       for position, values in allowed.items()):
+                    continue
+                key = tuple(cell[position] for position in positions)
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = {"listings": 0, **{measure: [0, 0, None, None] for measure in measures}}
+                group["listings"] += len(members)
+                for measure in measures:
+                    stats = self._current(cell, measure)
+                    if stats.count == 0:
+                        continue
+                    rolled = group[measure]
+                    rolled[0] += stats.count
+                    rolled[1] += stats.total
+                    rolled[2] = stats.low if rolled[2] is None else min(rolled[2], stats.low)
+                    rolled[3] = stats.high if rolled[3] is None else max(rolled[3], stats.high)
+
+        rows = []
+        for key, group in groups.items():
+            row = dict(zip(spec["group_by"], key))
+            for metric, op, measure in metrics:
+                if measure is None:
+                    row[metric] = group["listings"]
+                    continue
+                count, total, low, high = group[measure]
+                row[metric] = {
+                    "count": count,
+                    "sum": total if count else None,
+                    "avg": total / count if count else None,
+                    "min": low,
+                    "max": high
+                }[op]
+            rows.append(row)
+
+        for metric, condition in spec["having"].items():
+            tests = compile_condition(metric, condition)
+            rows = [row for row in rows if row[metric] is not None
+                    and all(test(row[metric], operand) for test, operand in tests)]
+        for field, direction in reversed(list(spec["sort"].items())):
+            # Missing values sort last either way
+            present = [row for row in rows if row.get(field) is not None]
+            present.sort(key=lambda row: row[field], reverse=direction in (-1, "desc", "DESC"))
+            rows = present + [row for row in rows if row.get(field) is None]
+        return rows if spec["limit"] is None else rows[:spec["limit"]]
+
+    def size(self) -> Tuple[int, int]:
+        with self._lock:
+            return len(self.listings), len(self.cells)
+
+
+def firebase_measures(child: Any) -> Dict[str, Any]:
+    values = {}
+    for measure, path in FIREBASE_MEASURES.items():
+        value = child
+        for part in path:
+            value = value.get(part) if isinstance(value, dict) else None
+        values[measure] = as_number(value)
+    return values
+
+def load_aggregates() -> AggregateTable:
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT l.id, {', '.join(f'l.{field}' for field in GROUP_FIELDS)}, "
+                f"{', '.join(f'r.{column} AS {measure}' for measure, column in MYSQL_MEASURES.items())} "
+                "FROM Listings l LEFT JOIN Reviews r ON r.listing_id = l.id"
+            )
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+    if firebase_mirror.ready("listings"):
+        children = firebase_mirror.snapshot("listings")
+    else:
+        initialize_firebase()
+        children = get_reference("listings").get() or {}
+    if isinstance(children, list):
+        children = {str(index): child for index, child in enumerate(children) if child is not None}
+
+    listings: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        entry = listings.setdefault(str(row["id"]), {"listed": True})
+        for field in GROUP_FIELDS:
+            entry[field] = row[field]
+        for measure in MYSQL_MEASURES:
+            if row[measure] is not None:
+                entry[measure] = as_number(row[measure])
+    for key, child in children.items():
+        listings.setdefault(str(key), {}).update(firebase_measures(child))
+    return AggregateTable().apply(listings)
+
+
+aggregate_store = DerivedIndex("aggregate", "Listings", load_aggregates, AGGREGATE_STORE_CONFIG["refresh_interval_s"],
+                               mysql_source=False)
+
+
+def mysql_changes(statements: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+
+    # Listing changes made by committed statements, or None when a statement on Listings or
+    # Reviews is not a keyed UPDATE by listing id.
+
+    changes: Dict[str, Dict[str, Any]] = {}
+    for statement in statements:
+        keyed = keyed_mysql_write(statement)
+        if keyed is None:
+            tables = sql_write_tables([statement])
+            if tables is None or tables & {"listings", "reviews"}:
+                return None
+            continue
+        table, key_field, fields = keyed["target"].lower(), keyed["key_field"].lower(), keyed["fields"]
+        if table == "listings":
+            if key_field != "id":
+                return None
+            written = {field: fields[field] for field in GROUP_FIELDS if field in fields}
+        elif table == "reviews":
+            if key_field != "listing_id":
+                return None
+            written = {measure: as_number(fields[column]) for measure, column in MYSQL_MEASURES.items() if column in fields}
+        else:
+            continue
+        if written:
+            changes.setdefault(str(keyed["key"]), {}).update(written)
+    return changes
+
+def on_mysql_aggregate_write(tables: Optional[Set[str]], statements: Optional[List[str]]) -> None:
+    if tables is not None and not tables & {"listings", "reviews"}:
+        return
+    changes = mysql_changes(statements) if statements is not None else None
+    if changes is None:
+        aggregate_store.on_write(None)
+    elif changes:
+        aggregate_store.patch(lambda table: table.apply(changes, create=False))
+
+def firebase_changes(updates: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+
+    # Listing changes made by a multi-path update of the listings node: a whole child
+    # ("123": {...} or None) or paths within one ("123/pricing/price": 90).
+
+    changes: Dict[str, Dict[str, Any]] = {}
+    for path, value in updates.items():
+        key, *parts = path.strip("/").split("/")
+        for measure, measure_path in FIREBASE_MEASURES.items():
+            if tuple(parts) != measure_path[:len(parts)]:
+                continue
+            nested = value
+            for part in measure_path[len(parts):]:
+                nested = nested.get(part) if isinstance(nested, dict) else None
+            changes.setdefault(key, {})[measure] = as_number(nested)
+    return changes
+
+def on_firebase_aggregate_write(node: str, updates: Optional[Dict[str, Any]]) -> None:
+    if firebase_node_root(node) != "listings":
+        return
+    if updates is None or node.strip("/") != "listings":
+        aggregate_store.on_write(None)
+        return
+    changes = firebase_changes(updates)
+    if changes:
+        aggregate_store.patch(lambda table: table.apply(changes))
+
+on_mysql_write(on_mysql_aggregate_write)
+on_firebase_write(on_firebase_aggregate_write)
+
+
+def start_aggregate_store() -> None:
+    if AGGREGATE_STORE_CONFIG["enabled"]:
+        aggregate_store.refresh_in_background()
+
+def find_aggregates(spec: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+
+    # Rows for a parsed aggregate object, or None until the table is built.
+
+    table = aggregate_store.current()
+    if table is None:
+        return None
+    with stage("aggregate_store"):
+        return table.query(spec)
+
+
+def render_aggregate_metrics() -> List[str]:
+    table = aggregate_store.current()
+    listings, cells = table.size() if table is not None else (0, 0)
+    return aggregate_store.render_metrics("chatdb_aggregate_store") + [
+        "# HELP chatdb_aggregate_store_listings Listings in the neighbourhood aggregate table.",
+        "# TYPE chatdb_aggregate_store_listings gauge",
+        f"chatdb_aggregate_store_listings {listings}",
+        "# HELP chatdb_aggregate_store_cells Neighbourhood x room type cells in the aggregate table.",
+        "# TYPE chatdb_aggregate_store_cells gauge",
+        f"chatdb_aggregate_store_cells {cells}"
+    ]
+
+register_collector(render_aggregate_metrics)
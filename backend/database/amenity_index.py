@@ -0,0 +1,342 @@
+import bisect
+import logging
+import re
+from array import array
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+from database.derived_index import DerivedIndex
+from database.mongodb_connector import get_collection, on_mongodb_write, query_mongodb
+from metrics import register_collector, stage
+
+logger = logging.getLogger("chatdb.amenity_index")
+
+# Bitmap index of listing amenities.
+# Amenity questions ("wifi, a dishwasher and free parking, but no smoking") are answered from
+# an in-process index of the MongoDB amenities collection instead of array scans and $lookup
+# joins. Listings are numbered densely, and every distinct amenity keeps the set of listings that
+# have it: a Python int used as a bitmap when many listings do, or a sorted array of listing
+# numbers when few do (4 bytes per listing instead of a bit per listing of the whole dataset).
+# all/any/none filters are evaluated with &, | and ~ on the bitmaps.
+# A filter term matches every amenity containing all of its words, so "free parking" matches
+# "Free parking on premises" and "Free street parking".
+# Writes to the amenities collection that name their listings ({"listing_id": ...} filters,
+# inserted documents) are applied to the index at once; any other write rebuilds it in the
+# background (see derived_index.py).
+
+# refresh_interval_s: age after which the index is rebuilt even without writes
+# max_pushdown: most matching listings pushed into the backend queries as ids; beyond that,
+#   the backend results are filtered by the index instead
+# max_terms: most filter terms across all/any/none
+AMENITY_INDEX_CONFIG = {
+    "enabled": True,
+    "refresh_interval_s": 600,
+    "max_pushdown": 20000,
+    "max_terms": 20
+}
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+Posting = Union[int, array]
+
+
+class InvalidAmenityQuery(HTTPException):
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=400, detail=f"Invalid amenities filter: {detail}")
+
+
+class AmenityMatch(NamedTuple):
+    count: int
+    listing_ids: Optional[List[Any]]  # None when there are more than max_pushdown
+    contains: Callable[[Any], bool]
+
+
+def amenity_words(name: Any) -> frozenset:
+    return frozenset(WORD_PATTERN.findall(str(name).lower()))
+
+def listing_key(listing_id: Any) -> Any:
+    # Listing ids are ints in MongoDB but often strings in filters and Firebase rows
+    if isinstance(listing_id, str) and listing_id.strip().lstrip("-").isdigit():
+        return int(listing_id)
+    return listing_id
+
+def parse_amenities(spec: Any) -> Dict[str, List[str]]:
+
+    # Validates an amenities filter from the converted query:
+    #   {"all": ["wifi", "dishwasher"], "any": ["free parking", "street parking"], "none": ["smoking allowed"]}
+    # A plain list means "all".
+
+    if isinstance(spec, list):
+        spec = {"all": spec}
+    if not isinstance(spec, dict) or set(spec) - {"all", "any", "none"}:
+        raise InvalidAmenityQuery('expected an object with "all", "any" and/or "none" lists')
+    parsed = {}
+    for part in ("all", "any", "none"):
+        terms = spec.get(part) or []
+        if not isinstance(terms, list) or not all(isinstance(term, str) and amenity_words(term) for term in terms):
+            raise InvalidAmenityQuery(f'"{part}" must be a list of amenity names')
+        parsed[part] = terms
+    count = sum(len(terms) for terms in parsed.values())
+    if count == 0 or count > AMENITY_INDEX_CONFIG["max_terms"]:
+        raise InvalidAmenityQuery(f"expected 1 to {AMENITY_INDEX_CONFIG['max_terms']} amenity names")
+    return parsed
+
+def set_bits(bits: int) -> Iterator[int]:
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield byte_index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+class AmenityBitmaps:
+
+    # Immutable snapshot of the index; with_listings returns a patched copy that shares the
+    # postings of every amenity it does not change.
+
+    def __init__(self, ids: List[Any], numbers: Dict[Any, int], postings: Dict[str, Posting],
+                 names: Dict[str, frozenset], listed: int):
+        self.ids = ids
+        self.numbers = numbers
+        self.postings = postings
+        self.names = names  # amenity -> its words
+        self.listed = listed  # bitmap of listings that have an amenities document
+        self._resolved: Dict[str, int] = {}
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[Any, Any]]) -> "AmenityBitmaps":
+        ids: List[Any] = []
+        numbers: Dict[Any, int] = {}
+        members: Dict[str, List[int]] = {}
+        for listing_id, amenities in documents:
+            listing_id = listing_key(listing_id)
+            if listing_id in numbers or not isinstance(amenities, list):
+                continue
+            number = numbers[listing_id] = len(ids)
+            ids.append(listing_id)
+            for amenity in set(" ".join(str(name).split()) for name in amenities if name):
+                members.setdefault(amenity, []).append(number)
+        postings = {amenity: cls.compact(numbers_with, len(ids)) for amenity, numbers_with in members.items()}
+        return cls(ids, numbers, postings, {amenity: amenity_words(amenity) for amenity in postings},
+                   (1 << len(ids)) - 1)
+
+    @staticmethod
+    def compact(sorted_numbers: List[int], total: int) -> Posting:
+        # A bitmap costs total/8 bytes, an array 4 bytes per listing: keep whichever is smaller
+        if len(sorted_numbers) * 32 >= total:
+            buffer = bytearray((total + 7) // 8)
+            for number in sorted_numbers:
+                buffer[number >> 3] |= 1 << (number & 7)
+            return int.from_bytes(buffer, "little")
+        return array("I", sorted_numbers)
+
+    def bitmap(self, posting: Posting) -> int:
+        if isinstance(posting, int):
+            return posting
+        buffer = bytearray((len(self.ids) + 7) // 8)
+        for number in posting:
+            buffer[number >> 3] |= 1 << (number & 7)
+        return int.from_bytes(buffer, "little")
+
+    def resolve(self, term: str) -> int:
+        # Listings with any amenity that contains all words of `term`
+        words = amenity_words(term)
+        key = " ".join(sorted(words))
+        bits = self._resolved.get(key)
+        if bits is None:
+            bits = 0
+            for amenity, amenity_words_ in self.names.items():
+                if words <= amenity_words_:
+                    bits |= self.bitmap(self.postings[amenity])
+            if len(self._resolved) < 1024:
+                self._resolved[key] = bits
+        return bits
+
+    def evaluate(self, spec: Dict[str, List[str]]) -> int:
+        bits = self.listed
+        for term in spec["all"]:
+            bits &= self.resolve(term)
+        if spec["any"]:
+            any_bits = 0
+            for term in spec["any"]:
+                any_bits |= self.resolve(term)
+            bits &= any_bits
+        for term in spec["none"]:
+            bits &= ~self.resolve(term)
+        return bits
+
+    def listing_ids(self, bits: int) -> List[Any]:
+        return [self.ids[number] for number in set_bits(bits)]
+
+    def contains(self, bits: int, listing_id: Any) -> bool:
+        number = self.numbers.get(listing_key(listing_id))
+        return number is not None and bool(bits >> number & 1)
+
+    def amenities_of(self, number: int) -> List[str]:
+        found = []
+        for amenity, posting in self.postings.items():
+            if isinstance(posting, int):
+                if posting >> number & 1:
+                    found.append(amenity)
+            else:
+                position = bisect.bisect_left(posting, number)
+                if position < len(posting) and posting[position] == number:
+                    found.append(amenity)
+        return found
+
+    def with_listings(self, changes: Dict[Any, Optional[List[str]]]) -> "AmenityBitmaps":
+
+        # A copy with the amenities of some listings replaced (None removes the listing).
+
+        ids, numbers, listed = self.ids, self.numbers, self.listed
+        postings, names = dict(self.postings), dict(self.names)
+        for listing_id, amenities in changes.items():
+            listing_id = listing_key(listing_id)
+            number = numbers.get(listing_id)
+            if number is None:
+                if amenities is None:
+                    continue
+                if ids is self.ids:
+                    ids, numbers = list(ids), dict(numbers)
+                number = numbers[listing_id] = len(ids)
+                ids.append(listing_id)
+            old = set(self.amenities_of(number)) if number < len(self.ids) else set()
+            new = set(" ".join(str(name).split()) for name in amenities or [] if name)
+            for amenity in old - new:
+                postings[amenity] = self.without(postings[amenity], number)
+            for amenity in new - old:
+                postings[amenity] = self.plus(postings.get(amenity), number)
+                names.setdefault(amenity, amenity_words(amenity))
+            listed = listed | (1 << number) if amenities is not None else listed & ~(1 << number)
+        return AmenityBitmaps(ids, numbers, postings, names, listed)
+
+    @staticmethod
+    def without(posting: Posting, number: int) -> Posting:
+        if isinstance(posting, int):
+            return posting & ~(1 << number)
+        position = bisect.bisect_left(posting, number)
+        if position < len(posting) and posting[position] == number:
+            return posting[:position] + posting[position + 1:]
+        return posting
+
+    @staticmethod
+    def plus(posting: Optional[Posting], number: int) -> Posting:
+        if posting is None:
+            return array("I", [number])
+        if isinstance(posting, int):
+            return posting | (1 << number)
+        position = bisect.bisect_left(posting, number)
+        if position < len(posting) and posting[position] == number:
+            return posting
+        return posting[:position] + array("I", [number]) + posting[position:]
+
+    def size_bytes(self) -> int:
+        return sum((posting.bit_length() + 7) // 8 if isinstance(posting, int) else posting.itemsize * len(posting)
+                   for posting in self.postings.values())
+
+
+def load_amenities() -> AmenityBitmaps:
+    cursor = get_collection("amenities").find({}, {"listing_id": 1, "amenities": 1, "_id": 0})
+    return AmenityBitmaps.build((doc.get("listing_id"), doc.get("amenities")) for doc in cursor)
+
+
+amenity_index = DerivedIndex("amenity", "amenities", load_amenities, AMENITY_INDEX_CONFIG["refresh_interval_s"],
+                             mysql_source=False)
+
+
+def written_listing_ids(mod_query: Optional[Dict[str, Any]]) -> Optional[List[Any]]:
+
+    # The listings a modification of the amenities collection touches, when it names them.
+
+    if not isinstance(mod_query, dict):
+        return None
+    op = str(mod_query.get("operation", "")).lower()
+    if op == "insert":
+        documents = mod_query.get("documents") if isinstance(mod_query.get("documents"), list) else [mod_query.get("document")]
+        ids = [doc.get("listing_id") for doc in documents if isinstance(doc, dict)]
+        return ids if ids and all(listing_id is not None for listing_id in ids) else None
+    filter_query = mod_query.get("filter")
+    if not isinstance(filter_query, dict) or list(filter_query) != ["listing_id"]:
+        return None
+    value = filter_query["listing_id"]
+    if isinstance(value, dict):
+        return list(value["$in"]) if list(value) == ["$in"] and isinstance(value["$in"], list) else None
+    return [value]
+
+def on_amenities_write(collection_name: str, mod_query: Optional[Dict[str, Any]]) -> None:
+    if collection_name != "amenities" or amenity_index.current() is None:
+        return
+    listing_ids = written_listing_ids(mod_query)
+    if listing_ids is not None:
+        keys = [listing_key(listing_id) for listing_id in listing_ids]
+        try:
+            found = {listing_key(doc.get("listing_id")): doc.get("amenities")
+                     for doc in get_collection("amenities").find({"listing_id": {"$in": keys}},
+                                                                 {"listing_id": 1, "amenities": 1, "_id": 0})}
+            changes = {key: found.get(key) if isinstance(found.get(key), list) else None for key in keys}
+            amenity_index.patch(lambda index: index.with_listings(changes))
+            return
+        except Exception as e:
+            logger.warning("Could not update the amenity index for %s: %s", keys, e)
+    amenity_index.refresh_in_background()
+
+on_mongodb_write(on_amenities_write)
+
+
+def start_amenity_index() -> None:
+    if AMENITY_INDEX_CONFIG["enabled"]:
+        amenity_index.refresh_in_background()
+
+def term_pattern(term: str) -> Dict[str, Any]:
+    # Fallback match for one term: an amenity containing all of its words, in any order
+    lookaheads = "".join(f"(?=.*\\b{word}\\b)" for word in sorted(amenity_words(term)))
+    return {"amenities": {"$regex": f"^{lookaheads}", "$options": "i"}}
+
+def mongodb_amenities(spec: Dict[str, List[str]]) -> List[Any]:
+
+    # The same filter as a MongoDB query of the amenities collection, used until the index is built.
+
+    conditions = [term_pattern(term) for term in spec["all"]]
+    if spec["any"]:
+        conditions.append({"$or": [term_pattern(term) for term in spec["any"]]})
+    if spec["none"]:
+        conditions.append({"$nor": [term_pattern(term) for term in spec["none"]]})
+    rows = query_mongodb({"collection": "amenities", "filter": {"$and": conditions},
+                          "projection": {"listing_id": 1, "_id": 0}}, convert=False)
+    return [row["listing_id"] for row in rows if row.get("listing_id") is not None]
+
+def find_amenities(spec: Dict[str, List[str]]) -> Tuple[AmenityMatch, str]:
+
+    # Listings matching a parsed amenities filter and where they were found.
+
+    index = amenity_index.current()
+    if index is None:
+        listing_ids = mongodb_amenities(spec)
+        members = {listing_key(listing_id) for listing_id in listing_ids}
+        listed = listing_ids if len(listing_ids) <= AMENITY_INDEX_CONFIG["max_pushdown"] else None
+        return AmenityMatch(len(listing_ids), listed, lambda listing_id: listing_key(listing_id) in members), "mongodb"
+    with stage("amenity_search"):
+        bits = index.evaluate(spec)
+        count = bin(bits).count("1")
+        listed = index.listing_ids(bits) if count <= AMENITY_INDEX_CONFIG["max_pushdown"] else None
+    return AmenityMatch(count, listed, lambda listing_id: index.contains(bits, listing_id)), "index"
+
+
+def render_amenity_metrics() -> List[str]:
+    index = amenity_index.current()
+    return amenity_index.render_metrics("chatdb_amenity_index") + [
+        "# HELP chatdb_amenity_index_listings Listings in the amenity bitmap index.",
+        "# TYPE chatdb_amenity_index_listings gauge",
+        f"chatdb_amenity_index_listings {len(index.ids) if index is not None else 0}",
+        "# HELP chatdb_amenity_index_amenities Distinct amenities in the amenity bitmap index.",
+        "# TYPE chatdb_amenity_index_amenities gauge",
+        f"chatdb_amenity_index_amenities {len(index.postings) if index is not None else 0}",
+        "# HELP chatdb_amenity_index_bytes Memory held by the postings of the amenity bitmap index.",
+        "# TYPE chatdb_amenity_index_bytes gauge",
+        f"chatdb_amenity_index_bytes {index.size_bytes() if index is not None else 0}"
+    ]
+
+register_collector(render_amenity_metrics)
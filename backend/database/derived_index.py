@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from database.mysql_connector import on_mysql_write
+
+logger = logging.getLogger("chatdb.derived_index")
+
+
+class DerivedIndex:
+
+    # In-process index derived from a table or collection (see geo_index.py, text_index.py,
+    # amenity_index.py and aggregate_store.py). `build` reads the source and returns the finished index, which then
+    # replaces the previous one; readers never wait for a build and keep the old index meanwhile.
+    # A build runs in the background after a write to `table` (MySQL writes are subscribed to
+    # here; other sources call on_write themselves) and when the index is older than
+    # `refresh_interval_s`. Writes that arrive during a build trigger one more build.
+
+    def __init__(self, name: str, table: str, build: Callable[[], Any], refresh_interval_s: float,
+                 mysql_source: bool = True):
+        self.name = name
+        self.table = table.lower()
+        self._build = build
+        self.refresh_interval_s = refresh_interval_s
+        self._index: Optional[Any] = None
+        self._built_at: Optional[float] = None
+        self.build_seconds = 0.0
+        self.builds = 0
+        self._lock = threading.Lock()
+        self._building = False
+        self._dirty = False
+        if mysql_source:
+            on_mysql_write(self.on_write)
+
+    def refresh(self) -> None:
+        with self._lock:
+            if self._building:
+                self._dirty = True
+                return
+            self._building = True
+        try:
+            while True:
+                with self._lock:
+                    self._dirty = False
+                started = time.perf_counter()
+                try:
+                    index = self._build()
+                except Exception as e:
+                    logger.error("Building the %s index failed: %s", self.name, e)
+                    return
+                with self._lock:
+                    self._index = index
+                    self._built_at = time.monotonic()
+                    self.build_seconds = time.perf_counter() - started
+                    self.builds += 1
+                    if not self._dirty:
+                        break
+            logger.info("Built the %s index in %.2fs", self.name, self.build_seconds)
+        finally:
+            with self._lock:
+                self._building = False
+
+    def refresh_in_background(self) -> None:
+        threading.Thread(target=self.refresh, name=f"{self.name}-index-build", daemon=True).start()
+
+    def on_write(self, tables: Optional[Set[str]], statements: Optional[List[str]] = None) -> None:
+        if (self._built_at is not None or self._building) and (tables is None or self.table in tables):
+            self.refresh_in_background()
+
+    def patch(self, apply: Callable[[Any], Any]) -> bool:
+
+        # Replaces the current index with apply(index), e.g. a copy with a few entries changed.
+        # A build in progress may have read the source before the change, so it is repeated.
+        # Returns False when there is no index to patch yet.
+
+        with self._lock:
+            if self._building:
+                self._dirty = True
+            if self._index is None:
+                return False
+            self._index = apply(self._index)
+            return True
+
+    def current(self) -> Optional[Any]:
+
+        # The latest built index, or None before the first build completes.
+
+        index = self._index
+        if index is not None and time.monotonic() - self._built_at > self.refresh_interval_s:
+            self.refresh_in_background()
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self._index is not None,
+            "age_seconds": time.monotonic() - self._built_at if self._built_at is not None else None,
+            "build_seconds": self.build_seconds,
+            "builds": self.builds
+        }
+
+    def render_metrics(self, prefix: str) -> list:
+        stats = self.stats()
+        lines = [
+            f"# HELP {prefix}_ready Whether the in-process {self.name} index is built.",
+            f"# TYPE {prefix}_ready gauge",
+            f"{prefix}_ready {int(stats['ready'])}",
+            f"# HELP {prefix}_builds_total Completed builds of the {self.name} index.",
+            f"# TYPE {prefix}_builds_total counter",
+            f"{prefix}_builds_total {stats['builds']}",
+            f"# HELP {prefix}_build_seconds Duration of the last build of the {self.name} index.",
+            f"# TYPE {prefix}_build_seconds gauge",
+            f"{prefix}_build_seconds {stats['build_seconds']:.3f}"
+        ]
+        if stats["age_seconds"] is not None:
+            lines += [
+                f"# HELP {prefix}_age_seconds Time since the {self.name} index was last built.",
+                f"# TYPE {prefix}_age_seconds gauge",
+                f"{prefix}_age_seconds {stats['age_seconds']:.3f}"
+            ]
+        return lines
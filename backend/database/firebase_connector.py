@@ -1,9 +1,22 @@
+import logging
 import firebase_admin
+import firebase_admin.exceptions
+import google.auth.exceptions
 from firebase_admin import credentials, db
 from fastapi import HTTPException
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 import json
 import os
+import time
+from database.query_cache import get_query_cache, canonicalize_query, firebase_node_root
+from database.slow_query_log import record_if_slow
+from database.firebase_mirror import firebase_mirror, with_path, FIREBASE_MIRROR_CONFIG
+from database.firebase_query import compile_firebase_query, run_firebase_query
+from admission import admit, limited
+from circuit_breaker import CIRCUITS, caused_by, guard, guarded
+from metrics import timed_stage
+
+logger = logging.getLogger("chatdb.firebase")
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 CREDENTIAL_PATH = os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), 
@@ -22,36 +35,55 @@ NODES = {
     "hosts": "hosts"
 }
 
+class FirebaseUnavailable(HTTPException):
+    # Firebase could not be initialised with either credential source
+    pass
+
+# Errors meaning Firebase could not be reached or would not authenticate us
+FIREBASE_OUTAGES = (
+    FirebaseUnavailable,
+    firebase_admin.exceptions.UnavailableError,
+    firebase_admin.exceptions.DeadlineExceededError,
+    firebase_admin.exceptions.UnauthenticatedError,
+    google.auth.exceptions.GoogleAuthError
+)
+
+def is_firebase_outage(error: BaseException) -> bool:
+    return caused_by(error, FIREBASE_OUTAGES)
+
 def initialize_firebase():
 
     # Initializes Firebase connection with credentials or fallback authentication.
     # Uses a tiered approach to authentication:
     # 1. Certificate-based auth with provided credentials
     # 2. Application default credentials as fallback
+    # A failure opens the Firebase circuit at once, so later calls fail fast instead of
+    # retrying both methods until the circuit's half-open probe.
 
     try:
         if not firebase_admin._apps:
-            print(f"Initializing Firebase with credential path: {FIREBASE_CONFIG['credential_path']}")
+            logger.debug("Initializing Firebase with credential path: %s", FIREBASE_CONFIG['credential_path'])
             try:
                 cred = credentials.Certificate(FIREBASE_CONFIG["credential_path"])
                 firebase_admin.initialize_app(cred, {
                     "databaseURL": FIREBASE_CONFIG["database_url"]
                 })
-                print("Firebase initialization successful")
+                logger.debug("Firebase initialization successful")
             except Exception as e:
-                print(f"Firebase initialization error: {str(e)}")
+                logger.error("Firebase initialization error: %s", e)
                 # Fallback to application default credentials if certificate fails
                 try:
                     firebase_admin.initialize_app(options={"databaseURL": FIREBASE_CONFIG["database_url"]})
-                    print("Firebase initialized with default credentials")
+                    logger.debug("Firebase initialized with default credentials")
                 except Exception as inner_e:
-                    print(f"Firebase default credentials error: {str(inner_e)}")
+                    logger.error("Firebase default credentials error: %s", inner_e)
                     raise
         else:
-            print("Firebase already initialized")
+            logger.debug("Firebase already initialized")
     except Exception as e:
-        print(f"Failed to initialize Firebase: {str(e)}")
-        raise HTTPException(
+        logger.error("Failed to initialize Firebase: %s", e)
+        CIRCUITS["firebase"].trip(e)
+        raise FirebaseUnavailable(
             status_code=500,
             detail=f"Failed to initialize Firebase: {str(e)}"
         )
@@ -67,213 +99,463 @@ def get_reference(node: str) -> db.Reference:
             
         # Security validation to prevent accessing unauthorized nodes
         if node not in NODES.values() and not any(node.startswith(f"{n}/") for n in NODES.values()):
-            print(f"Warning: Accessing non-standard node: {node}")
+            logger.warning("Accessing non-standard node: %s", node)
             
         ref_path = f"/{node}"
-        print(f"Getting Firebase reference to: {ref_path}")
+        logger.debug("Getting Firebase reference to: %s", ref_path)
         return db.reference(ref_path)
     except Exception as e:
-        print(f"Error getting Firebase reference: {str(e)}")
+        logger.error("Error getting Firebase reference: %s", e)
         raise HTTPException(
             status_code=400,
             detail=f"Invalid Firebase node: {node}. Error: {str(e)}"
         )
 
+@guarded("firebase", is_firebase_outage)
+def list_firebase_keys(node: str = "/") -> Optional[List[str]]:
+
+    # Lists the child keys of a node with a REST shallow read (shallow=true),
+    # so only the keys are transferred instead of the whole subtree.
+    # Returns None when the node holds a leaf value or does not exist.
+
+    initialize_firebase()
+    path = node if node.startswith("/") else f"/{node}"
+    data = db.reference(path).get(shallow=True)
+    if isinstance(data, dict):
+        return list(data.keys())
+    return None
+
+@guarded("firebase", is_firebase_outage)
+def sample_firebase_children(node: str, count: int = 5) -> Any:
+
+    # Reads at most `count` children of a node ordered by key (orderBy="$key"&limitToFirst=n).
+    # The transfer size depends on `count`, not on the size of the node.
+
+    initialize_firebase()
+    path = node if node.startswith("/") else f"/{node}"
+    return db.reference(path).order_by_key().limit_to_first(max(int(count), 1)).get()
+
+@timed_stage("firebase", backend="firebase")
 def query_firebase(
     node: str,
     query_obj: Optional[Dict[str, Any]] = None) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
 
     # Executes queries against Firebase database with filtering capabilities.
     # Supports complex filtering operations on nested fields and pagination.
+    # Non-empty results are cached per node and canonical query object until the node is modified.
+    # A node kept by the live mirror (firebase_mirror.py) is filtered in memory without a download.
+
+    cache = get_query_cache("firebase")
+    key = f"{node.strip('/')}:{canonicalize_query(query_obj)}"
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return list(cached) if isinstance(cached, list) else cached
 
+    if firebase_mirror.ready(node):
+        results = filter_firebase_data(firebase_mirror.snapshot(node), query_obj)
+    else:
+        with admit("firebase"), guard("firebase", is_firebase_outage):
+            results = _execute_firebase_query(node, query_obj)
+    if cache is not None and results:
+        cache.put(key, list(results) if isinstance(results, list) else results, [firebase_node_root(node)])
+    return results
+
+def _execute_firebase_query(
+    node: str,
+    query_obj: Optional[Dict[str, Any]] = None) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
     try:
         initialize_firebase()
         ref = get_reference(node)
+        started = time.perf_counter()
         all_data = ref.get()
-        
-        if not all_data:
-            return []
-        if not query_obj:
-            return list(all_data.values()) if isinstance(all_data, dict) else all_data
-        
-        results = []
-        
-        items = []
-        for key, value in all_data.items():
-            if isinstance(value, dict):
-                value['id'] = key
-                items.append(value)
-            else:
-                items.append({'id': key, 'value': value})
-        
-        if isinstance(query_obj, dict):
-            if 'pricing' in query_obj:
-                for condition_field, condition in query_obj['pricing'].items():
-                    if '$lt' in condition:
-                        limit_value = condition['$lt']
-                        items = [
-                            item for item in items
-                            if 'pricing' in item and
-                            condition_field in item['pricing'] and
-                            item['pricing'][condition_field] is not None and
-                            float(item['pricing'][condition_field]) < limit_value
-                        ]
-                    elif '$gt' in condition:
-                        limit_value = condition['$gt']
-                        items = [
-                            item for item in items 
-                            if 'pricing' in item and
-                            condition_field in item['pricing'] and
-                            item['pricing'][condition_field] is not None and
-                            float(item['pricing'][condition_field]) > limit_value
-                        ]
-                    elif '$eq' in condition:
-                        limit_value = condition['$eq']
-                        items = [
-                            item for item in items
-                            if 'pricing' in item and
-                            condition_field in item['pricing'] and
-                            item['pricing'][condition_field] is not None and
-                            float(item['pricing'][condition_field]) == limit_value
-                        ]
-            
-            if 'availability' in query_obj:
-                for condition_field, condition in query_obj['availability'].items():
-                    if '$lt' in condition:
-                        limit_value = condition['$lt']
-                        items = [
-                            item for item in items
-                            if 'availability' in item and
-                            condition_field in item['availability'] and
-                            item['availability'][condition_field] is not None and
-                            float(item['availability'][condition_field]) < limit_value
-                        ]
-                    elif '$gt' in condition:
-                        limit_value = condition['$gt']
-                        items = [
-                            item for item in items
-                            if 'availability' in item and
-                            condition_field in item['availability'] and
-                            item['availability'][condition_field] is not None and
-                            float(item['availability'][condition_field]) > limit_value
-                        ]
-                    elif '$eq' in condition:
-                        limit_value = condition['$eq']
-                        items = [
-                            item for item in items
-                            if 'availability' in item and
-                            condition_field in item['availability'] and
-                            item['availability'][condition_field] is not None and
-                            float(item['availability'][condition_field]) == limit_value
-                        ]
-            
-            if 'orderBy' in query_obj:
-                order_field = query_obj['orderBy']
-                if '/' in order_field:
-                    main_field, sub_field = order_field.split('/')
-                    items.sort(key=lambda x: (
-                        float(x.get(main_field, {}).get(sub_field, float('inf')))
-                        if x.get(main_field, {}).get(sub_field) is not None
-                        else float('inf')
-                    ))
-                else:
-                    items.sort(key=lambda x: float(x.get(order_field, float('inf'))) if x.get(order_field) is not None else float('inf'))
-            
-            if 'limitToFirst' in query_obj:
-                limit = query_obj['limitToFirst']
-                items = items[:limit]
-        
-        return items
-    
+        record_if_slow("firebase", {"node": node, "query": query_obj}, time.perf_counter() - started,
+                       lambda: firebase_download_summary(all_data))
+        return filter_firebase_data(all_data, query_obj)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Firebase query error: {str(e)}"
         )
 
+def filter_firebase_data(
+    all_data: Any,
+    query_obj: Optional[Dict[str, Any]] = None) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+
+    # Applies a query object to the children of a downloaded or mirrored node (see firebase_query.py).
+    # Only the children returned are copied to add "id", since mirrored children are shared.
+
+    if not all_data:
+        return []
+    if not query_obj:
+        return list(all_data.values()) if isinstance(all_data, dict) else all_data
+    if not isinstance(query_obj, dict):
+        raise HTTPException(status_code=400, detail="Firebase query must be an object")
+    try:
+        query = compile_firebase_query(query_obj)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid Firebase query: {e}")
+
+    # Firebase returns nodes whose keys are consecutive integers as lists
+    if not isinstance(all_data, dict):
+        all_data = {str(index): value for index, value in enumerate(all_data) if value is not None}
+    if query.keys is not None:
+        children = ((key, all_data[key]) for key in query.keys if key in all_data)
+    else:
+        children = all_data.items()
+    return [
+        {**value, 'id': key} if isinstance(value, dict) else {'id': key, 'value': value}
+        for key, value in run_firebase_query(query, children)
+    ]
+
+def firebase_download_summary(data: Any) -> Dict[str, Any]:
+
+    # Size of a downloaded node as JSON, for the slow-query log.
+
+    return {
+        "summary": {
+            "bytes_downloaded": len(json.dumps(data, separators=(",", ":"), default=str)),
+            "children": len(data) if isinstance(data, (dict, list)) else 0
+        },
+        "plan": None
+    }
+
 # modification
+
+def invalidate_firebase_cache(node: str) -> None:
+
+    # Drops cached query results for the top-level node that was written.
+
+    cache = get_query_cache("firebase")
+    if cache is None:
+        return
+    root = firebase_node_root(node)
+    removed = cache.invalidate([root])
+    logger.debug("Invalidated %s cached Firebase results for node: %s", removed, root)
+
+# Changes streamed into the mirror (including writes made outside this process) drop cached results
+firebase_mirror.on_change(invalidate_firebase_cache)
+
+def start_firebase_mirror() -> None:
+    if FIREBASE_MIRROR_CONFIG["enabled"]:
+        firebase_mirror.start(initialize_firebase)
+
+def normalize_firebase_data(node: str, data: Dict[str, Any]) -> Dict[str, Any]:
+
+    # Maps flat modification fields onto the node's schema; fields the node does not store are dropped.
+
+    if node == "listings":
+        return {
+            "pricing": {
+                k: v for k, v in data.items()
+                if k in ["price", "weekly_price", "monthly_price", 
+                        "security_deposit", "cleaning_fee", 
+                        "guests_included", "extra_people"]
+            },
+            "availability": {
+                k: v for k, v in data.items()
+                if k in ["availability_30", "availability_60", 
+                        "availability_90", "availability_365", 
+                        "calendar_last_scraped"]
+            }
+        }
+    return {
+        k: v for k, v in data.items()
+        if k in ["host_is_superhost", "host_listings_count"]
+    }
+
+# max_paths: paths per update() call; max_bytes: rough JSON size of one call's payload
+# (the SDKs reject writes over 16 MB). Each update() call is atomic, so a fan-out that
+# needs more than one chunk is applied chunk by chunk.
+FIREBASE_WRITE_CONFIG = {
+    "max_paths": 5000,
+    "max_bytes": 4000000
+}
+
+def firebase_field_paths(fields: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+
+    # Flattens nested fields into deep paths: {"pricing": {"price": 10}} -> {"pricing/price": 10}.
+    # Empty groups produce no path, so writing them cannot clear a subtree.
+
+    paths = {}
+    for name, value in fields.items():
+        if isinstance(value, dict):
+            paths.update(firebase_field_paths(value, f"{prefix}{name}/"))
+        else:
+            paths[f"{prefix}{name}"] = value
+    return paths
+
+def set_field_path(target: Dict[str, Any], path: str, value: Any) -> None:
+    *parents, leaf = path.split("/")
+    for part in parents:
+        target = target.setdefault(part, {})
+    target[leaf] = value
+
+def chunk_firebase_updates(updates: Dict[str, Any]) -> List[Dict[str, Any]]:
+
+    # Splits a multi-path update into chunks within FIREBASE_WRITE_CONFIG.
+
+    chunks, chunk, size = [], {}, 0
+    for path, value in updates.items():
+        item_size = len(path) + len(json.dumps(value, default=str)) + 4
+        if chunk and (len(chunk) >= FIREBASE_WRITE_CONFIG["max_paths"]
+                      or size + item_size > FIREBASE_WRITE_CONFIG["max_bytes"]):
+            chunks.append(chunk)
+            chunk, size = {}, 0
+        chunk[path] = value
+        size += item_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+# Called with the node and the multi-path update (None when it failed, possibly after some
+# chunks were applied) after every write through this module, e.g. to update in-process
+# aggregates derived from a node
+WRITE_LISTENERS: List[Callable[[str, Optional[Dict[str, Any]]], None]] = []
+
+def on_firebase_write(callback: Callable[[str, Optional[Dict[str, Any]]], None]) -> None:
+    WRITE_LISTENERS.append(callback)
+
+@limited("firebase")
+@guarded("firebase", is_firebase_outage)
+@timed_stage("firebase_modify", backend="firebase")
+def apply_firebase_updates(node: str, updates: Dict[str, Any]) -> int:
+
+    # Writes a multi-path update relative to `node`; returns the number of update() calls.
+
+    initialize_firebase()
+    ref = get_reference(node)
+    chunks = chunk_firebase_updates(updates)
+    applied = False
+    try:
+        for chunk in chunks:
+            ref.update(chunk)
+        applied = True
+    finally:
+        invalidate_firebase_cache(node)
+        for callback in WRITE_LISTENERS:
+            callback(node, updates if applied else None)
+    logger.debug("Firebase fan-out of %s paths under %s in %s update(s)", len(updates), node, len(chunks))
+    return len(chunks)
+
+@limited("firebase")
+@guarded("firebase", is_firebase_outage)
+@timed_stage("firebase_modify", backend="firebase")
+def increment_firebase_children(node: str, keys: List[str], data: Dict[str, Any], increment: Dict[str, Any]) -> Dict[str, Any]:
+
+    # Applies an update with increments to each child in its own Reference.transaction, which
+    # reads only that child and retries when it changed in between, so concurrent increments of
+    # the same field are not lost. Each child is atomic; the set of children is not.
+    # Returns the written paths as a multi-path update relative to `node`.
+
+    initialize_firebase()
+    ref = get_reference(node)
+    written: Dict[str, Any] = {}
+    applied = False
+    try:
+        for key in keys:
+            child_updates: Dict[str, Any] = {}
+
+            def apply(child: Any, key: str = key, child_updates: Dict[str, Any] = child_updates) -> Any:
+                # Runs again with the new value on every retry, so the paths are recomputed each time
+                child_updates.clear()
+                child_updates.update(firebase_fan_out(node, "update", [key], data, increment, {key: child}))
+                for path, value in child_updates.items():
+                    child = with_path(child, path.split("/")[1:], value)
+                return child
+
+            ref.child(key).transaction(apply)
+            written.update(child_updates)
+        applied = True
+    finally:
+        invalidate_firebase_cache(node)
+        for callback in WRITE_LISTENERS:
+            callback(node, written if applied else None)
+    logger.debug("Firebase increment of %s children under %s in %s transaction(s)", len(keys), node, len(keys))
+    return written
+
+def increment_value(current: Any, path: str, amount: Any) -> Any:
+    value = current
+    for part in path.split("/"):
+        value = value.get(part) if isinstance(value, dict) else None
+    if value is None or value == "":
+        return amount
+    if not isinstance(value, (int, float)):
+        value = float(value)
+    return value + amount
+
+def firebase_fan_out(
+    node: str,
+    operation: str,
+    keys: List[str],
+    data: Dict[str, Any],
+    increment: Dict[str, Any],
+    current: Dict[str, Any]) -> Dict[str, Any]:
+
+    # The multi-path update writing `operation` to every key: insert sets the whole child,
+    # update writes deep field paths (listings/123/pricing/cleaning_fee), delete nulls the child.
+
+    updates = {}
+    fields = normalize_firebase_data(node, data)
+    increments = firebase_field_paths(normalize_firebase_data(node, increment))
+    for key in keys:
+        if operation == "delete":
+            updates[key] = None
+            continue
+        try:
+            numeric_id = int(key)
+        except ValueError:
+            numeric_id = None
+        if operation == "insert":
+            child = dict(fields)
+            if numeric_id is not None:
+                child["id"] = numeric_id
+            updates[key] = child
+            continue
+        paths = firebase_field_paths(fields)
+        for path, amount in increments.items():
+            paths[path] = increment_value(current.get(key), path, amount)
+        if numeric_id is not None:
+            paths["id"] = numeric_id
+        for path, value in paths.items():
+            updates[f"{key}/{path}"] = value
+    return updates
+
 def modify_firebase(
     node: str,
     key: str,
     operation: str,
-    data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    data: Optional[Dict[str, Any]] = None,
+    keys: Optional[List[str]] = None,
+    where: Optional[Dict[str, Any]] = None,
+    increment: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
 
     # Performs CRUD operations on Firebase nodes with data normalization.
     # Different schemas are applied based on the target node type.
+    # Targets one child (`key`), a set of children (`keys`) or every child matching `where`, a
+    # query object resolved through query_firebase. All targets are written with one fan-out
+    # update() of deep paths, chunked by FIREBASE_WRITE_CONFIG, so an update leaves the fields
+    # it does not mention alone. `increment` adds to numeric fields (e.g. {"cleaning_fee": 10});
+    # each target is then written in its own transaction instead of the fan-out.
 
     try:
-        initialize_firebase()
-        ref = get_reference(node)
-        
-        if operation in ["insert", "update"]:
-            if data is None:
-                raise ValueError("Data required for insert/update operations")
-                
-            if node == "listings":
-                normalized_data = {
-                    "pricing": {
-                        k: v for k, v in data.items()
-                        if k in ["price", "weekly_price", "monthly_price", 
-                                "security_deposit", "cleaning_fee", 
-                                "guests_included", "extra_people"]
-                    },
-                    "availability": {
-                        k: v for k, v in data.items()
-                        if k in ["availability_30", "availability_60", 
-                                "availability_90", "availability_365", 
-                                "calendar_last_scraped"]
-                    }
-                }
-            else:
-                normalized_data = {
-                    k: v for k, v in data.items()
-                    if k in ["host_is_superhost", "host_listings_count"]
-                }
-            
-            if not key:
-                child_ref = ref.push()
-                key = child_ref.key
-            else:
-                key = key.strip('"')
-                child_ref = ref.child(key)
-                
-            try:
-                numeric_id = int(key)
-                normalized_data["id"] = numeric_id
-            except ValueError:
-                pass
-                
-            if operation == "insert":
-                child_ref.set(normalized_data)
-            else:
-                child_ref.update(normalized_data)
-                
-            return {
-                "message": f"Firebase {operation} successful",
-                "key": key
-            }
-            
-        elif operation == "delete":
-            if not key:
-                raise ValueError("Key required for delete operation")
-                
-            key = key.strip('"')
-            ref.child(key).delete()
-            return {
-                "message": "Firebase delete successful",
-                "key": key
-            }
-            
-        else:
+        if operation not in ("insert", "update", "delete"):
             raise ValueError(f"Unsupported operation: {operation}")
-            
+        if operation != "delete" and data is None and not increment:
+            raise ValueError("Data required for insert/update operations")
+        if increment and operation != "update":
+            raise ValueError("Increments apply to update operations only")
+
+        if where is not None:
+            if not isinstance(where, dict) or not where:
+                raise ValueError("where must be a non-empty Firebase query object")
+            matches = query_firebase(node, where)
+            targets = list(dict.fromkeys(str(item["id"]) for item in matches if isinstance(item, dict) and "id" in item))
+        elif keys is not None:
+            targets = list(dict.fromkeys(str(k).strip('"') for k in keys if str(k).strip('"')))
+        elif key:
+            targets = [key.strip('"')]
+        elif operation == "insert":
+            targets = [generate_push_key()]
+        else:
+            raise ValueError(f"Key required for {operation} operation")
+
+        if not targets:
+            return {"message": f"No Firebase children matched, nothing to {operation}", "keys": []}
+        if increment:
+            updates = increment_firebase_children(node, targets, data or {}, increment)
+            update_calls = len(targets)
+        else:
+            updates = firebase_fan_out(node, operation, targets, data or {}, {}, {})
+            update_calls = apply_firebase_updates(node, updates)
+
+        result = {"message": f"Firebase {operation} successful"}
+        if len(targets) == 1 and keys is None and where is None:
+            result["key"] = targets[0]
+        else:
+            result.update({"keys": targets, "paths": len(updates), "update_calls": update_calls})
+        return result
+
     except ValueError as e:
         raise HTTPException(
             status_code=400,
             detail=str(e)
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Firebase modification error: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+def generate_push_key() -> str:
+
+    # A chronologically ordered key in the format of Reference.push(), generated locally so
+    # inserts without a key can join a multi-path update instead of costing a round trip each.
+
+    now = int(time.time() * 1000)
+    timestamp = ""
+    for _ in range(8):
+        timestamp = PUSH_CHARS[now % 64] + timestamp
+        now //= 64
+    return timestamp + "".join(PUSH_CHARS[b % 64] for b in os.urandom(12))
+
+def modify_firebase_batch(node: str, mods: List[tuple]) -> Dict[str, Any]:
+
+    # Applies many modifications to a node with a single multi-path update(), which Firebase
+    # applies atomically (split only past FIREBASE_WRITE_CONFIG). mods: [(item index, operation, key, data), ...].
+    # Writes to the same child are folded in order first, since a multi-path update may not
+    # contain a path together with one of its ancestors:
+    # insert = set the child, update = write its deep field paths, delete = set it to null.
+    # Returns the written keys per item and {item index: error} for invalid items.
+
+    errors: Dict[int, str] = {}
+    keys: Dict[int, str] = {}
+    children: Dict[str, tuple] = {}  # key -> ("set", value) | ("update", paths) | ("delete", None)
+    for index, operation, key, data in mods:
+        key = (key or "").strip('"')
+        if operation in ("insert", "update"):
+            if data is None:
+                errors[index] = "Data required for insert/update operations"
+                continue
+            key = key or generate_push_key()
+            fields = normalize_firebase_data(node, data)
+            try:
+                fields["id"] = int(key)
+            except ValueError:
+                pass
+            kind, current = children.get(key, (None, None))
+            if operation == "insert":
+                children[key] = ("set", fields)
+            elif kind == "set":
+                for path, value in firebase_field_paths(fields).items():
+                    set_field_path(current, path, value)
+            elif kind == "update":
+                current.update(firebase_field_paths(fields))
+            else:
+                # Updating a just deleted child recreates it with these fields
+                children[key] = ("set", fields) if kind == "delete" else ("update", firebase_field_paths(fields))
+        elif operation == "delete":
+            if not key:
+                errors[index] = "Key required for delete operation"
+                continue
+            children[key] = ("delete", None)
+        else:
+            errors[index] = f"Unsupported operation: {operation}"
+            continue
+        keys[index] = key
+
+    updates = {}
+    for key, (kind, value) in children.items():
+        if kind == "update":
+            for path, path_value in value.items():
+                updates[f"{key}/{path}"] = path_value
+        else:
+            updates[key] = value
+    update_calls = apply_firebase_updates(node, updates) if updates else 0
+    return {"paths": len(updates), "update_calls": update_calls, "keys": keys, "errors": errors}
@@ -0,0 +1,265 @@
+import logging
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from firebase_admin import db
+
+from metrics import register_collector, stage
+
+logger = logging.getLogger("chatdb.firebase_mirror")
+
+# In-process mirror of Firebase nodes.
+# Each mirrored node is subscribed to with Reference.listen(): the first event is a put of the
+# whole node (the seed), later put/patch events carry only what changed and are applied in
+# place. query_firebase reads a mirrored node from memory instead of downloading it, and /query
+# reports how fresh the mirror is. A node whose listener has not delivered its seed yet (or
+# could not start) is downloaded as before.
+# Children are never mutated once stored: an event replaces the dicts along its path, so a
+# snapshot taken by a query stays consistent while later events are applied.
+# The listener is restarted every `resync_interval_s`, which re-seeds the node; this bounds
+# how long a silently dropped stream can go unnoticed.
+
+# nodes: top-level nodes to mirror
+# resync_interval_s: listener restart (and re-seed) interval
+# footprint_interval_s: how long a memory estimate is reused before it is recomputed
+FIREBASE_MIRROR_CONFIG = {
+    "enabled": True,
+    "nodes": ("listings", "hosts"),
+    "resync_interval_s": 3600.0,
+    "footprint_interval_s": 30.0
+}
+
+EVENT_TYPES = ("put", "patch")
+
+
+def with_path(value: Any, path: List[str], new_value: Any) -> Any:
+
+    # A copy of `value` with the child at `path` set to `new_value` (None deletes it, and
+    # parents left empty are deleted too, as in Firebase). Only the dicts along the path are copied.
+
+    node = dict(value) if isinstance(value, dict) else {}
+    if len(path) == 1:
+        if new_value is None:
+            node.pop(path[0], None)
+        else:
+            node[path[0]] = new_value
+    else:
+        child = with_path(node.get(path[0]), path[1:], new_value)
+        if child:
+            node[path[0]] = child
+        else:
+            node.pop(path[0], None)
+    return node
+
+def as_children(data: Any) -> Dict[str, Any]:
+    # Firebase returns nodes whose keys are consecutive integers as lists
+    if isinstance(data, dict):
+        return dict(data)
+    if isinstance(data, list):
+        return {str(i): value for i, value in enumerate(data) if value is not None}
+    return {}
+
+def estimate_bytes(value: Any) -> int:
+    # Rough in-memory size of decoded JSON: containers, keys and leaves
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, child in value.items():
+            size += sys.getsizeof(key) + estimate_bytes(child)
+    elif isinstance(value, list):
+        for child in value:
+            size += estimate_bytes(child)
+    return size
+
+
+class MirroredNode:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.children: Dict[str, Any] = {}
+        self.seeded_at: Optional[float] = None
+        self.last_event_at: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.events = {event_type: 0 for event_type in EVENT_TYPES}
+        self.registration = None
+        self.footprint = (0.0, 0)  # (computed at, bytes)
+
+
+class FirebaseMirror:
+
+    def __init__(self, nodes: tuple):
+        self.nodes = {name: MirroredNode(name) for name in nodes}
+        self._listeners: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def on_change(self, callback: Callable[[str], None]) -> None:
+        # Called with the node name after every applied event (e.g. to drop cached results)
+        self._listeners.append(callback)
+
+    # Listening
+
+    def _listen(self, mirrored: MirroredNode) -> None:
+        if mirrored.registration is not None:
+            try:
+                mirrored.registration.close()
+            except Exception as e:
+                logger.warning("Closing the %s listener failed: %s", mirrored.name, e)
+        mirrored.started_at = time.time()
+        mirrored.registration = db.reference(f"/{mirrored.name}").listen(
+            lambda event: self._on_event(mirrored, event))
+        logger.info("Listening to Firebase /%s", mirrored.name)
+
+    def start(self, initialize: Callable[[], None]) -> None:
+
+        # Subscribes to every mirrored node and starts the resync thread. `initialize` sets up
+        # the Firebase app; when it fails the nodes stay unmirrored and queries download them.
+
+        if self._thread is not None:
+            return
+        try:
+            initialize()
+            for mirrored in self.nodes.values():
+                self._listen(mirrored)
+        except Exception as e:
+            logger.error("Firebase mirror not started: %s", e)
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="firebase-mirror-resync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        for mirrored in self.nodes.values():
+            if mirrored.registration is not None:
+                mirrored.registration.close()
+                mirrored.registration = None
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(FIREBASE_MIRROR_CONFIG["resync_interval_s"]):
+            for mirrored in self.nodes.values():
+                try:
+                    self._listen(mirrored)
+                except Exception as e:
+                    logger.error("Restarting the %s listener failed: %s", mirrored.name, e)
+
+    def _on_event(self, mirrored: MirroredNode, event: Any) -> None:
+        try:
+            self.apply(mirrored.name, event.event_type, event.path, event.data)
+        except Exception:
+            logger.exception("Could not apply %s event at /%s%s", event.event_type, mirrored.name, event.path)
+
+    def apply(self, node: str, event_type: str, path: str, data: Any) -> None:
+
+        # Applies one streaming event: put replaces the value at `path`, patch sets each of
+        # its (possibly multi-segment) keys relative to `path`.
+
+        if event_type not in EVENT_TYPES:
+            return
+        mirrored = self.nodes[node]
+        parts = [part for part in path.split("/") if part]
+        if event_type == "put":
+            changes = [(parts, data)]
+        else:
+            changes = [(parts + [part for part in key.split("/") if part], value) for key, value in (data or {}).items()]
+        with stage("firebase_mirror_apply"):
+            with self._lock:
+                for change_path, value in changes:
+                    if not change_path:
+                        mirrored.children = as_children(value)
+                        mirrored.seeded_at = time.time()
+                        continue
+                    key = change_path[0]
+                    if len(change_path) == 1:
+                        child = value
+                    else:
+                        child = with_path(mirrored.children.get(key), change_path[1:], value) or None
+                    if child is None:
+                        mirrored.children.pop(key, None)
+                    else:
+                        mirrored.children[key] = child
+                mirrored.last_event_at = time.time()
+                mirrored.events[event_type] += 1
+        for callback in self._listeners:
+            callback(node)
+
+    # Reading
+
+    def ready(self, node: str) -> bool:
+        mirrored = self.nodes.get(node.strip("/"))
+        return mirrored is not None and mirrored.seeded_at is not None
+
+    def snapshot(self, node: str) -> Dict[str, Any]:
+
+        # The node's children as of now. The dict is a copy; the children in it are shared
+        # and must not be modified.
+
+        mirrored = self.nodes[node.strip("/")]
+        with self._lock:
+            return dict(mirrored.children)
+
+    def freshness(self, node: str) -> Dict[str, Any]:
+        mirrored = self.nodes.get(node.strip("/"))
+        if mirrored is None or mirrored.seeded_at is None:
+            return {"source": "download"}
+        now = time.time()
+        return {
+            "source": "mirror",
+            "seeded_seconds_ago": round(now - mirrored.seeded_at, 3),
+            "last_event_seconds_ago": round(now - mirrored.last_event_at, 3),
+            "events_applied": sum(mirrored.events.values())
+        }
+
+    def footprint(self, mirrored: MirroredNode) -> int:
+        computed_at, size = mirrored.footprint
+        if time.monotonic() - computed_at > FIREBASE_MIRROR_CONFIG["footprint_interval_s"]:
+            with self._lock:
+                children = dict(mirrored.children)
+            size = estimate_bytes(children)
+            mirrored.footprint = (time.monotonic(), size)
+        return size
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "ready": mirrored.seeded_at is not None,
+                "children": len(mirrored.children),
+                "bytes": self.footprint(mirrored) if mirrored.seeded_at is not None else 0,
+                "events": dict(mirrored.events),
+                "last_event_age_seconds": time.time() - mirrored.last_event_at if mirrored.last_event_at else None
+            }
+            for name, mirrored in self.nodes.items()
+        }
+
+
+firebase_mirror = FirebaseMirror(FIREBASE_MIRROR_CONFIG["nodes"])
+
+
+def render_mirror_metrics() -> List[str]:
+    stats = firebase_mirror.stats()
+    lines = []
+    for field, name, documentation in (
+        ("ready", "chatdb_firebase_mirror_ready", "Whether the node is served from the in-process mirror."),
+        ("children", "chatdb_firebase_mirror_children", "Children held by the mirror per node."),
+        ("bytes", "chatdb_firebase_mirror_bytes", "Estimated memory held by the mirror per node."),
+    ):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        for node, node_stats in stats.items():
+            lines.append(f'{name}{{node="{node}"}} {int(node_stats[field])}')
+    lines.append("# HELP chatdb_firebase_mirror_last_event_age_seconds Time since the mirror last applied an event per node.")
+    lines.append("# TYPE chatdb_firebase_mirror_last_event_age_seconds gauge")
+    for node, node_stats in stats.items():
+        if node_stats["last_event_age_seconds"] is not None:
+            lines.append(f'chatdb_firebase_mirror_last_event_age_seconds{{node="{node}"}} {node_stats["last_event_age_seconds"]:.3f}')
+    lines.append("# HELP chatdb_firebase_mirror_events_total Streaming events applied to the mirror per node and type.")
+    lines.append("# TYPE chatdb_firebase_mirror_events_total counter")
+    for node, node_stats in stats.items():
+        for event_type, count in node_stats["events"].items():
+            lines.append(f'chatdb_firebase_mirror_events_total{{node="{node}",type="{event_type}"}} {count}')
+    return lines
+
+register_collector(render_mirror_metrics)
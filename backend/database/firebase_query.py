@@ -0,0 +1,147 @@
+import heapq
+import operator
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Compiler for Firebase query objects.
+# A query object such as
+#   {"pricing": {"price": {"$gte": 50, "$lt": 150}}, "orderBy": "pricing/price", "limitToFirst": 10}
+# is turned into one predicate that checks every condition of a child in a single pass, with
+# the operands converted to numbers once at compile time. With limitToFirst, only the first
+# `limit` children are kept (by a heap when ordered), so the matches are never fully sorted.
+# A condition matches only children whose field holds a number (or a numeric string).
+# "keys" restricts the query to the listed children, which are then read in that order
+# (e.g. listings found by a near search, nearest first).
+
+# Groups of listing fields that conditions may filter on
+FILTER_GROUPS = ("pricing", "availability")
+
+COMPARISONS = {
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$eq": operator.eq,
+    "$ne": operator.ne
+}
+
+Test = Tuple[Callable[[float, Any], bool], Any]
+
+
+class FirebaseQuery(NamedTuple):
+    predicate: Callable[[Any], bool]
+    order_key: Optional[Callable[[Any], float]]
+    limit: Optional[int]
+    keys: Optional[List[str]]
+
+
+def as_number(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def operand_number(field: str, op: str, value: Any) -> float:
+    number = as_number(value)
+    if number is None:
+        raise ValueError(f"{op} on {field} needs a number, got {value!r}")
+    return number
+
+def compile_condition(field: str, condition: Any) -> List[Test]:
+
+    # One (test, operand) pair per operator of a field's condition; a bare value means $eq.
+
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    tests = []
+    for op, value in condition.items():
+        if op in COMPARISONS:
+            tests.append((COMPARISONS[op], operand_number(field, op, value)))
+        elif op == "$in":
+            if not isinstance(value, list):
+                raise ValueError(f"$in on {field} needs a list")
+            tests.append((lambda number, members: number in members,
+                          frozenset(operand_number(field, op, member) for member in value)))
+        elif op == "$between":
+            if not isinstance(value, list) or len(value) != 2:
+                raise ValueError(f"$between on {field} needs [low, high]")
+            low, high = (operand_number(field, op, bound) for bound in value)
+            tests.append((lambda number, bounds: bounds[0] <= number <= bounds[1], (low, high)))
+        else:
+            raise ValueError(f"Unsupported Firebase operator {op} on {field}")
+    return tests
+
+def compile_predicate(query_obj: Dict[str, Any]) -> Callable[[Any], bool]:
+    checks = []  # (group, field, tests)
+    for group in FILTER_GROUPS:
+        conditions = query_obj.get(group)
+        if conditions is None:
+            continue
+        if not isinstance(conditions, dict):
+            raise ValueError(f"{group} conditions must be an object")
+        for field, condition in conditions.items():
+            checks.append((group, field, compile_condition(field, condition)))
+
+    if not checks:
+        return lambda child: True
+
+    def predicate(child: Any) -> bool:
+        if not isinstance(child, dict):
+            return False
+        for group, field, tests in checks:
+            values = child.get(group)
+            if not isinstance(values, dict):
+                return False
+            number = as_number(values.get(field))
+            if number is None:
+                return False
+            for test, operand in tests:
+                if not test(number, operand):
+                    return False
+        return True
+
+    return predicate
+
+def compile_order_key(order_field: str) -> Callable[[Any], float]:
+    # Children without a numeric value sort last
+    path = order_field.strip("/").split("/")
+
+    def order_key(child: Any) -> float:
+        value = child
+        for part in path:
+            if not isinstance(value, dict):
+                return float("inf")
+            value = value.get(part)
+        number = as_number(value)
+        return float("inf") if number is None else number
+
+    return order_key
+
+def compile_firebase_query(query_obj: Dict[str, Any]) -> FirebaseQuery:
+
+    # Raises ValueError for operators, operands or limits the query cannot use.
+
+    order_key = compile_order_key(query_obj["orderBy"]) if query_obj.get("orderBy") else None
+    limit = query_obj.get("limitToFirst")
+    if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 0):
+        raise ValueError(f"limitToFirst must be a non-negative integer, got {limit!r}")
+    keys = query_obj.get("keys")
+    if keys is not None:
+        if not isinstance(keys, list):
+            raise ValueError("keys must be a list")
+        keys = [str(key) for key in keys]
+    return FirebaseQuery(compile_predicate(query_obj), order_key, limit, keys)
+
+def run_firebase_query(query: FirebaseQuery, children: Iterable[Tuple[str, Any]]) -> List[Tuple[str, Any]]:
+
+    # Matching (key, child) pairs in result order. Ties keep the node's order, as a stable sort would.
+
+    matches = ((key, child) for key, child in children if query.predicate(child))
+    if query.order_key is None:
+        return list(matches if query.limit is None else islice(matches, query.limit))
+    sort_key = lambda pair: query.order_key(pair[1])
+    if query.limit is None:
+        return sorted(matches, key=sort_key)
+    return heapq.nsmallest(query.limit, matches, key=sort_key)
@@ -0,0 +1,217 @@
+import heapq
+import logging
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from database.derived_index import DerivedIndex
+from database.mysql_connector import get_connection, query_mysql
+from metrics import register_collector, stage
+
+logger = logging.getLogger("chatdb.geo_index")
+
+# Geospatial search over listing coordinates.
+# "Near" questions ("within 1 km of Union Station", "the 5 closest to LAX") are answered from an
+# in-process grid of Listings.latitude/longitude: points are bucketed into cells of `cell_deg`
+# degrees, a radius search reads only the cells overlapping the circle's bounding box, and a
+# k-nearest search reads rings of cells outwards until no unread cell can hold a closer point.
+# The grid is rebuilt in the background after a write to Listings and every
+# `refresh_interval_s` (see derived_index.py). Until the first build completes, searches run
+# in MySQL on the SPATIAL index of Listings.location.
+
+# cell_deg: grid cell size in degrees (0.01 is about 1.1 km of latitude)
+# refresh_interval_s: age after which the grid is rebuilt even without writes
+# max_matches: most listings a search returns, nearest first
+# default_radius_km: radius used when a near query gives neither radius_km nor k
+GEO_INDEX_CONFIG = {
+    "enabled": True,
+    "cell_deg": 0.01,
+    "refresh_interval_s": 600,
+    "max_matches": 2000,
+    "default_radius_km": 1.0
+}
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+Point = Tuple[Any, float, float]  # (listing id, latitude, longitude)
+
+
+class InvalidNearQuery(HTTPException):
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=400, detail=f"Invalid near query: {detail}")
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def parse_near(near: Any) -> Dict[str, Any]:
+
+    # Validates a near object from the converted query:
+    #   {"latitude": 34.05, "longitude": -118.24, "radius_km": 1, "k": 10}
+    # radius_km and k are both optional; without either, default_radius_km applies.
+
+    if not isinstance(near, dict):
+        raise InvalidNearQuery("expected an object with latitude and longitude")
+    try:
+        latitude = float(near["latitude"])
+        longitude = float(near["longitude"])
+        radius_km = float(near["radius_km"]) if near.get("radius_km") is not None else None
+        k = int(near["k"]) if near.get("k") is not None else None
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidNearQuery(f"bad or missing field {e}")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise InvalidNearQuery("latitude/longitude out of range")
+    if (radius_km is not None and radius_km <= 0) or (k is not None and k <= 0):
+        raise InvalidNearQuery("radius_km and k must be positive")
+    if radius_km is None and k is None:
+        radius_km = GEO_INDEX_CONFIG["default_radius_km"]
+    return {"latitude": latitude, "longitude": longitude, "radius_km": radius_km, "k": k}
+
+
+class GridIndex:
+
+    # Immutable grid of points; searches return (distance in metres, listing id), nearest first.
+
+    def __init__(self, points: Iterable[Point], cell_deg: float):
+        self.cell_deg = cell_deg
+        self.cells: Dict[Tuple[int, int], List[Point]] = {}
+        self.size = 0
+        for point in points:
+            self.cells.setdefault(self._cell(point[1], point[2]), []).append(point)
+            self.size += 1
+        rows = [cell[0] for cell in self.cells] or [0]
+        columns = [cell[1] for cell in self.cells] or [0]
+        self.bounds = (min(rows), max(rows), min(columns), max(columns))
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_deg), math.floor(longitude / self.cell_deg)
+
+    def _scan(self, cells: Iterable[Tuple[int, int]], latitude: float, longitude: float,
+              radius_m: Optional[float], found: List[Tuple[float, Any]]) -> None:
+        for cell in cells:
+            for listing_id, lat, lon in self.cells.get(cell, ()):
+                distance = haversine_m(latitude, longitude, lat, lon)
+                if radius_m is None or distance <= radius_m:
+                    found.append((distance, listing_id))
+
+    def within(self, latitude: float, longitude: float, radius_m: float) -> List[Tuple[float, Any]]:
+        dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+        dlon = min(180.0, dlat / max(math.cos(math.radians(min(89.9, abs(latitude) + dlat))), 1e-6))
+        low_row, low_col = self._cell(latitude - dlat, longitude - dlon)
+        high_row, high_col = self._cell(latitude + dlat, longitude + dlon)
+        found: List[Tuple[float, Any]] = []
+        if (high_row - low_row + 1) * (high_col - low_col + 1) > len(self.cells):
+            # The circle spans more cells than are occupied: reading the occupied ones is cheaper
+            self._scan(list(self.cells), latitude, longitude, radius_m, found)
+        else:
+            self._scan(((row, col) for row in range(low_row, high_row + 1) for col in range(low_col, high_col + 1)),
+                       latitude, longitude, radius_m, found)
+        found.sort()
+        return found
+
+    def nearest(self, latitude: float, longitude: float, k: int,
+                radius_m: Optional[float] = None) -> List[Tuple[float, Any]]:
+        center_row, center_col = self._cell(latitude, longitude)
+        low_row, high_row, low_col, high_col = self.bounds
+        last_ring = max(abs(center_row - low_row), abs(center_row - high_row),
+                        abs(center_col - low_col), abs(center_col - high_col))
+        found: List[Tuple[float, Any]] = []
+        visited = 0
+        for ring in range(last_ring + 1):
+            if ring == 0:
+                cells = [(center_row, center_col)]
+            else:
+                cells = [(center_row + d_row, center_col + d_col)
+                         for d_row in range(-ring, ring + 1)
+                         for d_col in ((-ring, ring) if abs(d_row) < ring else range(-ring, ring + 1))]
+            visited += len(cells)
+            if visited > len(self.cells):
+                # Sparse around the query point: one pass over every point is cheaper than more rings
+                found = []
+                self._scan(list(self.cells), latitude, longitude, radius_m, found)
+                break
+            self._scan(cells, latitude, longitude, radius_m, found)
+            # No point in an unread ring is closer than this
+            reach_deg = ring * self.cell_deg
+            reach_m = reach_deg * METERS_PER_DEGREE * math.cos(math.radians(min(89.9, abs(latitude) + reach_deg)))
+            if radius_m is not None and reach_m >= radius_m:
+                break
+            if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= reach_m:
+                break
+        found.sort()
+        return found[:k]
+
+
+def load_points() -> GridIndex:
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, latitude, longitude FROM Listings "
+                "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+            )
+            points = [(row["id"], float(row["latitude"]), float(row["longitude"])) for row in cursor.fetchall()]
+    finally:
+        connection.close()
+    return GridIndex(points, GEO_INDEX_CONFIG["cell_deg"])
+
+
+geo_index = DerivedIndex("geo", "Listings", load_points, GEO_INDEX_CONFIG["refresh_interval_s"])
+
+
+def start_geo_index() -> None:
+    if GEO_INDEX_CONFIG["enabled"]:
+        geo_index.refresh_in_background()
+
+def mysql_near(latitude: float, longitude: float, radius_km: Optional[float],
+               k: Optional[int]) -> List[Tuple[float, Any]]:
+
+    # The same search in MySQL, used until the grid is built. A radius is first narrowed to its
+    # bounding box with MBRContains, which the SPATIAL index on Listings.location answers.
+
+    center = f"ST_SRID(POINT({longitude!r}, {latitude!r}), 4326)"
+    conditions = ["latitude IS NOT NULL", "longitude IS NOT NULL"]
+    if radius_km is not None:
+        dlat = math.degrees(radius_km * 1000 / EARTH_RADIUS_M)
+        dlon = min(179.9, dlat / max(math.cos(math.radians(min(89.9, abs(latitude) + dlat))), 1e-6))
+        south, north = max(-90.0, latitude - dlat), min(90.0, latitude + dlat)
+        west, east = max(-180.0, longitude - dlon), min(180.0, longitude + dlon)
+        box = f"POLYGON(({west!r} {south!r}, {east!r} {south!r}, {east!r} {north!r}, {west!r} {north!r}, {west!r} {south!r}))"
+        conditions.append(f"MBRContains(ST_GeomFromText('{box}', 4326, 'axis-order=long-lat'), location)")
+    limit = min(k or GEO_INDEX_CONFIG["max_matches"], GEO_INDEX_CONFIG["max_matches"])
+    sql = (f"SELECT id, ST_Distance_Sphere(location, {center}) AS distance_m FROM Listings "
+           f"WHERE {' AND '.join(conditions)}"
+           + (f" HAVING distance_m <= {radius_km * 1000!r}" if radius_km is not None else "")
+           + f" ORDER BY distance_m LIMIT {limit};")
+    return [(float(row["distance_m"]), row["id"]) for row in query_mysql(sql)]
+
+def find_near(near: Dict[str, Any]) -> Tuple[List[Tuple[float, Any]], str]:
+
+    # Listings matching a parsed near object, nearest first, and where they were found.
+
+    radius_m = near["radius_km"] * 1000 if near["radius_km"] is not None else None
+    limit = min(near["k"] or GEO_INDEX_CONFIG["max_matches"], GEO_INDEX_CONFIG["max_matches"])
+    grid = geo_index.current()
+    if grid is None:
+        return mysql_near(near["latitude"], near["longitude"], near["radius_km"], near["k"]), "mysql"
+    with stage("geo_search"):
+        if near["k"] is None:
+            return grid.within(near["latitude"], near["longitude"], radius_m)[:limit], "index"
+        return grid.nearest(near["latitude"], near["longitude"], limit, radius_m), "index"
+
+
+def render_geo_metrics() -> List[str]:
+    grid = geo_index.current()
+    return geo_index.render_metrics("chatdb_geo_index") + [
+        "# HELP chatdb_geo_index_points Listings in the in-process grid.",
+        "# TYPE chatdb_geo_index_points gauge",
+        f"chatdb_geo_index_points {grid.size if grid is not None else 0}"
+    ]
+
+register_collector(render_geo_metrics)
@@ -1,18 +1,32 @@
+import itertools
+import logging
 import pymongo
 import json
+import time
 import numpy as np
 from fastapi import HTTPException
 from bson import ObjectId
-from typing import List, Dict, Any, Optional, Union
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Union
 from pymongo.collection import Collection
 from pymongo.database import Database
+from database.query_cache import get_query_cache, canonicalize_query, mongo_read_collections
+from database.slow_query_log import record_if_slow, summarize_mongo_plan
+from admission import admit, limited
+from circuit_breaker import caused_by, guard, guarded
+from metrics import timed_stage, BACKEND_ERRORS
+from tracing import lazy_json
+
+logger = logging.getLogger("chatdb.mongodb")
 
 # replace with actual MongoDB Server config values on your system if needed
 # These values must be replaced with actual credentials before deployment
 MONGO_CONFIG = {
     "host": "localhost",
     "port": 27017,
-    "database": "airbnb_db"
+    "database": "airbnb_db",
+    "serverSelectionTimeoutMS": 5000  # bounds how long a request waits on an unreachable server
 }
 
 COLLECTIONS = {
@@ -21,6 +35,9 @@ COLLECTIONS = {
     "media": "media"
 }
 
+# Cursors opened with these options return undecoded BSON bytes per document
+RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
 def get_database() -> Database:
     try:
         client = pymongo.MongoClient(**{k: v for k, v in MONGO_CONFIG.items() if k != "database"})
@@ -31,6 +48,10 @@ def get_database() -> Database:
             detail=f"Failed to connect to MongoDB: {str(e)}"
         )
 
+def is_mongodb_outage(error: BaseException) -> bool:
+    # ConnectionFailure covers server selection timeouts, network errors and lost primaries
+    return caused_by(error, (pymongo.errors.ConnectionFailure,))
+
 def get_collection(collection_name: str) -> Collection:
     if collection_name not in COLLECTIONS.values():
         raise HTTPException(
@@ -52,36 +73,88 @@ def convert_objectid_to_str(doc: Any) -> Any:
         return str(doc)
     return doc
 
+@timed_stage("mongodb", backend="mongodb")
 def query_mongodb(
     mongo_filter: Union[Dict[str, Any], List[Dict[str, Any]]],
-    collection_name: str = "listings_meta"
+    collection_name: str = "listings_meta",
+    convert: bool = True
 ) -> List[Dict[str, Any]]:
+
+    # Non-empty results are cached per canonical filter/pipeline until a write
+    # touches the queried collection or one of its $lookup sources.
+    # Empty results are not cached, since query errors are also reported as [].
+    # With convert=False the raw documents are returned (ObjectId, NaN, ...) for
+    # callers that encode the response with fast_json, which handles those types itself.
+
+    cache = get_query_cache("mongodb")
+    key = f"{collection_name}:{canonicalize_query(mongo_filter)}"
+    results = cache.get(key) if cache is not None else None
+    if results is None:
+        with admit("mongodb"), guard("mongodb", is_mongodb_outage):
+            started = time.perf_counter()
+            results = _execute_mongodb_query(mongo_filter, collection_name)
+        record_if_slow("mongodb", {"collection": collection_name, "query": mongo_filter}, time.perf_counter() - started,
+                       lambda: explain_mongodb(mongo_filter, collection_name))
+        if cache is not None and results:
+            cache.put(key, results, mongo_read_collections(mongo_filter, collection_name))
+    if not convert:
+        return list(results)
+    return convert_objectid_to_str(results)
+
+def stream_mongodb(
+    mongo_filter: Union[Dict[str, Any], List[Dict[str, Any]]],
+    collection_name: str = "listings_meta"
+) -> Iterator[RawBSONDocument]:
+
+    # Passthrough for streamed responses: documents come back as RawBSONDocument (undecoded
+    # BSON bytes) straight from the cursor, one batch at a time as the caller iterates, so
+    # the result is never held in full and is not cached. The query runs and its first batch
+    # is read within the MongoDB admission slot and circuit; later batches are read as the
+    # response is written, and an error there ends the stream early.
+
+    with admit("mongodb"), guard("mongodb", is_mongodb_outage):
+        started = time.perf_counter()
+        cursor = iter(_execute_mongodb_query(mongo_filter, collection_name, RAW_BSON_OPTIONS, lazy=True))
+        first = next(cursor, None)
+    record_if_slow("mongodb", {"collection": collection_name, "query": mongo_filter}, time.perf_counter() - started,
+                   lambda: explain_mongodb(mongo_filter, collection_name))
+    return itertools.chain([first], cursor) if first is not None else iter(())
+
+def _execute_mongodb_query(
+    mongo_filter: Union[Dict[str, Any], List[Dict[str, Any]]],
+    collection_name: str = "listings_meta",
+    codec_options: Optional[CodecOptions] = None,
+    lazy: bool = False
+) -> Iterable[Dict[str, Any]]:
+    # With lazy=True the open cursor is returned unread instead of a list
+    collect = iter if lazy else list
     try:
-        print(f"MongoDB Query: {json.dumps(mongo_filter, default=str)}")
+        logger.debug("MongoDB Query: %s", lazy_json(mongo_filter))
+        if isinstance(mongo_filter, dict) and "collection" in mongo_filter:
+            collection_name = mongo_filter["collection"]
         coll = get_collection(collection_name)
+        if codec_options is not None:
+            coll = coll.with_options(codec_options=codec_options)
         
         if isinstance(mongo_filter, dict):
-            if "collection" in mongo_filter:
-                collection_name = mongo_filter["collection"]
-                coll = get_collection(collection_name)
             
             if "aggregate" in mongo_filter:
                 pipeline = mongo_filter["aggregate"]
                 if isinstance(pipeline, list):
                     try:
-                        print(f"Executing aggregate pipeline: {json.dumps(pipeline, default=str)}")
-                        results = list(coll.aggregate(pipeline))
-                        return convert_objectid_to_str(results)
+                        logger.debug("Executing aggregate pipeline: %s", lazy_json(pipeline))
+                        results = collect(coll.aggregate(pipeline))
+                        return results
                     except pymongo.errors.OperationFailure as e:
-                        print(f"MongoDB aggregation error: {str(e)}")
+                        logger.error("MongoDB aggregation error: %s", e)
                         if "$group" in str(e) and "$sort" in str(e):
                             # Try to fix common group+sort issues by adding allowDiskUse
                             try:
-                                print("Retrying with allowDiskUse=True")
-                                results = list(coll.aggregate(pipeline, allowDiskUse=True))
-                                return convert_objectid_to_str(results)
+                                logger.warning("Retrying with allowDiskUse=True")
+                                results = collect(coll.aggregate(pipeline, allowDiskUse=True))
+                                return results
                             except Exception as retry_err:
-                                print(f"Retry failed: {str(retry_err)}")
+                                logger.error("Retry failed: %s", retry_err)
                                 return []
                         return []
                 
@@ -129,66 +202,115 @@ def query_mongodb(
                     pipeline.append({"$limit": limit_val})
                     
                 try:
-                    print(f"Executing built pipeline: {json.dumps(pipeline, default=str)}")
-                    results = list(coll.aggregate(pipeline))
-                    return convert_objectid_to_str(results)
+                    logger.debug("Executing built pipeline: %s", lazy_json(pipeline))
+                    results = collect(coll.aggregate(pipeline))
+                    return results
                 except pymongo.errors.OperationFailure as e:
-                    print(f"MongoDB pipeline error: {str(e)}")
+                    logger.error("MongoDB pipeline error: %s", e)
                     # Use allowDiskUse for large datasets since MongoDB has a 100MB memory limit for aggregation pipelines
                     # allowDiskUse=True permits operations to use temporary files on disk
                     try:
-                        print("Retrying with allowDiskUse=True")
-                        results = list(coll.aggregate(pipeline, allowDiskUse=True))
-                        return convert_objectid_to_str(results)
+                        logger.warning("Retrying with allowDiskUse=True")
+                        results = collect(coll.aggregate(pipeline, allowDiskUse=True))
+                        return results
                     except Exception as retry_err:
-                        print(f"Retry failed: {str(retry_err)}")
+                        logger.error("Retry failed: %s", retry_err)
                         return []
             
             # Standard find query
             # Used when no special sorting or complex operations are needed
             if projection:
-                results = list(coll.find(filter_obj, projection))
+                results = collect(coll.find(filter_obj, projection))
             else:
-                results = list(coll.find(filter_obj))
+                results = collect(coll.find(filter_obj))
                 
             # Apply limit after find if specified
             # This is a client-side limit (not a database cursor limit)
             if limit_val > 0:
-                results = results[:limit_val]
+                results = itertools.islice(results, limit_val) if lazy else results[:limit_val]
                 
-            return convert_objectid_to_str(results)
+            return results
             
         # Handle direct aggregation pipeline
         elif isinstance(mongo_filter, list):
             try:
-                print(f"Executing direct aggregation: {json.dumps(mongo_filter, default=str)}")
-                results = list(coll.aggregate(mongo_filter))
-                return convert_objectid_to_str(results)
+                logger.debug("Executing direct aggregation: %s", lazy_json(mongo_filter))
+                results = collect(coll.aggregate(mongo_filter))
+                return results
             except pymongo.errors.OperationFailure as e:
-                print(f"MongoDB direct aggregation error: {str(e)}")
+                logger.error("MongoDB direct aggregation error: %s", e)
                 # Try with allowDiskUse for large datasets or complex aggregations
                 # Particularly important for operations like $sort with large datasets
                 # or $group operations that consume significant memory
                 try:
-                    print("Retrying direct aggregation with allowDiskUse=True")
-                    results = list(coll.aggregate(mongo_filter, allowDiskUse=True))
-                    return convert_objectid_to_str(results)
+                    logger.warning("Retrying direct aggregation with allowDiskUse=True")
+                    results = collect(coll.aggregate(mongo_filter, allowDiskUse=True))
+                    return results
                 except Exception as retry_err:
-                    print(f"Retry failed: {str(retry_err)}")
+                    logger.error("Retry failed: %s", retry_err)
+                    BACKEND_ERRORS.inc(backend="mongodb")
                     return []
             
         else:
             raise ValueError("Unsupported MongoDB query format. Provide a dict or list (aggregation pipeline).")
 
     except pymongo.errors.OperationFailure as e:
-        print(f"MongoDB OperationFailure: {str(e)}")
+        logger.error("MongoDB OperationFailure: %s", e)
+        BACKEND_ERRORS.inc(backend="mongodb")
         return []
+    except pymongo.errors.ConnectionFailure as e:
+        # An unreachable server is not an empty result: raise so the circuit breaker sees it
+        raise HTTPException(
+            status_code=500,
+            detail=f"MongoDB is unreachable: {str(e)}"
+        )
     except Exception as e:
-        print(f"MongoDB Query Error: {str(e)}")
+        logger.error("MongoDB Query Error: %s", e)
+        BACKEND_ERRORS.inc(backend="mongodb")
         import traceback
         traceback.print_exc()
         return []
 
+def explain_command(
+    mongo_filter: Union[Dict[str, Any], List[Dict[str, Any]]],
+    collection_name: str = "listings_meta") -> Dict[str, Any]:
+
+    # The find/aggregate command _execute_mongodb_query runs for mongo_filter, for explain.
+
+    if isinstance(mongo_filter, list):
+        return {"aggregate": collection_name, "pipeline": mongo_filter, "cursor": {}}
+    collection_name = mongo_filter.get("collection", collection_name)
+    if isinstance(mongo_filter.get("aggregate"), list):
+        return {"aggregate": collection_name, "pipeline": mongo_filter["aggregate"], "cursor": {}}
+    filter_obj = mongo_filter.get("filter", mongo_filter.get("query", {}))
+    projection = mongo_filter.get("projection")
+    sort_obj = mongo_filter.get("sort") or mongo_filter.get("$sort") or mongo_filter.get("$orderby")
+    limit_val = mongo_filter.get("limit") or mongo_filter.get("$limit") or 0
+    if sort_obj or limit_val:
+        pipeline = [{"$match": filter_obj}] if filter_obj else []
+        if projection:
+            pipeline.append({"$project": projection})
+        if sort_obj:
+            pipeline.append({"$sort": sort_obj})
+        if limit_val > 0:
+            pipeline.append({"$limit": limit_val})
+        return {"aggregate": collection_name, "pipeline": pipeline, "cursor": {}}
+    command = {"find": collection_name, "filter": filter_obj}
+    if projection:
+        command["projection"] = projection
+    return command
+
+def explain_mongodb(
+    mongo_filter: Union[Dict[str, Any], List[Dict[str, Any]]],
+    collection_name: str = "listings_meta") -> Dict[str, Any]:
+
+    # Captures explain("executionStats") for a slow query (called by the slow-query log).
+    # executionStats runs the query again, which is why this happens off the request path.
+
+    plan = get_database().command({"explain": explain_command(mongo_filter, collection_name), "verbosity": "executionStats"})
+    plan = convert_objectid_to_str(plan)
+    return {"summary": summarize_mongo_plan(plan), "plan": plan}
+
 def normalize_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
     normalized = doc.copy()
     
@@ -208,12 +330,52 @@ def normalize_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
 
 # modification
 
+def infer_multi(filter_query: Dict[str, Any]) -> bool:
+    # If the filter contains operators like $in, $gt, etc, or doesn't have a specific _id,
+    # it's likely intended to modify multiple documents
+    uses_array_operator = any(isinstance(v, dict) and any(k.startswith('$') for k in v.keys())
+                             for k, v in filter_query.items())
+    has_id_exact_match = "_id" in filter_query and not isinstance(filter_query["_id"], dict)
+    return uses_array_operator or not has_id_exact_match
+
+def coerce_int_id(doc: Dict[str, Any]) -> Dict[str, Any]:
+    # Listing ids are stored as integers; string ids that parse as one are converted in place
+    if "_id" in doc and isinstance(doc["_id"], str):
+        try:
+            doc["_id"] = int(doc["_id"])
+        except ValueError:
+            pass
+    return doc
+
+# Called with the collection and the modification (None when not known, e.g. for batches)
+# after every write, e.g. to update in-process indexes derived from a collection
+WRITE_LISTENERS: List[Callable[[str, Optional[Dict[str, Any]]], None]] = []
+
+def on_mongodb_write(callback: Callable[[str, Optional[Dict[str, Any]]], None]) -> None:
+    WRITE_LISTENERS.append(callback)
+
+def invalidate_mongodb_cache(collection_name: str, mod_query: Optional[Dict[str, Any]] = None) -> None:
+
+    # Drops cached results that read from the modified collection, including
+    # pipelines that $lookup into it.
+
+    for callback in WRITE_LISTENERS:
+        callback(collection_name, mod_query)
+    cache = get_query_cache("mongodb")
+    if cache is None:
+        return
+    removed = cache.invalidate([collection_name])
+    logger.debug("Invalidated %s cached MongoDB results for collection: %s", removed, collection_name)
+
+@limited("mongodb")
+@guarded("mongodb", is_mongodb_outage)
+@timed_stage("mongodb_modify", backend="mongodb")
 def modify_mongodb(
     mod_query: Dict[str, Any],
     collection_name: str = "listings_meta") -> Dict[str, Any]:
 
     try:
-        print(f"MongoDB modification request: {json.dumps(mod_query, default=str)}")
+        logger.debug("MongoDB modification request: %s", lazy_json(mod_query))
         
         # Validate operation type
         op = mod_query.get("operation", "").lower()
@@ -223,13 +385,13 @@ def modify_mongodb(
         # Get the correct collection
         try:
             coll = get_collection(collection_name)
-            print(f"Using MongoDB collection: {collection_name}")
+            logger.debug("Using MongoDB collection: %s", collection_name)
         except Exception as e:
-            print(f"Error accessing collection '{collection_name}': {str(e)}")
+            logger.error("Error accessing collection '%s': %s", collection_name, e)
             # Fallback to listings_meta collection
             collection_name = "listings_meta" 
             coll = get_collection(collection_name)
-            print(f"Fell back to collection: {collection_name}")
+            logger.warning("Fell back to collection: %s", collection_name)
         
         if op == "insert":
             # Check if inserting multiple documents
@@ -238,7 +400,7 @@ def modify_mongodb(
                 if not documents:
                     raise ValueError("Empty documents list provided for bulk insert operation")
                 
-                print(f"Bulk inserting {len(documents)} documents")
+                logger.debug("Bulk inserting %s documents", len(documents))
                 
                 for doc in documents:
                     if "_id" in doc and isinstance(doc["_id"], str):
@@ -252,7 +414,8 @@ def modify_mongodb(
                     "message": f"{len(documents)} documents inserted successfully",
                     "inserted_ids": [str(id) for id in result.inserted_ids]
                 }
-                print(f"Bulk insert result: {json.dumps(response, default=str)}")
+                logger.debug("Bulk insert result: %s", lazy_json(response))
+                invalidate_mongodb_cache(collection_name, mod_query)
                 return response
             else:
                 # Single document insert (existing code)
@@ -260,13 +423,13 @@ def modify_mongodb(
                 if not document:
                     raise ValueError("No document provided for insert operation")
                 
-                print(f"Inserting document: {json.dumps(document, default=str)}")
+                logger.debug("Inserting document: %s", lazy_json(document))
                 
                 # Ensure _id is properly formatted
                 if "_id" in document and isinstance(document["_id"], str):
                     try:
                         document["_id"] = int(document["_id"])
-                        print(f"Converted _id from string to int: {document['_id']}")
+                        logger.debug("Converted _id from string to int: %s", document['_id'])
                     except ValueError:
                         # Keep as string if not convertible to int
                         pass
@@ -276,7 +439,8 @@ def modify_mongodb(
                     "message": "Document inserted successfully",
                     "inserted_id": str(result.inserted_id)
                 }
-                print(f"Insert result: {json.dumps(response, default=str)}")
+                logger.debug("Insert result: %s", lazy_json(response))
+                invalidate_mongodb_cache(collection_name, mod_query)
                 return response
             
         elif op == "update":
@@ -292,7 +456,7 @@ def modify_mongodb(
             if "_id" in filter_query and isinstance(filter_query["_id"], str):
                 try:
                     filter_query["_id"] = int(filter_query["_id"])
-                    print(f"Converted filter _id from string to int: {filter_query['_id']}")
+                    logger.debug("Converted filter _id from string to int: %s", filter_query['_id'])
                 except ValueError:
                     # Keep as string if not convertible to int
                     pass
@@ -301,28 +465,19 @@ def modify_mongodb(
             multi = mod_query.get("multi", False)
             
             # Auto-detect if this is likely a multi-update operation
-            if not multi:
-                # If the filter contains operators like $in, $gt, etc, or doesn't have a specific _id, it's likely intended to update multiple documents
-                uses_array_operator = any(isinstance(v, dict) and any(k.startswith('$') for k in v.keys()) 
-                                         for k, v in filter_query.items())
-                has_id_exact_match = "_id" in filter_query and not isinstance(filter_query["_id"], dict)
-                
-                # If using array operators or not targeting a specific ID, assume multi=True
-                if uses_array_operator or not has_id_exact_match:
-                    multi = True
-                    print("Auto-detected multi-update operation based on filter criteria")
+            if not multi and infer_multi(filter_query):
+                multi = True
+                logger.debug("Auto-detected multi-update operation based on filter criteria")
             
             upsert = mod_query.get("upsert", False)
             
             # Ensure update has proper MongoDB operators
             if not any(k.startswith("$") for k in update_data):
                 update_data = {"$set": update_data}
-                print("Added $set operator to update data")
+                logger.debug("Added $set operator to update data")
             
-            print(f"Update operation:")
-            print(f"  Filter: {json.dumps(filter_query, default=str)}")
-            print(f"  Update: {json.dumps(update_data, default=str)}")
-            print(f"  Multi: {multi}, Upsert: {upsert}")
+            logger.debug("Update operation: filter=%s update=%s multi=%s upsert=%s",
+                         lazy_json(filter_query), lazy_json(update_data), multi, upsert)
             
             if multi:
                 result = coll.update_many(filter_query, update_data, upsert=upsert)
@@ -334,7 +489,8 @@ def modify_mongodb(
                 "modified_count": result.modified_count,
                 "upserted_id": str(result.upserted_id) if result.upserted_id else None
             }
-            print(f"Update result: {json.dumps(response, default=str)}")
+            logger.debug("Update result: %s", lazy_json(response))
+            invalidate_mongodb_cache(collection_name, mod_query)
             return response
             
         elif op == "delete":
@@ -346,7 +502,7 @@ def modify_mongodb(
             if "_id" in filter_query and isinstance(filter_query["_id"], str):
                 try:
                     filter_query["_id"] = int(filter_query["_id"])
-                    print(f"Converted filter _id from string to int: {filter_query['_id']}")
+                    logger.debug("Converted filter _id from string to int: %s", filter_query['_id'])
                 except ValueError:
                     # Keep as string if not convertible to int
                     pass
@@ -355,19 +511,11 @@ def modify_mongodb(
             multi = mod_query.get("multi", False)
             
             # Auto-detect if this is likely a multi-delete operation
-            if not multi:
-                # If the filter contains operators like $in, $gt, etc, or doesn't have a specific _id, it's likely intended to delete multiple documents
-                uses_array_operator = any(isinstance(v, dict) and any(k.startswith('$') for k in v.keys()) 
-                                         for k, v in filter_query.items())
-                has_id_exact_match = "_id" in filter_query and not isinstance(filter_query["_id"], dict)
-                
-                # If using array operators or not targeting a specific ID, assume multi=True
-                if uses_array_operator or not has_id_exact_match:
-                    multi = True
-                    print("Auto-detected multi-delete operation based on filter criteria")
+            if not multi and infer_multi(filter_query):
+                multi = True
+                logger.debug("Auto-detected multi-delete operation based on filter criteria")
             
-            print(f"Delete operation with filter: {json.dumps(filter_query, default=str)}")
-            print(f"  Multi: {multi}")
+            logger.debug("Delete operation: filter=%s multi=%s", lazy_json(filter_query), multi)
             
             if multi:
                 result = coll.delete_many(filter_query)
@@ -377,14 +525,15 @@ def modify_mongodb(
             response = {
                 "deleted_count": result.deleted_count
             }
-            print(f"Delete result: {json.dumps(response, default=str)}")
+            logger.debug("Delete result: %s", lazy_json(response))
+            invalidate_mongodb_cache(collection_name, mod_query)
             return response
             
         else:
             raise ValueError(f"Unsupported operation: {op}")
             
     except ValueError as e:
-        print(f"MongoDB modification error (ValueError): {str(e)}")
+        logger.error("MongoDB modification error (ValueError): %s", e)
         traceback = __import__('traceback')
         traceback.print_exc()
         raise HTTPException(
@@ -392,10 +541,95 @@ def modify_mongodb(
             detail=str(e)
         )
     except Exception as e:
-        print(f"MongoDB modification error: {str(e)}")
+        logger.error("MongoDB modification error: %s", e)
+        # Bulk writes can fail part-way, so results read before the error may be stale
+        invalidate_mongodb_cache(collection_name)
         traceback = __import__('traceback')
         traceback.print_exc()
         raise HTTPException(
             status_code=500,
             detail=f"MongoDB modification error: {str(e)}"
         )
+
+def mongo_write_ops(mod_query: Dict[str, Any]) -> List[Any]:
+
+    # The pymongo write models for one modification, with the same normalisation as
+    # modify_mongodb (numeric _id, $set wrapping, multi-document auto-detection).
+    # Raises ValueError for an invalid modification.
+
+    op = mod_query.get("operation", "").lower()
+    if op == "insert":
+        if isinstance(mod_query.get("documents"), list):
+            documents = [coerce_int_id(normalize_doc(doc)) for doc in mod_query["documents"]]
+        else:
+            documents = [coerce_int_id(normalize_doc(mod_query.get("document", {})))]
+        if not documents or not all(documents):
+            raise ValueError("No document provided for insert operation")
+        return [pymongo.InsertOne(doc) for doc in documents]
+
+    filter_query = coerce_int_id(dict(mod_query.get("filter", {})))
+    if not filter_query:
+        raise ValueError(f"Filter is required for {op} operation")
+    multi = mod_query.get("multi", False) or infer_multi(filter_query)
+    if op == "update":
+        update_data = mod_query.get("update", {})
+        if not update_data:
+            raise ValueError("Update data is required for update operation")
+        if not any(k.startswith("$") for k in update_data):
+            update_data = {"$set": update_data}
+        upsert = mod_query.get("upsert", False)
+        model = pymongo.UpdateMany if multi else pymongo.UpdateOne
+        return [model(filter_query, update_data, upsert=upsert)]
+    if op == "delete":
+        return [pymongo.DeleteMany(filter_query) if multi else pymongo.DeleteOne(filter_query)]
+    raise ValueError(f"Invalid or missing operation: {op}. Must be 'insert', 'update', or 'delete'.")
+
+@limited("mongodb")
+@guarded("mongodb", is_mongodb_outage)
+@timed_stage("mongodb_batch", backend="mongodb")
+def modify_mongodb_batch(mods: List[tuple]) -> Dict[str, Any]:
+
+    # Applies many modifications with one unordered bulk_write per collection.
+    # mods: [(item index, collection name, modification), ...]
+    # Returns per-collection counts and {item index: error} for the items that failed;
+    # unordered writes keep going past a failed item.
+
+    errors: Dict[int, str] = {}
+    by_collection: Dict[str, tuple] = {}
+    for index, collection_name, mod_query in mods:
+        try:
+            ops = mongo_write_ops(mod_query)
+        except ValueError as e:
+            errors[index] = str(e)
+            continue
+        ops_list, owners = by_collection.setdefault(collection_name, ([], []))
+        ops_list.extend(ops)
+        owners.extend([index] * len(ops))
+
+    collections = {}
+    for collection_name, (ops, owners) in by_collection.items():
+        try:
+            coll = get_collection(collection_name)
+        except HTTPException as e:
+            for index in set(owners):
+                errors.setdefault(index, e.detail)
+            continue
+        try:
+            result = coll.bulk_write(ops, ordered=False)
+            details = result.bulk_api_result
+        except pymongo.errors.BulkWriteError as e:
+            details = e.details
+            for write_error in details.get("writeErrors", []):
+                errors.setdefault(owners[write_error["index"]], write_error.get("errmsg", "write error"))
+        finally:
+            invalidate_mongodb_cache(collection_name)
+        collections[collection_name] = {
+            "operations": len(ops),
+            "inserted": details.get("nInserted", 0),
+            "matched": details.get("nMatched", 0),
+            "modified": details.get("nModified", 0),
+            "deleted": details.get("nRemoved", 0),
+            "upserted": details.get("nUpserted", 0)
+        }
+        logger.debug("MongoDB bulk_write on %s: %s", collection_name, lazy_json(collections[collection_name]))
+    return {"collections": collections, "errors": errors}
@@ -1,7 +1,18 @@
+import json
+import logging
 import pymysql
 import re
+import time
+from decimal import Decimal
 from fastapi import HTTPException
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Iterator, Optional, Set
+from database.query_cache import get_query_cache, canonicalize_sql, sql_read_tables, sql_write_tables
+from database.slow_query_log import record_if_slow, summarize_mysql_plan
+from admission import admit, limited
+from circuit_breaker import caused_by, guard
+from metrics import timed_stage
+
+logger = logging.getLogger("chatdb.mysql")
 
 
 # config for MySQL connection
@@ -12,42 +23,161 @@ MYSQL_CONFIG = {
     'user': 'root',
     'password': 'Dsci-551',
     'database': 'airbnb_db',
+    'connect_timeout': 5,  # seconds; bounds how long a request waits on an unreachable server
     'cursorclass': pymysql.cursors.DictCursor  # Returns results as dictionaries instead of tuples
 }
 
+# Limits for streamed (unbuffered) query execution
+# chunk_rows: rows fetched from the server and encoded per chunk
+# max_rows / max_bytes: caps after which the stream stops and the running query is killed
+MYSQL_STREAM_CONFIG = {
+    "chunk_rows": 500,
+    "max_rows": 100000,
+    "max_bytes": 50 * 1024 * 1024
+}
+
+def is_mysql_outage(error: BaseException) -> bool:
+    # Only connecting is guarded by the circuit, so any driver error there is an outage
+    return caused_by(error, (pymysql.Error,))
+
 def get_connection():
 
     # Creates and returns a connection to the MySQL database.
     # Uses the global configuration and handles connection errors.
+    # Every MySQL call opens its connection here, so this is where the MySQL circuit is checked.
 
-    try:
-        return pymysql.connect(**MYSQL_CONFIG)
-    except pymysql.Error as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to connect to MySQL database: {str(e)}"
-        )
+    with guard("mysql", is_mysql_outage):
+        try:
+            return pymysql.connect(**MYSQL_CONFIG)
+        except pymysql.Error as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to connect to MySQL database: {str(e)}"
+            )
 
+@timed_stage("mysql", backend="mysql")
 def query_mysql(sql_query: str) -> List[Dict[str, Any]]:
 
     # Executes a SQL query and returns results as a list of dictionaries.
     # Uses connection pooling pattern with proper resource cleanup.
+    # Non-empty results are cached per canonical SQL until a write touches one of the read tables.
 
-    connection = None
+    cache = get_query_cache("mysql")
+    key = canonicalize_sql(sql_query)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+    with admit("mysql"):
+        connection = None
+        try:
+            connection = get_connection()
+            with connection.cursor() as cursor:
+                started = time.perf_counter()
+                cursor.execute(sql_query)  # Note: Direct query execution，used with trusted inputs only
+                results = cursor.fetchall()
+                record_if_slow("mysql", sql_query, time.perf_counter() - started, lambda: explain_mysql(sql_query))
+                if cache is not None and results:
+                    cache.put(key, list(results), sql_read_tables(sql_query))
+                return results
+        except pymysql.Error as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"MySQL query error: {str(e)}"
+            )
+        finally:
+            if connection:
+                connection.close()  # Ensures connection is closed even if an exception occurs
+
+def explain_mysql(sql_query: str) -> Dict[str, Any]:
+
+    # Captures EXPLAIN FORMAT=JSON for a slow read on its own connection (called by the slow-query log).
+
+    if not re.match(r"\s*(SELECT|WITH)\b", sql_query, re.IGNORECASE):
+        return {"summary": None, "plan": None}
+    connection = get_connection()
     try:
-        connection = get_connection()
         with connection.cursor() as cursor:
-            cursor.execute(sql_query)  # Note: Direct query execution，used with trusted inputs only
-            results = cursor.fetchall()
-            return results
-    except pymysql.Error as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"MySQL query error: {str(e)}"
-        )
+            cursor.execute("EXPLAIN FORMAT=JSON " + sql_query.strip().rstrip(";"))
+            row = cursor.fetchone()
+            plan = json.loads(next(iter(row.values())))
+            return {"summary": summarize_mysql_plan(plan), "plan": plan}
     finally:
-        if connection:
-            connection.close()  # Ensures connection is closed even if an exception occurs
+        connection.close()
+
+class MySQLStream:
+
+    # Executes one query with an unbuffered SSDictCursor and hands out the rows chunk by chunk,
+    # so rows are only read off the socket as the response is written.
+    # When the stream is closed before the result is exhausted (row cap, byte cap set by the
+    # consumer, client disconnect) the query is killed on the server instead of draining the rest.
+
+    def __init__(self, sql_query: str, chunk_rows: Optional[int] = None, max_rows: Optional[int] = None):
+        self.sql_query = sql_query
+        self.chunk_rows = chunk_rows or MYSQL_STREAM_CONFIG["chunk_rows"]
+        self.max_rows = max_rows or MYSQL_STREAM_CONFIG["max_rows"]
+        self.rows_read = 0
+        self.truncated = False
+        self._connection = None
+
+    def chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        # The MySQL admission slot is held until the stream is exhausted or closed
+        with admit("mysql"):
+            yield from self._read_chunks()
+
+    def _read_chunks(self) -> Iterator[List[Dict[str, Any]]]:
+        self._connection = get_connection()
+        exhausted = False
+        try:
+            cursor = self._connection.cursor(pymysql.cursors.SSDictCursor)
+            cursor.execute(self.sql_query)  # Note: Direct query execution，used with trusted inputs only
+            while True:
+                remaining = self.max_rows - self.rows_read
+                if remaining <= 0:
+                    # Row cap reached: only report truncation if the server has more rows
+                    self.truncated = cursor.fetchone() is not None
+                    exhausted = not self.truncated
+                    break
+                rows = cursor.fetchmany(min(self.chunk_rows, remaining))
+                if not rows:
+                    exhausted = True
+                    break
+                self.rows_read += len(rows)
+                yield rows
+            if exhausted:
+                cursor.close()
+        except pymysql.Error as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"MySQL query error: {str(e)}"
+            )
+        finally:
+            if exhausted:
+                self._connection.close()
+            else:
+                self.cancel()
+
+    def cancel(self) -> None:
+
+        # Kills the running statement from a second connection, then drops the
+        # streaming connection without reading the rows still in flight.
+
+        connection = self._connection
+        if connection is None or not connection.open:
+            return
+        try:
+            killer = get_connection()
+            try:
+                with killer.cursor() as cursor:
+                    cursor.execute("KILL QUERY %s", (connection.thread_id(),))
+            finally:
+                killer.close()
+            logger.debug("Cancelled streamed MySQL query after %s rows", self.rows_read)
+        except (pymysql.Error, HTTPException) as e:
+            logger.error("Failed to cancel streamed MySQL query: %s", e)
+        finally:
+            connection.close()
 
 def validate_table_exists(table_name: str) -> bool:
 
@@ -86,6 +216,30 @@ def get_table_schema(table_name: str) -> Optional[List[Dict[str, Any]]]:
 
 # modification
 
+# Called with the written tables (None when unknown) and the committed statements (None when
+# they were rolled back, possibly in part) after every modification, e.g. to rebuild or update
+# in-process indexes derived from MySQL tables
+WRITE_LISTENERS: List[Callable[[Optional[Set[str]], Optional[List[str]]], None]] = []
+
+def on_mysql_write(callback: Callable[[Optional[Set[str]], Optional[List[str]]], None]) -> None:
+    WRITE_LISTENERS.append(callback)
+
+def invalidate_mysql_cache(stmts: List[str], committed: bool = True) -> None:
+
+    # Drops cached results that read from any table written by the statements.
+    # Statements with an unrecognised target clear the whole MySQL cache.
+
+    tables = sql_write_tables(stmts)
+    for callback in WRITE_LISTENERS:
+        callback(tables, stmts if committed else None)
+    cache = get_query_cache("mysql")
+    if cache is None:
+        return
+    removed = cache.invalidate(tables)
+    logger.debug("Invalidated %s cached MySQL results for tables: %s", removed, sorted(tables) if tables else 'all')
+
+@limited("mysql")
+@timed_stage("mysql_modify", backend="mysql")
 def modify_mysql(sql_query: str) -> Dict[str, str]:
 
     # Executes a modification query (INSERT, UPDATE, DELETE) on the MySQL database.
@@ -105,19 +259,17 @@ def modify_mysql(sql_query: str) -> Dict[str, str]:
         connection = get_connection()
         with connection.cursor() as cursor:
             for raw_sql in stmts:
-                # Clean SQL to handle dollar signs in strings like '$100'
-                clean_sql = re.sub(
-                    r"'\$([0-9]+(?:\.[0-9]+)?)'",
-                    r"'\1'",
-                    raw_sql
-                )
-                print(f"Executing MySQL query: {clean_sql}")
+                clean_sql = clean_mysql_statement(raw_sql)
+                logger.debug("Executing MySQL query: %s", clean_sql)
                 cursor.execute(clean_sql)
         connection.commit()
+        invalidate_mysql_cache(stmts)
         return {"message": "MySQL modification executed successfully."}
     except pymysql.Error as e:
         if connection:
             connection.rollback()
+            # Statements run before the failing one may have been committed implicitly (DDL)
+            invalidate_mysql_cache(stmts, committed=False)
         raise HTTPException(
             status_code=500,
             detail=f"MySQL modification error: {str(e)}"
@@ -125,3 +277,78 @@ def modify_mysql(sql_query: str) -> Dict[str, str]:
     finally:
         if connection:
             connection.close()
+
+# Literals of a statement: quoted strings (with '' / \' escapes), numbers, and % signs,
+# which must be doubled once the statement is used as a pymysql format string
+SQL_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])|%")
+SQL_ESCAPES = {"\\'": "'", '\\"': '"', "\\\\": "\\", "\\n": "\n", "\\t": "\t", "\\0": "\0"}
+
+def parameterize_sql(sql: str) -> tuple:
+
+    # Splits a literal statement into a %s template and its values, so statements that
+    # differ only in their values can share one executemany call:
+    #   "UPDATE Listings SET accommodates = 6 WHERE id = 3003" -> ("... = %s WHERE id = %s", [6, 3003])
+
+    params = []
+
+    def replace(match):
+        token = match.group(0)
+        if token == "%":
+            return "%%"
+        if token[0] in "'\"":
+            quote = token[0]
+            value = token[1:-1].replace(quote * 2, quote)
+            params.append(re.sub(r"\\.", lambda m: SQL_ESCAPES.get(m.group(0), m.group(0)[1]), value))
+        elif "." in token:
+            params.append(Decimal(token))
+        else:
+            params.append(int(token))
+        return "%s"
+
+    return SQL_LITERAL.sub(replace, sql), params
+
+def clean_mysql_statement(raw_sql: str) -> str:
+    # Clean SQL to handle dollar signs in strings like '$100'
+    return re.sub(r"'\$([0-9]+(?:\.[0-9]+)?)'", r"'\1'", raw_sql)
+
+@limited("mysql")
+@timed_stage("mysql_batch", backend="mysql")
+def modify_mysql_batch(stmts: List[str]) -> Dict[str, Any]:
+
+    # Runs the statements of many modifications in one transaction. Consecutive statements
+    # with the same shape go to the server as one executemany call, which pymysql sends as a
+    # single multi-row INSERT for INSERT ... VALUES. Any error rolls the whole batch back.
+
+    groups = []  # [(template, [params, ...]), ...]
+    for raw_sql in stmts:
+        template, params = parameterize_sql(clean_mysql_statement(raw_sql).strip().rstrip(";"))
+        if groups and groups[-1][0] == template:
+            groups[-1][1].append(params)
+        else:
+            groups.append((template, [params]))
+
+    connection = None
+    try:
+        connection = get_connection()
+        rowcount = 0
+        with connection.cursor() as cursor:
+            for template, rows in groups:
+                logger.debug("Executing MySQL batch of %s: %s", len(rows), template)
+                if len(rows) == 1:
+                    rowcount += cursor.execute(template, rows[0])
+                else:
+                    rowcount += cursor.executemany(template, rows) or 0
+        connection.commit()
+        invalidate_mysql_cache(stmts)
+        return {"statements": len(stmts), "executemany_groups": len(groups), "rowcount": rowcount}
+    except pymysql.Error as e:
+        if connection:
+            connection.rollback()
+            invalidate_mysql_cache(stmts, committed=False)
+        raise HTTPException(
+            status_code=500,
+            detail=f"MySQL batch error, all statements rolled back: {str(e)}"
+        )
+    finally:
+        if connection:
+            connection.close()
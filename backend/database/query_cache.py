@@ -0,0 +1,256 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# Result cache settings, applied to every backend cache.
+# max_entries bounds memory (least recently used entries are evicted first),
+# ttl_seconds bounds staleness for writes that bypass modify_* (e.g. loaders).
+QUERY_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 256,
+    "ttl_seconds": 300
+}
+
+# Marker dependency for entries whose touched tables could not be determined.
+# Such entries are dropped by any write on the same backend.
+ANY_TARGET = "*"
+
+# Tokens of a statement: string literals (so words inside them are skipped), quoted and bare
+# identifiers, numbers, and single punctuation characters
+SQL_TOKEN_PATTERN = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`|[A-Za-z_][A-Za-z0-9_$]*|\d+(?:\.\d+)?|\S"
+)
+# Words that end a table reference, so they are never taken for a table or alias
+SQL_TABLE_LIST_END = frozenset(
+    "WHERE JOIN INNER LEFT RIGHT CROSS FULL NATURAL STRAIGHT_JOIN OUTER ON USING GROUP ORDER LIMIT "
+    "OFFSET HAVING UNION EXCEPT INTERSECT SET WINDOW FOR LOCK INTO VALUES SELECT PARTITION USE FORCE "
+    "IGNORE AS WITH LATERAL".split()
+)
+SQL_WRITE_TABLE_PATTERN = re.compile(
+    r"^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE\s+(?:TABLE\s+)?|"
+    r"ALTER\s+TABLE|DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?)\s*`?([A-Za-z_][A-Za-z0-9_]*)`?",
+    re.IGNORECASE
+)
+
+
+class QueryCache:
+
+    # Size-bounded LRU cache with TTL for the results of one backend.
+    # Each entry remembers the tables/collections/nodes it read from so that
+    # a write only evicts the entries that could have been affected by it.
+
+    def __init__(self, name: str, max_entries: int = 256, ttl_seconds: float = 300):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, targets, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, _, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any, targets: Iterable[str]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, frozenset(targets), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, targets: Optional[Iterable[str]] = None) -> int:
+
+        # Drops entries that read from any of the given targets.
+        # Passing None (or ANY_TARGET) clears the whole cache.
+
+        with self._lock:
+            target_set = {t.lower() for t in targets} if targets is not None else {ANY_TARGET}
+            if ANY_TARGET in target_set:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [
+                    key for key, (_, entry_targets, _) in self._entries.items()
+                    if ANY_TARGET in entry_targets or entry_targets & target_set
+                ]
+                for key in stale:
+                    del self._entries[key]
+                removed = len(stale)
+            self.invalidations += removed
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+QUERY_CACHES = {
+    backend: QueryCache(backend, QUERY_CACHE_CONFIG["max_entries"], QUERY_CACHE_CONFIG["ttl_seconds"])
+    for backend in ("mysql", "mongodb", "firebase")
+}
+
+def get_query_cache(backend: str) -> Optional[QueryCache]:
+
+    # Returns the cache of a backend, or None when result caching is disabled.
+
+    if not QUERY_CACHE_CONFIG["enabled"]:
+        return None
+    return QUERY_CACHES[backend]
+
+def canonicalize_sql(sql_query: str) -> str:
+
+    # Collapses whitespace and drops trailing semicolons so that formatting
+    # differences in the generated SQL map to the same cache entry.
+    # Literal case is kept, since string comparisons may be case sensitive.
+
+    return re.sub(r"\s+", " ", sql_query).strip().rstrip(";").strip()
+
+def canonicalize_query(query: Any) -> str:
+
+    # Serialises a Mongo filter/pipeline or Firebase query object with sorted keys.
+
+    return json.dumps(query, sort_keys=True, separators=(",", ":"), default=str)
+
+def sql_table_refs(sql: str) -> Optional[Set[str]]:
+
+    # Returns every table named in the table lists of a statement: after FROM, JOIN and UPDATE,
+    # including comma-separated lists ("FROM Listings l, Hosts h"), schema-qualified names and
+    # lists that continue after a derived table ("FROM (SELECT ...) t, Hosts h").
+    # Returns None when the parentheses do not balance, so the caller can assume any table.
+    # Words that merely follow FROM (EXTRACT(YEAR FROM date)) may be included; extra tables
+    # only cost extra invalidations.
+
+    tokens = SQL_TOKEN_PATTERN.findall(sql)
+    tables = set()
+    derived = []  # per open parenthesis: whether it opened a derived table in a table list
+
+    def is_name(token: str) -> bool:
+        return token.startswith("`") or ((token[0].isalpha() or token[0] == "_") and token.upper() not in SQL_TABLE_LIST_END)
+
+    def skip_alias(i: int) -> int:
+        if i < len(tokens) and tokens[i].upper() == "AS":
+            i += 1
+        if i < len(tokens) and is_name(tokens[i]):
+            i += 1
+        return i
+
+    def read_list(i: int) -> int:
+        while i < len(tokens):
+            if tokens[i] == "(":
+                derived.append(True)
+                return i + 1
+            if not is_name(tokens[i]):
+                return i
+            name = tokens[i]
+            i += 1
+            while i + 1 < len(tokens) and tokens[i] == "." and is_name(tokens[i + 1]):
+                name = tokens[i + 1]
+                i += 2
+            tables.add(name.strip("`").lower())
+            i = skip_alias(i)
+            if i >= len(tokens) or tokens[i] != ",":
+                return i
+            i += 1
+        return i
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.upper() in ("FROM", "JOIN", "UPDATE"):
+            i = read_list(i + 1)
+        elif token == "(":
+            derived.append(False)
+            i += 1
+        elif token == ")":
+            if not derived:
+                return None
+            i += 1
+            if derived.pop():
+                i = skip_alias(i)
+                if i < len(tokens) and tokens[i] == ",":
+                    i = read_list(i + 1)
+        else:
+            i += 1
+    return tables if not derived else None
+
+def sql_read_tables(sql_query: str) -> Set[str]:
+    return sql_table_refs(sql_query) or {ANY_TARGET}
+
+def sql_write_tables(statements: List[str]) -> Optional[Set[str]]:
+
+    # Returns the tables written by the statements, or None when any statement
+    # has a target we cannot determine (the caller then clears the cache).
+    # A multi-table UPDATE or DELETE may write any table it names, so all of them count.
+
+    tables = set()
+    for stmt in statements:
+        verb = stmt.lstrip().split(None, 1)[0].upper() if stmt.strip() else ""
+        if verb in ("UPDATE", "DELETE"):
+            refs = sql_table_refs(stmt)
+            if not refs:
+                return None
+            tables |= refs
+            continue
+        match = SQL_WRITE_TABLE_PATTERN.match(stmt)
+        if not match:
+            return None
+        tables.add(match.group(1).lower())
+    return tables
+
+def mongo_read_collections(mongo_filter: Any, collection_name: str) -> Set[str]:
+
+    # Collects the base collection plus every collection pulled in through
+    # $lookup / $unionWith / $graphLookup stages, at any nesting depth.
+
+    if isinstance(mongo_filter, dict) and isinstance(mongo_filter.get("collection"), str):
+        collection_name = mongo_filter["collection"]
+    collections = {collection_name.lower()}
+
+    def walk(node: Any) -> None:
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in ("$lookup", "$graphLookup") and isinstance(value, dict) and isinstance(value.get("from"), str):
+                    collections.add(value["from"].lower())
+                elif key == "$unionWith":
+                    coll = value.get("coll") if isinstance(value, dict) else value
+                    if isinstance(coll, str):
+                        collections.add(coll.lower())
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(mongo_filter)
+    return collections
+
+def firebase_node_root(node: str) -> str:
+
+    # Cache entries are tracked per top-level node ("listings/123" -> "listings").
+
+    return node.strip("/").split("/", 1)[0].lower()
@@ -0,0 +1,403 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from pymysql.converters import escape_item
+
+from admission import Overloaded
+from circuit_breaker import describe, outage_reason
+from database.mysql_connector import modify_mysql_batch
+from database.mongodb_connector import modify_mongodb_batch
+from database.firebase_connector import apply_firebase_updates
+from metrics import register_collector, stage
+
+logger = logging.getLogger("chatdb.replication")
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Replication log for fields stored in more than one database.
+# /modify writes only where the translated modification points, so the copies of a shared
+# field drift. Instead of writing every copy during the request, each keyed update of a shared
+# field is recorded here (the same keyed updates write_journal.py accepts), and a background
+# applier propagates the new values to the other copies in batches:
+# - within a batch, the latest recorded value of a field wins and is written to every copy
+#   except the one it came from
+# - values are absolute, so applying an entry twice has the same effect as once; replay()
+#   re-applies a range of the log on purpose (e.g. after restoring one store from a backup)
+# - an unavailable store keeps the batch pending and the applier backs off; a write the store
+#   rejects is logged and skipped
+# Updates that select rows by anything other than the key are not recorded.
+
+# enabled: whether changes are recorded and applied
+# log_path / checkpoint_path: the log (JSON lines) and the last sequence number applied
+# apply_interval_s: time between batches; max_batch: log entries per batch
+# max_backoff_s: longest wait between batches while a store is unavailable
+# max_entries: entries kept in the log file for replay
+REPLICATION_CONFIG = {
+    "enabled": True,
+    "log_path": os.path.join(os.path.dirname(CURRENT_DIR), "replication_log.jsonl"),
+    "checkpoint_path": os.path.join(os.path.dirname(CURRENT_DIR), "replication_log.checkpoint"),
+    "apply_interval_s": 1.0,
+    "max_batch": 500,
+    "max_backoff_s": 60.0,
+    "max_entries": 50000
+}
+
+# Shared fields per entity and where each copy lives: store -> (table/collection/node, key field)
+SHARED_FIELDS = {
+    "listing": {
+        "copies": {"mysql": ("Listings", "id"), "mongodb": ("listings_meta", "_id")},
+        "fields": ("neighbourhood_cleansed", "host_id")
+    },
+    "host": {
+        "copies": {"mysql": ("Hosts", "host_id"), "firebase": ("hosts", "host_id")},
+        "fields": ("host_is_superhost", "host_listings_count")
+    }
+}
+
+STORES = ("mysql", "mongodb", "firebase")
+
+TRUE_VALUES = (True, 1, "1", "t", "true", "True", "TRUE")
+
+def store_value(store: str, field: str, value: Any) -> Any:
+    # host_is_superhost is a BOOLEAN in MySQL and the CSV's "t"/"f" in Firebase
+    if field == "host_is_superhost" and value is not None:
+        flag = value in TRUE_VALUES
+        return ("t" if flag else "f") if store == "firebase" else int(flag)
+    return value
+
+def shared_entity(backend: str, target: str, key_field: str) -> Optional[str]:
+    for entity, spec in SHARED_FIELDS.items():
+        copy = spec["copies"].get(backend)
+        if copy and copy[0].lower() == target.lower() and copy[1] == key_field:
+            return entity
+    return None
+
+
+class ReplicationLog:
+
+    def __init__(self, log_path: Optional[str], checkpoint_path: Optional[str]):
+        self.log_path = log_path
+        self.checkpoint_path = checkpoint_path
+        self._entries: List[Dict[str, Any]] = []  # recorded, not applied yet, in seq order
+        self._seq = 0
+        self._applied_seq = 0
+        self._log_lines = 0
+        self._file = None
+        self._loaded = False
+        self._replay_from: Optional[int] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._backoff = 0.0
+        self.recorded = 0
+        self.applied = {store: 0 for store in STORES}
+        self.failed = {store: 0 for store in STORES}
+        self.last_batch: Optional[Dict[str, Any]] = None
+
+    def _load(self) -> None:
+        # Called with the lock held: restores the entries recorded after the checkpoint
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                self._applied_seq = int(f.read().strip() or 0)
+        self._seq = self._applied_seq
+        for entry in self._read_log():
+            self._log_lines += 1
+            self._seq = max(self._seq, entry["seq"])
+            if entry["seq"] > self._applied_seq:
+                self._entries.append(entry)
+        if self._entries:
+            logger.info("%s replication log entries left to apply after seq %s", len(self._entries), self._applied_seq)
+        if self.log_path:
+            self._file = open(self.log_path, "a", encoding="utf-8")
+
+    def _read_log(self) -> List[Dict[str, Any]]:
+        entries = []
+        if not self.log_path or not os.path.exists(self.log_path):
+            return entries
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue  # a torn last line from a crash mid-append
+        return entries
+
+    def record(self, writes: List[Dict[str, Any]]) -> int:
+
+        # Records the shared fields among applied keyed writes ({"backend", "target", "key_field",
+        # "key", "fields"}, as built by write_journal.keyed_*_write). Returns the entries recorded.
+
+        if not REPLICATION_CONFIG["enabled"]:
+            return 0
+        entries = []
+        for write in writes:
+            entity = shared_entity(write["backend"], write["target"], write["key_field"])
+            if entity is None:
+                continue
+            fields = {f: v for f, v in write["fields"].items() if f in SHARED_FIELDS[entity]["fields"]}
+            if fields:
+                entries.append({"source": write["backend"], "entity": entity, "key": write["key"], "fields": fields})
+        if not entries:
+            return 0
+        with self._lock:
+            self._load()
+            now = time.time()
+            for entry in entries:
+                self._seq += 1
+                entry.update(seq=self._seq, time=now)
+                self._entries.append(entry)
+                if self._file is not None:
+                    self._file.write(json.dumps(entry, default=str) + "\n")
+                    self._log_lines += 1
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self.recorded += len(entries)
+        return len(entries)
+
+    def _save_checkpoint(self) -> None:
+        # Called with the lock held
+        if not self.checkpoint_path or self._file is None:
+            return
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(self._applied_seq))
+        os.replace(tmp_path, self.checkpoint_path)
+        if self._log_lines > 2 * REPLICATION_CONFIG["max_entries"]:
+            kept = self._read_log()[-REPLICATION_CONFIG["max_entries"]:]
+            self._file.close()
+            with open(self.log_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry, default=str) + "\n" for entry in kept)
+            self._file = open(self.log_path, "a", encoding="utf-8")
+            self._log_lines = len(kept)
+
+    # Applying
+
+    def apply_batch(self) -> Dict[str, Any]:
+
+        # Propagates the oldest unapplied entries (or the next replay range) to the other copies.
+
+        with self._lock:
+            self._load()
+            replaying = self._replay_from is not None
+            if replaying:
+                batch = [e for e in self._read_log() if self._replay_from <= e["seq"] <= self._applied_seq]
+                batch = batch[:REPLICATION_CONFIG["max_batch"]]
+            else:
+                batch = self._entries[:REPLICATION_CONFIG["max_batch"]]
+        if not batch:
+            with self._lock:
+                self._replay_from = None
+            return {"entries": 0}
+
+        started = time.perf_counter()
+        with stage("replication_apply"):
+            # (entity, str(key)) -> {"key", "fields": {field: (value, source)}}; later entries win
+            latest: Dict[tuple, Dict[str, Any]] = {}
+            for entry in batch:
+                record = latest.setdefault((entry["entity"], str(entry["key"])), {"key": entry["key"], "fields": {}})
+                for field, value in entry["fields"].items():
+                    record["fields"][field] = (value, entry["source"])
+            retry = False
+            for store, apply in (("mysql", self._apply_mysql), ("mongodb", self._apply_mongodb), ("firebase", self._apply_firebase)):
+                updates = []  # [(copy, key, {field: value})]
+                for (entity, _), record in latest.items():
+                    copy = SHARED_FIELDS[entity]["copies"].get(store)
+                    if copy is None:
+                        continue
+                    values = {f: store_value(store, f, v) for f, (v, source) in record["fields"].items() if source != store}
+                    if values:
+                        updates.append((copy, record["key"], values))
+                if updates:
+                    retry = apply(updates) or retry
+
+        last_seq = batch[-1]["seq"]
+        with self._lock:
+            if not retry:
+                if replaying:
+                    self._replay_from = last_seq + 1 if last_seq < self._applied_seq else None
+                else:
+                    self._entries = [e for e in self._entries if e["seq"] > last_seq]
+                    self._applied_seq = last_seq
+                    self._save_checkpoint()
+        self._backoff = (min(max(self._backoff * 2, REPLICATION_CONFIG["apply_interval_s"]), REPLICATION_CONFIG["max_backoff_s"])
+                         if retry else 0.0)
+        self.last_batch = {
+            "time": time.time(),
+            "entries": len(batch),
+            "through_seq": last_seq,
+            "replay": replaying,
+            "retry": retry,
+            "seconds": round(time.perf_counter() - started, 4)
+        }
+        return self.last_batch
+
+    @staticmethod
+    def _is_outage(error: BaseException) -> bool:
+        return isinstance(error, Overloaded) or outage_reason(error) is not None
+
+    def _rejected(self, store: str, copy: tuple, key: Any, error: BaseException) -> None:
+        self.failed[store] += 1
+        logger.error("Could not replicate to %s %s %s=%s: %s", store, copy[0], copy[1], key, describe(error))
+
+    def _apply_mysql(self, updates: List[tuple]) -> bool:
+        # Returns whether the batch must be retried
+        statements = [
+            f"UPDATE `{table}` SET " + ", ".join(f"`{f}` = {escape_item(v, 'utf8mb4')}" for f, v in sorted(values.items()))
+            + f" WHERE `{key_field}` = {escape_item(key, 'utf8mb4')}"
+            for (table, key_field), key, values in updates
+        ]
+        try:
+            modify_mysql_batch(statements)
+            self.applied["mysql"] += len(updates)
+            return False
+        except Exception as e:
+            if self._is_outage(e):
+                return True
+        # The batch is all-or-nothing; apply the statements one at a time to skip the rejected ones
+        for statement, (copy, key, _) in zip(statements, updates):
+            try:
+                modify_mysql_batch([statement])
+                self.applied["mysql"] += 1
+            except Exception as e:
+                if self._is_outage(e):
+                    return True
+                self._rejected("mysql", copy, key, e)
+        return False
+
+    def _apply_mongodb(self, updates: List[tuple]) -> bool:
+        mods = [
+            (i, collection, {"operation": "update", "filter": {key_field: key}, "update": {"$set": values}})
+            for i, ((collection, key_field), key, values) in enumerate(updates)
+        ]
+        try:
+            summary = modify_mongodb_batch(mods)
+        except Exception as e:
+            if self._is_outage(e):
+                return True
+            for copy, key, _ in updates:
+                self._rejected("mongodb", copy, key, e)
+            return False
+        for i, (copy, key, _) in enumerate(updates):
+            if i in summary["errors"]:
+                self._rejected("mongodb", copy, key, Exception(summary["errors"][i]))
+            else:
+                self.applied["mongodb"] += 1
+        return False
+
+    def _apply_firebase(self, updates: List[tuple]) -> bool:
+        by_node: Dict[str, Dict[str, Any]] = {}
+        for (node, _), key, values in updates:
+            paths = by_node.setdefault(node, {})
+            for field, value in values.items():
+                paths[f"{key}/{field}"] = value
+        for node, paths in by_node.items():
+            try:
+                apply_firebase_updates(node, paths)
+            except Exception as e:
+                if self._is_outage(e):
+                    return True
+                for copy, key, _ in updates:
+                    if copy[0] == node:
+                        self._rejected("firebase", copy, key, e)
+                continue
+            self.applied["firebase"] += sum(1 for copy, _, _ in updates if copy[0] == node)
+        return False
+
+    def replay(self, from_seq: int) -> None:
+
+        # Re-applies the applied entries from `from_seq` on, then carries on with new entries.
+        # Values are absolute, so replaying is idempotent; it does overwrite later changes that
+        # were made outside /modify and so are not in the log.
+
+        with self._lock:
+            self._load()
+            self._replay_from = max(int(from_seq), 1)
+        self._wake.set()
+
+    # Applier thread
+
+    def start(self) -> None:
+        with self._lock:
+            self._load()
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="replication-applier", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        thread.join(timeout=REPLICATION_CONFIG["max_backoff_s"])
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(REPLICATION_CONFIG["apply_interval_s"] + self._backoff)
+            self._wake.clear()
+            try:
+                # Keep going while full batches are waiting
+                while self.apply_batch().get("entries", 0) >= REPLICATION_CONFIG["max_batch"] and not self._backoff:
+                    pass
+            except Exception:
+                logger.exception("Replication batch failed")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            oldest = self._entries[0]["time"] if self._entries else None
+            return {
+                "enabled": REPLICATION_CONFIG["enabled"],
+                "running": self._thread is not None,
+                "pending_entries": len(self._entries),
+                "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "last_seq": self._seq,
+                "applied_seq": self._applied_seq,
+                "replaying_from": self._replay_from,
+                "recorded": self.recorded,
+                "applied": dict(self.applied),
+                "failed": dict(self.failed),
+                "backoff_seconds": self._backoff,
+                "last_batch": self.last_batch
+            }
+
+
+replication_log = ReplicationLog(REPLICATION_CONFIG["log_path"], REPLICATION_CONFIG["checkpoint_path"])
+
+
+def render_replication_metrics() -> List[str]:
+    stats = replication_log.stats()
+    lines = [
+        "# HELP chatdb_replication_pending_entries Shared-field changes not yet propagated to the other stores.",
+        "# TYPE chatdb_replication_pending_entries gauge",
+        f"chatdb_replication_pending_entries {stats['pending_entries']}",
+        "# HELP chatdb_replication_lag_seconds Age of the oldest shared-field change not yet propagated.",
+        "# TYPE chatdb_replication_lag_seconds gauge",
+        f"chatdb_replication_lag_seconds {stats['lag_seconds']:g}",
+        "# HELP chatdb_replication_recorded_total Shared-field changes recorded in the replication log.",
+        "# TYPE chatdb_replication_recorded_total counter",
+        f"chatdb_replication_recorded_total {stats['recorded']}"
+    ]
+    for field, documentation in (
+        ("applied", "Record copies updated by the replication applier, per store."),
+        ("failed", "Record copies the store rejected, per store."),
+    ):
+        name = f"chatdb_replication_{field}_total"
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} counter")
+        for store, count in stats[field].items():
+            lines.append(f'{name}{{store="{store}"}} {count}')
+    return lines
+
+register_collector(render_replication_metrics)
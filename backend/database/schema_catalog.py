@@ -0,0 +1,235 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from database.mysql_connector import get_connection, MYSQL_CONFIG
+from database.mongodb_connector import get_database
+from database.firebase_connector import list_firebase_keys, sample_firebase_children, NODES
+
+# Schema catalogue settings.
+# ttl_seconds: age after which a store's snapshot is refreshed in the background
+# mongo_sample_size: documents sampled per collection to infer field types
+# firebase_sample_size: children read per node (ordered by key) to infer its structure
+SCHEMA_CATALOG_CONFIG = {
+    "ttl_seconds": 600,
+    "mongo_sample_size": 100,
+    "firebase_sample_size": 5
+}
+
+BACKENDS = ("mysql", "mongodb", "firebase")
+
+
+def introspect_mysql() -> Dict[str, Dict[str, Any]]:
+
+    # Reads every table's columns and approximate row count from information_schema.
+    # Column rows use the same keys as DESCRIBE so /explore responses keep their shape.
+    # TABLE_ROWS is an InnoDB estimate, which is enough for exploration purposes.
+
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT TABLE_NAME AS table_name, TABLE_ROWS AS row_count
+                FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE'
+                """,
+                (MYSQL_CONFIG["database"],)
+            )
+            tables = {
+                row["table_name"]: {"fields": [], "row_count": row["row_count"]}
+                for row in cursor.fetchall()
+            }
+            cursor.execute(
+                """
+                SELECT TABLE_NAME AS table_name, COLUMN_NAME AS Field, COLUMN_TYPE AS Type,
+                       IS_NULLABLE AS `Null`, COLUMN_KEY AS `Key`, COLUMN_DEFAULT AS `Default`, EXTRA AS Extra
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = %s
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+                """,
+                (MYSQL_CONFIG["database"],)
+            )
+            for row in cursor.fetchall():
+                table = tables.get(row.pop("table_name"))
+                if table is not None:
+                    table["fields"].append(row)
+        return tables
+    finally:
+        connection.close()
+
+def introspect_mongodb(sample_size: int) -> Dict[str, Dict[str, Any]]:
+
+    # Infers field names, BSON types and nullability from a $sample of each collection.
+    # Typing is done server-side by the aggregation, so only one summary row
+    # per field is transferred instead of the sampled documents themselves.
+
+    database = get_database()
+    collections = {}
+    for name in database.list_collection_names():
+        coll = database[name]
+        row_count = coll.estimated_document_count()
+        sampled = min(sample_size, row_count)
+        pipeline = [
+            {"$sample": {"size": sample_size}},
+            {"$project": {"kv": {"$objectToArray": "$$ROOT"}}},
+            {"$unwind": "$kv"},
+            {"$group": {
+                "_id": "$kv.k",
+                "types": {"$addToSet": {"$type": "$kv.v"}},
+                "seen": {"$sum": 1},
+                "example": {"$first": "$kv.v"}
+            }}
+        ]
+        fields = []
+        for row in coll.aggregate(pipeline):
+            types = sorted(t for t in row["types"] if t != "null")
+            fields.append({
+                "Field": row["_id"],
+                "Type": "|".join(types) or "null",
+                "Nullable": row["seen"] < sampled or "null" in row["types"],
+                "Example": str(row["example"])
+            })
+        fields.sort(key=lambda f: (f["Field"] != "_id", f["Field"]))
+        collections[name] = {"fields": fields, "row_count": row_count}
+    return collections
+
+def infer_firebase_schema(data_obj: Any) -> Any:
+
+    # Recursively describes a Firebase value as nested type names.
+
+    if isinstance(data_obj, dict):
+        return {k: infer_firebase_schema(v) for k, v in data_obj.items()}
+    elif isinstance(data_obj, list):
+        return f"Array[{len(data_obj)}]"
+    else:
+        return f"{type(data_obj).__name__}"
+
+def merge_firebase_schema(left: Any, right: Any) -> Any:
+
+    # Combines the inferred schemas of two children, so fields missing from
+    # the first sampled child still show up in the catalogue.
+
+    if isinstance(left, dict) and isinstance(right, dict):
+        merged = dict(left)
+        for k, v in right.items():
+            merged[k] = merge_firebase_schema(merged[k], v) if k in merged else v
+        return merged
+    if left == "NoneType":
+        return right
+    return left
+
+def introspect_firebase(sample_size: int) -> Dict[str, Dict[str, Any]]:
+
+    # Lists the top-level nodes with a shallow read and samples at most
+    # sample_size children of each, ordered by key, rather than downloading
+    # whole nodes. Row counts come from a shallow read of each node's keys,
+    # and are None if that read fails.
+
+    nodes = {}
+    for node in list_firebase_keys("/") or list(NODES.values()):
+        data = sample_firebase_children(node, sample_size)
+        if not isinstance(data, dict) or not data:
+            continue
+        keys = list_firebase_keys(node)
+        schema = None
+        for value in data.values():
+            child_schema = infer_firebase_schema(value)
+            schema = child_schema if schema is None else merge_firebase_schema(schema, child_schema)
+        nodes[node] = {
+            "fields": {"schema": schema, "example_key": next(iter(data))},
+            "row_count": len(keys) if keys is not None else None
+        }
+    return nodes
+
+
+class SchemaCatalog:
+
+    # In-memory catalogue of the tables, collections and nodes of all stores.
+    # Each store is refreshed independently: a store that cannot be reached keeps
+    # its previous snapshot, and callers fall back to live introspection while a
+    # store has never been loaded.
+
+    def __init__(self, ttl_seconds: float = 600, mongo_sample_size: int = 100, firebase_sample_size: int = 5):
+        self.ttl_seconds = ttl_seconds
+        self.mongo_sample_size = mongo_sample_size
+        self.firebase_sample_size = firebase_sample_size
+        self._snapshots = {}  # backend -> {"loaded_at": float, "tables": {...}}
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    def _introspect(self, backend: str) -> Dict[str, Dict[str, Any]]:
+        if backend == "mysql":
+            return introspect_mysql()
+        if backend == "mongodb":
+            return introspect_mongodb(self.mongo_sample_size)
+        return introspect_firebase(self.firebase_sample_size)
+
+    def refresh(self, backend: Optional[str] = None) -> None:
+
+        # Re-introspects one store, or all of them when backend is None.
+
+        for name in ([backend] if backend else BACKENDS):
+            with self._lock:
+                if name in self._refreshing:
+                    continue
+                self._refreshing.add(name)
+            try:
+                started = time.perf_counter()
+                tables = self._introspect(name)
+                with self._lock:
+                    self._snapshots[name] = {"loaded_at": time.monotonic(), "tables": tables}
+                print(f"Schema catalogue loaded {len(tables)} {name} tables in {time.perf_counter() - started:.2f}s")
+            except Exception as e:
+                print(f"Schema catalogue refresh failed for {name}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(name)
+
+    def refresh_in_background(self, backend: Optional[str] = None) -> None:
+        threading.Thread(target=self.refresh, args=(backend,), daemon=True).start()
+
+    def _tables(self, backend: str) -> Optional[Dict[str, Dict[str, Any]]]:
+
+        # Returns the cached tables of a store, scheduling a background refresh
+        # when the snapshot is older than the TTL. Stale data is served meanwhile.
+
+        with self._lock:
+            snapshot = self._snapshots.get(backend)
+        if snapshot is None:
+            return None
+        if time.monotonic() - snapshot["loaded_at"] > self.ttl_seconds:
+            self.refresh_in_background(backend)
+        return snapshot["tables"]
+
+    def _find_table(self, backend: str, table_name: str) -> Optional[Dict[str, Any]]:
+        tables = self._tables(backend)
+        if tables is None:
+            return None
+        name = table_name.strip("/")
+        if name in tables:
+            return tables[name]
+        # Table names in natural language questions are rarely cased exactly
+        for key, table in tables.items():
+            if key.lower() == name.lower():
+                return table
+        return None
+
+    def list_tables(self, backend: str) -> Optional[List[str]]:
+        tables = self._tables(backend)
+        return list(tables.keys()) if tables is not None else None
+
+    def table_schema(self, backend: str, table_name: str) -> Optional[Any]:
+        table = self._find_table(backend, table_name)
+        return table["fields"] if table is not None else None
+
+    def row_count(self, backend: str, table_name: str) -> Optional[int]:
+        table = self._find_table(backend, table_name)
+        return table["row_count"] if table is not None else None
+
+
+schema_catalog = SchemaCatalog(
+    SCHEMA_CATALOG_CONFIG["ttl_seconds"],
+    SCHEMA_CATALOG_CONFIG["mongo_sample_size"],
+    SCHEMA_CATALOG_CONFIG["firebase_sample_size"]
+)
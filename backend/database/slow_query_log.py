@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from tracing import current_request_id
+
+logger = logging.getLogger("chatdb.slow_queries")
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Slow-query log.
+# The connectors report the execution time of every query that reached a store (cache hits
+# are not reported). Queries over the backend's threshold are recorded together with the
+# natural language request that produced them and a plan captured off the request path:
+# - MySQL: EXPLAIN FORMAT=JSON, summarised as query cost and full-scanned tables
+# - MongoDB: explain with "executionStats" (this re-runs the query), summarised as docs/keys
+#   examined vs returned and whether a collection scan was used
+# - Firebase: the size of the downloaded node, which is what a slow Firebase read costs
+# Entries are kept in memory and appended to a JSON-lines file, both bounded by max_entries.
+# GET /debug/slow-queries groups entries by query shape (literals replaced by ?) and ranks them.
+
+# threshold_ms: per backend, queries slower than this are recorded
+# max_entries: entries kept in memory and, roughly, in the log file
+# log_path: JSON-lines file the log survives restarts in; None keeps it in memory only
+# max_pending_plans: plan captures queued at once; further slow queries are logged without a plan
+# max_plan_bytes: raw plans larger than this are stored as their summary only
+SLOW_QUERY_CONFIG = {
+    "threshold_ms": {"mysql": 200, "mongodb": 200, "firebase": 500},
+    "max_entries": 500,
+    "log_path": os.path.join(os.path.dirname(CURRENT_DIR), "slow_queries.jsonl"),
+    "max_pending_plans": 4,
+    "max_plan_bytes": 20000
+}
+
+# Natural language text of the request being served, set by the endpoints
+_nl_query: ContextVar[Optional[str]] = ContextVar("nl_query", default=None)
+
+def set_nl_query(nl_query: str) -> None:
+    _nl_query.set(nl_query)
+
+
+SQL_STRING = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+def sql_fingerprint(sql_query: str) -> str:
+
+    # Query shape: literals become ?, IN lists collapse to (?+), whitespace and case are normalised.
+
+    shape = SQL_STRING.sub("?", sql_query)
+    shape = SQL_NUMBER.sub("?", shape)
+    shape = SQL_IN_LIST.sub("(?+)", shape)
+    return " ".join(shape.split()).rstrip(";").upper()
+
+def document_fingerprint(query: Any) -> str:
+
+    # Query shape of a Mongo filter/pipeline or Firebase query object: keys and operators
+    # are kept, scalar values become "?", lists of scalars become ["?+"].
+
+    def shape(value):
+        if isinstance(value, dict):
+            return {k: shape(v) for k, v in value.items()}
+        if isinstance(value, list):
+            if value and all(not isinstance(v, (dict, list)) for v in value):
+                return ["?+"]
+            return [shape(v) for v in value]
+        return "?"
+    return json.dumps(shape(query), sort_keys=True, default=str)
+
+
+class SlowQueryLog:
+
+    def __init__(self, max_entries: int, log_path: Optional[str]):
+        self.max_entries = max_entries
+        self.log_path = log_path
+        self._entries = deque(maxlen=max_entries)
+        self._lines_in_file = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self) -> None:
+        # Called with the lock held
+        self._loaded = True
+        if not self.log_path or not os.path.exists(self.log_path):
+            return
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    self._lines_in_file += 1
+                    try:
+                        self._entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError as e:
+            logger.error("Could not read slow query log %s: %s", self.log_path, e)
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._entries.append(entry)
+            if not self.log_path:
+                return
+            try:
+                # The file is rewritten with the in-memory entries once it holds twice as many lines
+                if self._lines_in_file + 1 > 2 * self.max_entries:
+                    with open(self.log_path, "w", encoding="utf-8") as f:
+                        f.writelines(json.dumps(e, default=str) + "\n" for e in self._entries)
+                    self._lines_in_file = len(self._entries)
+                else:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(entry, default=str) + "\n")
+                    self._lines_in_file += 1
+            except OSError as e:
+                logger.error("Could not write slow query log %s: %s", self.log_path, e)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return list(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._loaded = True
+            if self.log_path and os.path.exists(self.log_path):
+                open(self.log_path, "w").close()
+            self._lines_in_file = 0
+
+    def rank(self, by: str = "total_ms", limit: int = 20, backend: Optional[str] = None) -> List[Dict[str, Any]]:
+
+        # Groups entries by backend and query shape and ranks the groups by
+        # total_ms (default), max_ms, avg_ms or count.
+
+        groups: Dict[tuple, Dict[str, Any]] = {}
+        for entry in self.entries():
+            if backend and entry["backend"] != backend:
+                continue
+            key = (entry["backend"], entry["fingerprint"])
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    "backend": entry["backend"],
+                    "fingerprint": entry["fingerprint"],
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "nl_queries": []
+                }
+            group["count"] += 1
+            group["total_ms"] += entry["duration_ms"]
+            if entry["duration_ms"] >= group["max_ms"]:
+                group["max_ms"] = entry["duration_ms"]
+                group["slowest"] = entry
+            if entry.get("nl_query") and entry["nl_query"] not in group["nl_queries"] and len(group["nl_queries"]) < 5:
+                group["nl_queries"].append(entry["nl_query"])
+            group["last_seen"] = max(group.get("last_seen", 0), entry["time"])
+        ranked = list(groups.values())
+        for group in ranked:
+            group["avg_ms"] = group["total_ms"] / group["count"]
+        if by not in ("total_ms", "max_ms", "avg_ms", "count"):
+            by = "total_ms"
+        ranked.sort(key=lambda g: g[by], reverse=True)
+        return ranked[:limit]
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_CONFIG["max_entries"], SLOW_QUERY_CONFIG["log_path"])
+
+# Plans are captured on one background thread so a slow query is not made slower
+_plan_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-plan")
+_pending_plans = [0]
+_pending_lock = threading.Lock()
+
+def record_if_slow(
+    backend: str,
+    query: Any,
+    seconds: float,
+    capture_plan: Optional[Callable[[], Dict[str, Any]]] = None) -> bool:
+
+    # Records the query when it exceeded the backend's threshold; capture_plan runs
+    # in the background and returns {"summary": {...}, "plan": raw plan or None}.
+    # Returns whether the query was slow.
+
+    duration_ms = seconds * 1000
+    if duration_ms < SLOW_QUERY_CONFIG["threshold_ms"].get(backend, float("inf")):
+        return False
+    entry = {
+        "time": time.time(),
+        "backend": backend,
+        "duration_ms": round(duration_ms, 3),
+        "query": query,
+        "fingerprint": sql_fingerprint(query) if isinstance(query, str) else document_fingerprint(query),
+        "nl_query": _nl_query.get(),
+        "request_id": current_request_id()
+    }
+    logger.warning("Slow %s query (%.0f ms): %s", backend, duration_ms, entry["fingerprint"])
+    if capture_plan is None:
+        slow_query_log.add(entry)
+        return True
+    with _pending_lock:
+        if _pending_plans[0] >= SLOW_QUERY_CONFIG["max_pending_plans"]:
+            entry["plan_error"] = "skipped: too many plan captures pending"
+            slow_query_log.add(entry)
+            return True
+        _pending_plans[0] += 1
+    _plan_executor.submit(_capture_plan, entry, capture_plan)
+    return True
+
+def _capture_plan(entry: Dict[str, Any], capture_plan: Callable[[], Dict[str, Any]]) -> None:
+    try:
+        captured = capture_plan()
+        entry["plan_summary"] = captured.get("summary")
+        plan = captured.get("plan")
+        if plan is not None and len(json.dumps(plan, default=str)) <= SLOW_QUERY_CONFIG["max_plan_bytes"]:
+            entry["plan"] = plan
+    except Exception as e:
+        entry["plan_error"] = f"{type(e).__name__}: {e}"
+    finally:
+        with _pending_lock:
+            _pending_plans[0] -= 1
+        slow_query_log.add(entry)
+
+
+# Plan summaries
+
+def summarize_mysql_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+
+    # Walks EXPLAIN FORMAT=JSON for the estimated cost and the tables read with a full scan (access_type ALL).
+
+    summary = {"query_cost": None, "full_scan_tables": [], "rows_examined_estimate": 0}
+    query_block = plan.get("query_block", {})
+    cost = query_block.get("cost_info", {}).get("query_cost")
+    summary["query_cost"] = float(cost) if cost is not None else None
+
+    def walk(node):
+        if isinstance(node, dict):
+            table = node.get("table") if isinstance(node.get("table"), dict) else None
+            if table is not None:
+                if table.get("access_type") == "ALL":
+                    summary["full_scan_tables"].append(table.get("table_name"))
+                summary["rows_examined_estimate"] += int(table.get("rows_examined_per_scan", 0) or 0)
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+    walk(query_block)
+    return summary
+
+def summarize_mongo_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+
+    # executionStats of find and aggregate explains (aggregate nests it under stages[0].$cursor).
+
+    stats = plan.get("executionStats")
+    if stats is None:
+        for stage in plan.get("stages", []):
+            cursor = stage.get("$cursor") if isinstance(stage, dict) else None
+            if cursor and "executionStats" in cursor:
+                stats = cursor["executionStats"]
+                break
+    stats = stats or {}
+    return {
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "execution_ms": stats.get("executionTimeMillis"),
+        "collection_scan": "COLLSCAN" in json.dumps(plan, default=str)
+    }
@@ -0,0 +1,180 @@
+import heapq
+import math
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pymysql
+from fastapi import HTTPException
+
+from database.derived_index import DerivedIndex
+from database.mysql_connector import get_connection, query_mysql
+from metrics import register_collector, stage
+
+# Full-text search over listing descriptions.
+# Keyword questions ("listings with a rooftop view") are answered from an in-process inverted
+# index of TEXT_INDEX_CONFIG["fields"]: each term maps to the listings that contain it and how
+# often, and matches are ranked with BM25. Like MySQL's natural language mode, a listing matches
+# when it contains any of the search terms, and the rarer terms weigh more. Terms are lowercase
+# words; stopwords and words shorter than `min_token_len` are ignored and there is no stemming.
+# The index is rebuilt in the background after a write to Listings and every
+# `refresh_interval_s` (see derived_index.py). Until the first build completes, searches run in
+# MySQL with MATCH ... AGAINST on the FULLTEXT index of the same columns.
+
+# fields: indexed Listings columns, in the order of the FULLTEXT index created by the loader
+# max_matches: most listings a search returns, most relevant first
+# min_token_len: shortest word indexed; 3 is InnoDB's default innodb_ft_min_token_size, so two-letter
+#   words ("tv", "ac") match neither here nor in the MATCH ... AGAINST fallback
+# k1 / b: BM25 term-frequency saturation and document-length normalisation
+TEXT_INDEX_CONFIG = {
+    "enabled": True,
+    "fields": ("description", "neighborhood_overview"),
+    "refresh_interval_s": 600,
+    "max_matches": 2000,
+    "min_token_len": 3,
+    "k1": 1.2,
+    "b": 0.75
+}
+
+# InnoDB's default full-text stopwords
+STOPWORDS = frozenset(
+    "a about an are as at be by com de en for from how i in is it la of on or that the this to "
+    "was what when where who will with und www".split()
+)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+HTML_TAG_PATTERN = re.compile(r"<[^>]*>")
+
+
+class InvalidSearchQuery(HTTPException):
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=400, detail=f"Invalid search query: {detail}")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    # Descriptions contain HTML line breaks (<br />), which are not words
+    if not text:
+        return []
+    words = TOKEN_PATTERN.findall(HTML_TAG_PATTERN.sub(" ", text.lower()))
+    return [word for word in words if len(word) >= TEXT_INDEX_CONFIG["min_token_len"] and word not in STOPWORDS]
+
+def parse_search(search: Any) -> Dict[str, Any]:
+
+    # Validates a search object from the converted query: {"text": "rooftop view", "k": 20}.
+    # A bare string is taken as the text.
+
+    if isinstance(search, str):
+        search = {"text": search}
+    if not isinstance(search, dict) or not isinstance(search.get("text"), str) or not search["text"].strip():
+        raise InvalidSearchQuery("expected an object with a non-empty text")
+    try:
+        k = int(search["k"]) if search.get("k") is not None else None
+    except (TypeError, ValueError):
+        raise InvalidSearchQuery(f"k must be an integer, got {search['k']!r}")
+    if k is not None and k <= 0:
+        raise InvalidSearchQuery("k must be positive")
+    return {"text": search["text"].strip(), "k": k}
+
+
+class InvertedIndex:
+
+    # Immutable term -> postings index. Postings are parallel arrays of document numbers and
+    # term frequencies, so each posting takes 8 bytes instead of two Python objects.
+
+    def __init__(self, documents: Iterable[Tuple[Any, str]]):
+        self.ids: List[Any] = []
+        self.lengths = array("I")
+        postings: Dict[str, Tuple[array, array]] = {}
+        for listing_id, text in documents:
+            number = len(self.ids)
+            self.ids.append(listing_id)
+            tokens = tokenize(text)
+            self.lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                entry = postings.get(token)
+                if entry is None:
+                    entry = postings[token] = (array("I"), array("I"))
+                entry[0].append(number)
+                entry[1].append(count)
+        self.postings = postings
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def search(self, text: str, limit: int) -> List[Tuple[float, Any]]:
+
+        # (BM25 score, listing id) pairs, most relevant first.
+
+        k1, b = TEXT_INDEX_CONFIG["k1"], TEXT_INDEX_CONFIG["b"]
+        count = len(self.ids)
+        average_length = self.average_length or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(text)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            numbers, frequencies = entry
+            idf = math.log(1 + (count - len(numbers) + 0.5) / (len(numbers) + 0.5))
+            for number, frequency in zip(numbers, frequencies):
+                norm = k1 * (1 - b + b * self.lengths[number] / average_length)
+                scores[number] = scores.get(number, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(score, self.ids[number]) for number, score in best]
+
+    def terms(self) -> int:
+        return len(self.postings)
+
+
+def load_documents() -> InvertedIndex:
+    fields = TEXT_INDEX_CONFIG["fields"]
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id, {', '.join(fields)} FROM Listings")
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+    return InvertedIndex((row["id"], " ".join(row[field] or "" for field in fields)) for row in rows)
+
+
+text_index = DerivedIndex("text", "Listings", load_documents, TEXT_INDEX_CONFIG["refresh_interval_s"])
+
+
+def start_text_index() -> None:
+    if TEXT_INDEX_CONFIG["enabled"]:
+        text_index.refresh_in_background()
+
+def mysql_search(text: str, limit: int) -> List[Tuple[float, Any]]:
+
+    # The same search in MySQL, used until the inverted index is built.
+
+    match = f"MATCH({', '.join(TEXT_INDEX_CONFIG['fields'])}) AGAINST ('{pymysql.converters.escape_string(text)}' IN NATURAL LANGUAGE MODE)"
+    sql = f"SELECT id, {match} AS score FROM Listings WHERE {match} ORDER BY score DESC LIMIT {limit};"
+    return [(float(row["score"]), row["id"]) for row in query_mysql(sql)]
+
+def find_text(search: Dict[str, Any]) -> Tuple[List[Tuple[float, Any]], str]:
+
+    # Listings matching a parsed search object, most relevant first, and where they were found.
+
+    limit = min(search["k"] or TEXT_INDEX_CONFIG["max_matches"], TEXT_INDEX_CONFIG["max_matches"])
+    index = text_index.current()
+    if index is None:
+        return mysql_search(search["text"], limit), "mysql"
+    with stage("text_search"):
+        return index.search(search["text"], limit), "index"
+
+
+def render_text_metrics() -> List[str]:
+    index = text_index.current()
+    return text_index.render_metrics("chatdb_text_index") + [
+        "# HELP chatdb_text_index_documents Listings in the in-process inverted index.",
+        "# TYPE chatdb_text_index_documents gauge",
+        f"chatdb_text_index_documents {len(index.ids) if index is not None else 0}",
+        "# HELP chatdb_text_index_terms Distinct terms in the in-process inverted index.",
+        "# TYPE chatdb_text_index_terms gauge",
+        f"chatdb_text_index_terms {index.terms() if index is not None else 0}"
+    ]
+
+register_collector(render_text_metrics)
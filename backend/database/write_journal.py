@@ -0,0 +1,505 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pymysql.converters import escape_item
+
+from admission import Overloaded
+from circuit_breaker import describe, outage_reason
+from database.mysql_connector import clean_mysql_statement, modify_mysql_batch, parameterize_sql
+from database.mongodb_connector import coerce_int_id, modify_mongodb_batch
+from database.firebase_connector import firebase_field_paths, modify_firebase_batch, normalize_firebase_data
+from database.replication_log import replication_log
+from metrics import register_collector, stage
+
+logger = logging.getLogger("chatdb.write_behind")
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Write-behind journal.
+# A /modify request with "write_behind": true is validated, appended to a local journal
+# (fsynced) and acknowledged with 202 before any store is written. A background flusher then
+# applies the pending writes in batches through the modify_*_batch connector functions.
+# Only keyed updates qualify, because they can be coalesced: several writes to the same record
+# collapse into one, the last write to a field wins.
+# - MySQL: UPDATE <table> SET <col> = <literal>, ... WHERE <primary key> = <literal>
+# - MongoDB: update of one document by _id with $set (or plain fields)
+# - Firebase: update of one child by key
+# Until a write is flushed, /query results are overlaid with it (read-your-writes): rows whose
+# key matches a pending write show the written values. The overlay does not re-evaluate
+# filters, and streamed responses are not overlaid.
+# Writes failing with an outage (circuit open, store unreachable, shed) stay pending and are
+# retried with backoff; writes the store rejects are dropped and listed on /debug/write-behind.
+# After a restart, journal entries newer than the checkpoint are replayed.
+
+# enabled: whether /modify accepts write_behind requests
+# journal_path / checkpoint_path: the journal (JSON lines) and the last sequence number applied
+# flush_interval_s: time between flushes; max_pending_keys: records pending before a flush is forced
+# max_backoff_s: longest wait between flushes while a store is unavailable
+# compact_after: journal lines kept before the file is truncated (only once nothing is pending)
+# fsync: sync every append to disk before acknowledging it
+WRITE_BEHIND_CONFIG = {
+    "enabled": True,
+    "journal_path": os.path.join(os.path.dirname(CURRENT_DIR), "write_journal.jsonl"),
+    "checkpoint_path": os.path.join(os.path.dirname(CURRENT_DIR), "write_journal.checkpoint"),
+    "flush_interval_s": 0.5,
+    "max_pending_keys": 2000,
+    "max_backoff_s": 30.0,
+    "compact_after": 10000,
+    "fsync": True
+}
+
+BACKENDS = ("mysql", "mongodb", "firebase")
+
+
+class WriteBehindRejected(HTTPException):
+
+    # A write_behind modification that cannot be journaled (not a keyed update, or disabled).
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=400, detail=detail)
+
+
+# Eligible modifications
+
+MYSQL_KEYED_UPDATE = re.compile(
+    r"^\s*UPDATE\s+`?(\w+)`?\s+SET\s+(.+?)\s+WHERE\s+`?(\w+)`?\s*=\s*%s\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL
+)
+MYSQL_ASSIGNMENT = re.compile(r"^\s*`?(\w+)`?\s*=\s*(%s|NULL|TRUE|FALSE)\s*$", re.IGNORECASE)
+MYSQL_KEYWORDS = {"NULL": None, "TRUE": True, "FALSE": False}
+# Primary key of each table (see load_airbnb_mysql.py): a WHERE on any other column may match
+# several rows, and writes to those cannot be coalesced per record
+MYSQL_PRIMARY_KEYS = {"listings": "id", "hosts": "host_id", "reviews": "listing_id"}
+
+def keyed_mysql_write(statement: str) -> Optional[Dict[str, Any]]:
+
+    # The keyed write of an UPDATE ... SET col = literal, ... WHERE <primary key> = literal; None otherwise.
+
+    template, params = parameterize_sql(clean_mysql_statement(statement))
+    match = MYSQL_KEYED_UPDATE.match(template)
+    if match is None:
+        return None
+    table, assignments, key_column = match.groups()
+    if MYSQL_PRIMARY_KEYS.get(table.lower()) != key_column.lower():
+        return None
+    values = iter(params)
+    fields = {}
+    for assignment in assignments.split(","):
+        part = MYSQL_ASSIGNMENT.match(assignment)
+        if part is None:
+            return None
+        column, value = part.groups()
+        fields[column] = next(values) if value == "%s" else MYSQL_KEYWORDS[value.upper()]
+    return {"backend": "mysql", "target": table, "key_field": key_column, "key": next(values), "fields": fields}
+
+def keyed_mongodb_write(collection: str, mod: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+
+    # The keyed write of an update of one document by _id; None otherwise.
+
+    if str(mod.get("operation", "")).lower() != "update" or mod.get("multi") or mod.get("upsert"):
+        return None
+    filter_query = coerce_int_id(dict(mod.get("filter") or {}))
+    if list(filter_query) != ["_id"] or isinstance(filter_query["_id"], (dict, list)):
+        return None
+    update = mod.get("update") or {}
+    if any(k.startswith("$") for k in update):
+        if list(update) != ["$set"]:
+            return None
+        update = update["$set"]
+    if not update or not isinstance(update, dict):
+        return None
+    return {"backend": "mongodb", "target": collection, "key_field": "_id", "key": filter_query["_id"], "fields": dict(update)}
+
+def keyed_firebase_write(node: str, mod: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+
+    # The keyed write of an update of one child; fields are kept flat (as modify_firebase takes them).
+
+    if mod.get("operation") != "update" or not mod.get("key"):
+        return None
+    if any(mod.get(field) is not None for field in ("keys", "where", "where_sql", "increment")):
+        return None
+    data = mod.get("data") or {}
+    stored = {path.split("/")[-1] for path in firebase_field_paths(normalize_firebase_data(node, data))}
+    fields = {name: value for name, value in data.items() if name in stored}
+    if not fields:
+        return None
+    return {"backend": "firebase", "target": node, "key_field": "id", "key": str(mod["key"]).strip('"'), "fields": fields}
+
+
+# Overlay helpers
+
+def set_path(row: Dict[str, Any], path: List[str], value: Any) -> Dict[str, Any]:
+    # A copy of `row` with the nested field at `path` set; dicts along the path are copied, not mutated
+    row = dict(row)
+    if len(path) == 1:
+        row[path[0]] = value
+    else:
+        child = row.get(path[0])
+        row[path[0]] = set_path(child if isinstance(child, dict) else {}, path[1:], value)
+    return row
+
+def overlay_paths(write: Dict[str, Any]) -> List[Tuple[List[str], Any]]:
+    if write["backend"] == "firebase":
+        paths = firebase_field_paths(normalize_firebase_data(write["target"], write["fields"]))
+        return [(path.split("/"), value) for path, value in paths.items()]
+    if write["backend"] == "mongodb":
+        return [(field.split("."), value) for field, value in write["fields"].items()]
+    return [([field], value) for field, value in write["fields"].items()]
+
+
+class WriteJournal:
+
+    def __init__(self, journal_path: Optional[str], checkpoint_path: Optional[str]):
+        self.journal_path = journal_path
+        self.checkpoint_path = checkpoint_path
+        # (backend, target, key_field, str(key)) -> {"key", "fields": {field: (value, seq)}, "since"}
+        self._pending: Dict[tuple, Dict[str, Any]] = {}
+        self._seq = 0
+        self._journal_lines = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._backoff = 0.0
+        self.appended = 0
+        self.coalesced = 0
+        self.flushed = {backend: 0 for backend in BACKENDS}
+        self.failed = {backend: 0 for backend in BACKENDS}
+        self.dead_letters = deque(maxlen=100)
+        self.last_flush: Optional[Dict[str, Any]] = None
+
+    # Journal
+
+    def _open(self) -> None:
+        # Called with the lock held: replays unapplied entries and opens the journal for appending
+        if self._file is not None or not self.journal_path:
+            return
+        checkpoint = 0
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                checkpoint = int(f.read().strip() or 0)
+        self._seq = checkpoint
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    self._journal_lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a torn last line from a crash mid-append
+                    self._seq = max(self._seq, entry["seq"])
+                    if entry["seq"] > checkpoint:
+                        self._merge(entry["seq"], entry["time"], entry["writes"])
+                        replayed += 1
+        if replayed:
+            logger.info("Replayed %s write-behind journal entries after seq %s", replayed, checkpoint)
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+
+    def _merge(self, seq: int, at: float, writes: List[Dict[str, Any]]) -> None:
+        # Called with the lock held
+        for write in writes:
+            pending_key = (write["backend"], write["target"], write["key_field"], str(write["key"]))
+            entry = self._pending.get(pending_key)
+            if entry is None:
+                entry = self._pending[pending_key] = {"key": write["key"], "fields": {}, "since": at}
+            for field, value in write["fields"].items():
+                if field in entry["fields"]:
+                    self.coalesced += 1
+                entry["fields"][field] = (value, seq)
+
+    def append(self, writes: List[Dict[str, Any]]) -> int:
+
+        # Journals the writes durably, then makes them pending; returns their sequence number.
+
+        with self._lock:
+            self._open()
+            self._seq += 1
+            seq = self._seq
+            now = time.time()
+            if self._file is not None:
+                self._file.write(json.dumps({"seq": seq, "time": now, "writes": writes}, default=str) + "\n")
+                self._file.flush()
+                if WRITE_BEHIND_CONFIG["fsync"]:
+                    os.fsync(self._file.fileno())
+                self._journal_lines += 1
+            self._merge(seq, now, writes)
+            self.appended += 1
+            if len(self._pending) >= WRITE_BEHIND_CONFIG["max_pending_keys"]:
+                self._wake.set()
+        return seq
+
+    def _checkpoint(self) -> None:
+        # Called with the lock held: everything before the oldest pending write has been applied
+        if not self.checkpoint_path or self._file is None:
+            return
+        oldest = min((seq for entry in self._pending.values() for _, seq in entry["fields"].values()), default=None)
+        applied_through = self._seq if oldest is None else oldest - 1
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(applied_through))
+        os.replace(tmp_path, self.checkpoint_path)
+        if oldest is None and self._journal_lines > WRITE_BEHIND_CONFIG["compact_after"]:
+            self._file.truncate(0)
+            self._journal_lines = 0
+
+    # Flushing
+
+    def flush(self) -> Dict[str, Any]:
+
+        # Applies every pending write with one batched call per store. Returns what happened.
+
+        with self._lock:
+            self._open()
+            snapshot = {
+                pending_key: {"key": entry["key"], "fields": dict(entry["fields"])}
+                for pending_key, entry in self._pending.items()
+            }
+        if not snapshot:
+            return {"keys": 0}
+        started = time.perf_counter()
+        with stage("write_behind_flush"):
+            outcome = {}  # pending key -> "applied" | "failed" | "retry"
+            for backend, apply in (("mysql", self._apply_mysql), ("mongodb", self._apply_mongodb), ("firebase", self._apply_firebase)):
+                keys = [k for k in snapshot if k[0] == backend]
+                if keys:
+                    outcome.update(apply(keys, snapshot))
+
+        with self._lock:
+            for pending_key, result in outcome.items():
+                if result == "retry":
+                    continue
+                entry = self._pending.get(pending_key)
+                if entry is None:
+                    continue
+                # Drop the fields flushed as they were; a field rewritten meanwhile stays pending
+                for field, (value, seq) in snapshot[pending_key]["fields"].items():
+                    if entry["fields"].get(field, (None, None))[1] == seq:
+                        del entry["fields"][field]
+                if entry["fields"]:
+                    entry["since"] = time.time()
+                else:
+                    del self._pending[pending_key]
+                if result == "applied":
+                    self.flushed[pending_key[0]] += 1
+                else:
+                    self.failed[pending_key[0]] += 1
+            self._checkpoint()
+        # Shared fields of the applied writes still have to reach their other copies
+        replication_log.record([
+            {"backend": k[0], "target": k[1], "key_field": k[2], "key": snapshot[k]["key"],
+             "fields": {field: value for field, (value, _) in snapshot[k]["fields"].items()}}
+            for k, result in outcome.items() if result == "applied"
+        ])
+        retried = sum(1 for result in outcome.values() if result == "retry")
+        self._backoff = (min(max(self._backoff * 2, WRITE_BEHIND_CONFIG["flush_interval_s"]), WRITE_BEHIND_CONFIG["max_backoff_s"])
+                         if retried else 0.0)
+        self.last_flush = {
+            "time": time.time(),
+            "keys": len(snapshot),
+            "retry": retried,
+            "seconds": round(time.perf_counter() - started, 4)
+        }
+        return self.last_flush
+
+    def _failure(self, pending_key: tuple, snapshot: Dict[tuple, Dict[str, Any]], error: str) -> str:
+        backend, target, key_field, _ = pending_key
+        fields = {field: value for field, (value, _) in snapshot[pending_key]["fields"].items()}
+        logger.error("Dropping write-behind %s write to %s %s=%s: %s", backend, target, key_field, snapshot[pending_key]["key"], error)
+        self.dead_letters.append({
+            "time": time.time(), "backend": backend, "target": target, "key_field": key_field,
+            "key": snapshot[pending_key]["key"], "fields": fields, "error": error
+        })
+        return "failed"
+
+    @staticmethod
+    def _is_outage(error: BaseException) -> bool:
+        return isinstance(error, Overloaded) or outage_reason(error) is not None
+
+    def _apply_mysql(self, keys: List[tuple], snapshot: Dict[tuple, Dict[str, Any]]) -> Dict[tuple, str]:
+        statements = {}
+        for pending_key in keys:
+            _, table, key_column, _ = pending_key
+            fields = snapshot[pending_key]["fields"]
+            assignments = ", ".join(f"`{column}` = {escape_item(value, 'utf8mb4')}" for column, (value, _) in sorted(fields.items()))
+            statements[pending_key] = (f"UPDATE `{table}` SET {assignments} "
+                                       f"WHERE `{key_column}` = {escape_item(snapshot[pending_key]['key'], 'utf8mb4')}")
+        # Statements of the same shape end up next to each other and share an executemany call
+        ordered = sorted(keys, key=lambda k: parameterize_sql(statements[k])[0])
+        try:
+            modify_mysql_batch([statements[k] for k in ordered])
+            return {k: "applied" for k in keys}
+        except Exception as e:
+            if self._is_outage(e):
+                return {k: "retry" for k in keys}
+        # The batch is all-or-nothing; find the statements MySQL rejects one at a time
+        outcome = {}
+        for pending_key in ordered:
+            try:
+                modify_mysql_batch([statements[pending_key]])
+                outcome[pending_key] = "applied"
+            except Exception as e:
+                outcome[pending_key] = "retry" if self._is_outage(e) else self._failure(pending_key, snapshot, describe(e))
+        return outcome
+
+    def _apply_mongodb(self, keys: List[tuple], snapshot: Dict[tuple, Dict[str, Any]]) -> Dict[tuple, str]:
+        mods = [
+            (i, pending_key[1], {
+                "operation": "update",
+                "filter": {"_id": snapshot[pending_key]["key"]},
+                "update": {"$set": {field: value for field, (value, _) in snapshot[pending_key]["fields"].items()}}
+            })
+            for i, pending_key in enumerate(keys)
+        ]
+        try:
+            summary = modify_mongodb_batch(mods)
+        except Exception as e:
+            if self._is_outage(e):
+                return {k: "retry" for k in keys}
+            return {k: self._failure(k, snapshot, describe(e)) for k in keys}
+        return {
+            pending_key: self._failure(pending_key, snapshot, summary["errors"][i]) if i in summary["errors"] else "applied"
+            for i, pending_key in enumerate(keys)
+        }
+
+    def _apply_firebase(self, keys: List[tuple], snapshot: Dict[tuple, Dict[str, Any]]) -> Dict[tuple, str]:
+        outcome = {}
+        for node in sorted({k[1] for k in keys}):
+            node_keys = [k for k in keys if k[1] == node]
+            mods = [
+                (i, "update", snapshot[pending_key]["key"], {field: value for field, (value, _) in snapshot[pending_key]["fields"].items()})
+                for i, pending_key in enumerate(node_keys)
+            ]
+            try:
+                summary = modify_firebase_batch(node, mods)
+            except Exception as e:
+                retry = self._is_outage(e)
+                outcome.update({k: "retry" if retry else self._failure(k, snapshot, describe(e)) for k in node_keys})
+                continue
+            outcome.update({
+                pending_key: self._failure(pending_key, snapshot, summary["errors"][i]) if i in summary["errors"] else "applied"
+                for i, pending_key in enumerate(node_keys)
+            })
+        return outcome
+
+    # Flusher thread
+
+    def start(self) -> None:
+        with self._lock:
+            self._open()
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        # Stops the flusher after one last flush; writes still pending stay in the journal
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        thread.join(timeout=WRITE_BEHIND_CONFIG["max_backoff_s"])
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(WRITE_BEHIND_CONFIG["flush_interval_s"] + self._backoff)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed")
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Final write-behind flush failed")
+
+    # Read-your-writes
+
+    def overlay(self, backend: str, rows: Any) -> Any:
+
+        # A copy of `rows` (query results of `backend`) with the pending writes applied to the
+        # rows whose key field matches. MySQL only gets the columns the row already has.
+
+        if not self._pending or not isinstance(rows, list):
+            return rows
+        with self._lock:
+            writes: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}  # key_field -> str(key) -> writes
+            for (pending_backend, target, key_field, key), entry in self._pending.items():
+                if pending_backend == backend and entry["fields"]:
+                    fields = {field: value for field, (value, _) in entry["fields"].items()}
+                    writes.setdefault(key_field, {}).setdefault(key, []).append(
+                        {"backend": backend, "target": target, "fields": fields})
+        if not writes:
+            return rows
+        overlaid = []
+        for row in rows:
+            if isinstance(row, dict):
+                for key_field, by_key in writes.items():
+                    for write in by_key.get(str(row.get(key_field)), ()):
+                        for path, value in overlay_paths(write):
+                            if backend != "mysql" or path[0] in row:
+                                row = set_path(row, path, value)
+            overlaid.append(row)
+        return overlaid
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            oldest = min((entry["since"] for entry in self._pending.values()), default=None)
+            return {
+                "enabled": WRITE_BEHIND_CONFIG["enabled"],
+                "running": self._thread is not None,
+                "pending_keys": len(self._pending),
+                "pending_fields": sum(len(entry["fields"]) for entry in self._pending.values()),
+                "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "last_seq": self._seq,
+                "appended": self.appended,
+                "coalesced": self.coalesced,
+                "flushed": dict(self.flushed),
+                "failed": dict(self.failed),
+                "backoff_seconds": self._backoff,
+                "last_flush": self.last_flush
+            }
+
+
+write_journal = WriteJournal(WRITE_BEHIND_CONFIG["journal_path"], WRITE_BEHIND_CONFIG["checkpoint_path"])
+
+
+def render_write_behind_metrics() -> List[str]:
+    stats = write_journal.stats()
+    lines = [
+        "# HELP chatdb_write_behind_pending_keys Records with write-behind writes not yet applied.",
+        "# TYPE chatdb_write_behind_pending_keys gauge",
+        f"chatdb_write_behind_pending_keys {stats['pending_keys']}",
+        "# HELP chatdb_write_behind_lag_seconds Age of the oldest write-behind write not yet applied.",
+        "# TYPE chatdb_write_behind_lag_seconds gauge",
+        f"chatdb_write_behind_lag_seconds {stats['lag_seconds']:g}",
+        "# HELP chatdb_write_behind_appended_total Modifications acknowledged from the write-behind journal.",
+        "# TYPE chatdb_write_behind_appended_total counter",
+        f"chatdb_write_behind_appended_total {stats['appended']}",
+        "# HELP chatdb_write_behind_coalesced_total Field writes superseded by a later write before a flush.",
+        "# TYPE chatdb_write_behind_coalesced_total counter",
+        f"chatdb_write_behind_coalesced_total {stats['coalesced']}"
+    ]
+    for field, documentation in (
+        ("flushed", "Records applied by the write-behind flusher, per backend."),
+        ("failed", "Records the store rejected and the write-behind flusher dropped, per backend."),
+    ):
+        name = f"chatdb_write_behind_{field}_total"
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} counter")
+        for backend, count in stats[field].items():
+            lines.append(f'{name}{{backend="{backend}"}} {count}')
+    return lines
+
+register_collector(render_write_behind_metrics)
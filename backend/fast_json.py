@@ -0,0 +1,211 @@
+import datetime
+import decimal
+import itertools
+import math
+from json.encoder import encode_basestring
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from starlette.responses import Response
+
+# orjson is an optional accelerator; the pure-Python encoder below produces the same output
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Single-pass JSON encoding for query results.
+# Replaces convert_objectid_to_str + FastAPI's jsonable_encoder + json.dumps,
+# which walk the same nested rows three times. Values are encoded the way
+# jsonable_encoder would encode them:
+# - ObjectId -> string
+# - Decimal (MySQL DECIMAL / AVG results) -> int when integral, else float
+# - datetime / date / time (MySQL DATE, DATETIME, TIME columns) -> ISO 8601 string
+# - timedelta -> total seconds
+# - NaN / Infinity (pandas-loaded Mongo documents) -> null
+
+def _encode_decimal(value: decimal.Decimal) -> Any:
+    if not value.is_finite():
+        return None
+    return int(value) if value.as_tuple().exponent >= 0 else float(value)
+
+def _encode_timedelta(value: datetime.timedelta) -> float:
+    return value.total_seconds()
+
+def _encode_isoformat(value: Any) -> str:
+    return value.isoformat()
+
+def _encode_bytes(value: bytes) -> str:
+    return value.decode("utf-8", errors="replace")
+
+def _decode_raw_bson(value: RawBSONDocument) -> dict:
+    # Only this one document is decoded; it is released as soon as it has been written
+    return bson.decode(value.raw)
+
+# Conversions for values JSON has no native representation for
+CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+    ObjectId: str,
+    decimal.Decimal: _encode_decimal,
+    datetime.datetime: _encode_isoformat,
+    datetime.date: _encode_isoformat,
+    datetime.time: _encode_isoformat,
+    datetime.timedelta: _encode_timedelta,
+    bytes: _encode_bytes,
+    RawBSONDocument: _decode_raw_bson,
+    set: list,
+    frozenset: list,
+}
+
+def convert_value(value: Any) -> Any:
+
+    # Converts one non-JSON value; used as the orjson `default` hook and as
+    # the fallback of the pure-Python encoder for subclasses and unknown types.
+
+    converter = CONVERTERS.get(type(value))
+    if converter is not None:
+        return converter(value)
+    for value_type, converter in CONVERTERS.items():
+        if isinstance(value, value_type):
+            return converter(value)
+    return str(value)
+
+def _encode_float(value: float, parts: List[str]) -> None:
+    parts.append(float.__repr__(value) if math.isfinite(value) else "null")
+
+def _encode_dict(value: dict, parts: List[str]) -> None:
+    if not value:
+        parts.append("{}")
+        return
+    append = parts.append
+    separator = "{"
+    for key, item in value.items():
+        if type(key) is not str:
+            key = _encode_key(key)
+        append(separator)
+        append(encode_basestring(key))
+        append(":")
+        encoder = ENCODERS.get(type(item))
+        if encoder is None:
+            _encode_other(item, parts)
+        else:
+            encoder(item, parts)
+        separator = ","
+    append("}")
+
+def _encode_key(key: Any) -> str:
+
+    # Object keys must be strings; scalars are rendered the way json.dumps renders them.
+
+    if isinstance(key, str):
+        return str(key)
+    if key is None:
+        return "null"
+    if isinstance(key, bool):
+        return "true" if key else "false"
+    if isinstance(key, int):
+        return int.__repr__(key)
+    if isinstance(key, float):
+        return float.__repr__(key) if math.isfinite(key) else "null"
+    return str(convert_value(key))
+
+def _encode_list(value: list, parts: List[str]) -> None:
+    if not value:
+        parts.append("[]")
+        return
+    append = parts.append
+    separator = "["
+    for item in value:
+        append(separator)
+        encoder = ENCODERS.get(type(item))
+        if encoder is None:
+            _encode_other(item, parts)
+        else:
+            encoder(item, parts)
+        separator = ","
+    append("]")
+
+def _encode_other(value: Any, parts: List[str]) -> None:
+
+    # Subclasses of the native types (bool is dispatched exactly, so it never gets here)
+    # and values that first need converting.
+
+    if value is None:
+        parts.append("null")
+    elif isinstance(value, str):
+        parts.append(encode_basestring(value))
+    elif isinstance(value, dict):
+        _encode_dict(value, parts)
+    elif isinstance(value, (list, tuple)):
+        _encode_list(value, parts)
+    elif isinstance(value, int):
+        parts.append(int.__repr__(value))
+    elif isinstance(value, float):
+        _encode_float(value, parts)
+    else:
+        converted = convert_value(value)
+        encoder = ENCODERS.get(type(converted))
+        if encoder is None:
+            parts.append(encode_basestring(str(converted)))
+        else:
+            encoder(converted, parts)
+
+# Exact-type dispatch table: one dict lookup per value on the hot path
+ENCODERS: Dict[type, Callable[[Any, List[str]], None]] = {
+    str: lambda value, parts: parts.append(encode_basestring(value)),
+    int: lambda value, parts: parts.append(int.__repr__(value)),
+    bool: lambda value, parts: parts.append("true" if value else "false"),
+    type(None): lambda value, parts: parts.append("null"),
+    float: _encode_float,
+    dict: _encode_dict,
+    list: _encode_list,
+    tuple: _encode_list,
+}
+
+def dumps(content: Any) -> bytes:
+
+    # Encodes content as compact UTF-8 JSON in a single pass.
+
+    if orjson is not None:
+        try:
+            return orjson.dumps(content, default=convert_value, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits or exotic dict keys; the pure-Python path handles them
+            pass
+    parts = []
+    encoder = ENCODERS.get(type(content))
+    if encoder is None:
+        _encode_other(content, parts)
+    else:
+        encoder(content, parts)
+    return "".join(parts).encode("utf-8")
+
+def iter_json_array(rows: Iterable[Any], chunk_size: int = 256) -> Iterator[bytes]:
+
+    # Yields a JSON array in chunks of chunk_size encoded rows, so a large result
+    # (e.g. RawBSONDocument rows) never has to exist as one encoded string.
+    # rows may be any iterable, such as a cursor that is read as the chunks are sent.
+
+    rows = iter(rows)
+    separator = b""
+    yield b"["
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield separator + dumps(chunk)[1:-1]
+        separator = b","
+    yield b"]"
+
+
+class FastJSONResponse(Response):
+
+    # JSON response rendered with the single-pass encoder. Endpoints must return an
+    # instance of it (not a plain dict) so that FastAPI skips jsonable_encoder.
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
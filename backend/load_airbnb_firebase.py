@@ -1,9 +1,12 @@
+import os
 import pandas as pd
 import firebase_admin
 from firebase_admin import credentials, db
 from tqdm import tqdm
+from loader_cleaning import strip_strings, blanks_to_none
 
-CSV_FILE_PATH = r"../sample_data/airbnb_listing_500.csv"
+# Set AIRBNB_CSV_PATH to load a generated dataset (see scale_dataset.py) instead of the sample
+CSV_FILE_PATH = os.environ.get("AIRBNB_CSV_PATH", r"../sample_data/airbnb_listing_500.csv")
 
 # These values must be replaced with actual credentials before deployment
 FIREBASE_CRED = "credential/<key.json file>" # replace with your firebase actual credential file path
@@ -21,10 +24,10 @@ df.drop_duplicates("id", inplace=True)
 df.dropna(subset=["id", "host_id"], inplace=True)
 
 # Clean string values by removing whitespace
-df = df.apply(lambda col: col.map(lambda x: x.strip() if isinstance(x, str) else x))
+df = strip_strings(df)
 
 # Replace empty strings and NaN values with None for proper Firebase JSON serialization
-df = df.where(df.ne(""), None).where(pd.notnull(df), None)
+df = blanks_to_none(df)
 
 # Remove currency symbols in pricing column and reformatting
 for col in ["price"]:
@@ -1,8 +1,11 @@
+import os
 import pandas as pd
 import ast
 from pymongo import MongoClient
+from loader_cleaning import strip_strings, blanks_to_none
 
-CSV_FILE_PATH = r"../sample_data/airbnb_listing_500.csv"
+# Set AIRBNB_CSV_PATH to load a generated dataset (see scale_dataset.py) instead of the sample
+CSV_FILE_PATH = os.environ.get("AIRBNB_CSV_PATH", r"../sample_data/airbnb_listing_500.csv")
 
 # These values must be replaced with actual credentials before deployment
 MONGO_URI = "mongodb://localhost:27017/" # MongoDB server address, replace with your actual MongoDB URI
@@ -21,10 +24,10 @@ df.drop_duplicates(subset=["id"], inplace=True)
 df.dropna(subset=["id"], inplace=True)
 
 # Remove whitespace to clean string values
-df = df.apply(lambda col: col.map(lambda x: x.strip() if isinstance(x, str) else x))
+df = strip_strings(df)
 
 # Replace empty strings and NaN values with None for proper MongoDB document serialization
-df = df.where(df.ne(""), None).where(pd.notnull(df), None)
+df = blanks_to_none(df)
 
 # MongoDB document schema design
 meta_fields = [
@@ -1,8 +1,11 @@
+import os
 import mysql.connector
 import pandas as pd
 import numpy as np
+from loader_cleaning import strip_strings, nulls_to_none
 
-CSV_FILE_PATH = r"../sample_data/airbnb_listing_500.csv"
+# Set AIRBNB_CSV_PATH to load a generated dataset (see scale_dataset.py) instead of the sample
+CSV_FILE_PATH = os.environ.get("AIRBNB_CSV_PATH", r"../sample_data/airbnb_listing_500.csv")
 
 
 # MySQL server address, port, user, password, and database name, 
@@ -27,10 +30,10 @@ df.drop_duplicates("id", inplace=True)
 df.dropna(subset=["id", "host_id"], inplace=True)
 
 # Remove redundant whitespace from string fields
-df = df.apply(lambda col: col.map(lambda x: x.strip() if isinstance(x, str) else x))
+df = strip_strings(df)
 
 # Convert NaN values to None for proper SQL handling
-df = df.astype(object).where(pd.notnull(df), None)
+df = nulls_to_none(df)
 
 # Define the columns for each table
 hosts_cols = [
@@ -133,7 +136,11 @@ CREATE TABLE Listings (
   neighbourhood_group_cleansed VARCHAR(100),
   latitude DOUBLE,
   longitude DOUBLE,
+  -- Kept in sync with latitude/longitude by MySQL; a SPATIAL index needs NOT NULL, so listings
+  -- without coordinates get POINT(0 0) and are excluded by the near queries (see database/geo_index.py)
+  location POINT GENERATED ALWAYS AS (ST_SRID(POINT(COALESCE(longitude, 0), COALESCE(latitude, 0)), 4326)) STORED NOT NULL SRID 4326,
   host_id BIGINT,
+  SPATIAL INDEX idx_listings_location (location),
   FOREIGN KEY (host_id) REFERENCES Hosts(host_id)
 );
 """)
@@ -182,6 +189,11 @@ for _, row in listings_df.iterrows():
     cursor.execute(listings_q, tuple(vals))
 conn.commit()
 
+# Keyword search with MATCH(description, neighborhood_overview) AGAINST (...).
+# Built once after the load, which is much faster than maintaining it row by row.
+cursor.execute("ALTER TABLE Listings ADD FULLTEXT INDEX ft_listings_text (description, neighborhood_overview);")
+conn.commit()
+
 # Insert review data, using listing ID as foreign key and primary key
 reviews_df = df[reviews_cols].dropna(subset=["id"])
 reviews_q = f"""
@@ -0,0 +1,16 @@
+import pandas as pd
+
+# Cleaning steps shared by the load_airbnb_* scripts (and timed by
+# test_files/benchmark_hot_paths.py, so loader changes are benchmarked).
+
+# Remove redundant whitespace from string fields
+def strip_strings(df: pd.DataFrame) -> pd.DataFrame:
+    return df.apply(lambda col: col.map(lambda x: x.strip() if isinstance(x, str) else x))
+
+# Replace empty strings and NaN values with None (MongoDB documents, Firebase JSON)
+def blanks_to_none(df: pd.DataFrame) -> pd.DataFrame:
+    return df.where(df.ne(""), None).where(pd.notnull(df), None)
+
+# Convert NaN values to None for proper SQL handling
+def nulls_to_none(df: pd.DataFrame) -> pd.DataFrame:
+    return df.astype(object).where(pd.notnull(df), None)
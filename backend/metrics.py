@@ -0,0 +1,271 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from admission import Overloaded, admission_stats
+from circuit_breaker import CircuitOpen, circuit_stats
+from database.query_cache import QUERY_CACHES
+from tracing import span
+
+# Per-stage latency instrumentation.
+# Each stage of a request (LLM translation attempts, each backend call, id pushdown,
+# merge, encode) is timed with stage() or @timed_stage and
+# - observed into the chatdb_stage_duration_seconds histogram served on /metrics
+#   (Prometheus text format), and
+# - collected for the current request and sent back in its Server-Timing header, e.g.
+#   Server-Timing: llm;desc="attempt 1";dur=812.4, mysql;dur=11.9, merge;dur=0.3, encode;dur=1.1, total;dur=829.0
+# Recording a stage costs two perf_counter() calls and one short lock.
+
+# Histogram bucket upper bounds in seconds; LLM calls take seconds, cached reads microseconds
+METRICS_CONFIG = {
+    "buckets": (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+}
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    # Monotonic counter with a fixed set of label names.
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+
+    # Cumulative-bucket histogram, rendered the way prometheus_client renders one.
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets or METRICS_CONFIG["buckets"])
+        # label values -> [count per bucket..., count in +Inf, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        # Non-cumulative slot; render() accumulates
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                slot = i
+                break
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            counts[slot] += 1
+            counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(snapshot.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative:g}")
+            cumulative += counts[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative:g}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {counts[-1]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative:g}")
+        return lines
+
+
+REQUESTS = Counter("chatdb_requests_total", "HTTP requests by path and status code.", ("path", "status"))
+REQUEST_SECONDS = Histogram("chatdb_request_duration_seconds", "HTTP request latency by path.", ("path",))
+STAGE_SECONDS = Histogram("chatdb_stage_duration_seconds", "Latency of each request stage (llm, mysql, mongodb, firebase, pushdown, merge, encode, ...).", ("stage",))
+BACKEND_ERRORS = Counter("chatdb_backend_errors_total", "Failed backend calls by backend.", ("backend",))
+LLM_RETRIES = Counter("chatdb_llm_retries_total", "Gemini translation attempts after the first, by purpose.", ("purpose",))
+
+METRICS = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, BACKEND_ERRORS, LLM_RETRIES]
+
+# Functions returning extra exposition lines, for modules that metrics.py cannot import
+# without an import cycle (they import the connectors, which import metrics)
+COLLECTORS: List[Callable[[], List[str]]] = []
+
+def register_collector(collector: Callable[[], List[str]]) -> None:
+    COLLECTORS.append(collector)
+
+# Stage timings of the current request: [(name, description, seconds), ...]; None outside a request
+_request_timings: ContextVar[Optional[List[Tuple[str, Optional[str], float]]]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str, desc: Optional[str] = None, backend: Optional[str] = None) -> Iterator[None]:
+
+    # Times the enclosed block as stage `name` (and records it as a span when the request
+    # is traced). With `backend`, an exception leaving the block is also counted in
+    # chatdb_backend_errors_total, unless the call was shed by admission control or an
+    # open circuit before reaching the backend (see admission.py, circuit_breaker.py).
+
+    started = time.perf_counter()
+    try:
+        with span(name, desc=desc):
+            yield
+    except Exception as e:
+        if backend is not None and not isinstance(e, (Overloaded, CircuitOpen)):
+            BACKEND_ERRORS.inc(backend=backend)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, desc, elapsed))
+
+def timed_stage(name: str, backend: Optional[str] = None) -> Callable:
+
+    # Decorator form of stage() for connector functions.
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, backend=backend):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing_header(timings: List[Tuple[str, Optional[str], float]], total: float) -> str:
+
+    # Repeated stages with the same name and description (e.g. several pushdown steps)
+    # are summed into one entry; durations are in milliseconds.
+
+    merged: Dict[Tuple[str, Optional[str]], float] = {}
+    for name, desc, elapsed in timings:
+        merged[(name, desc)] = merged.get((name, desc), 0.0) + elapsed
+    entries = [
+        f'{name};desc="{desc}";dur={elapsed * 1000:.1f}' if desc else f"{name};dur={elapsed * 1000:.1f}"
+        for (name, desc), elapsed in merged.items()
+    ]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+
+    # ASGI middleware: counts and times every HTTP request and adds the Server-Timing
+    # header. Stages that run after the headers are sent (streamed bodies) only reach
+    # /metrics. Requests that matched no route are labelled path="other" so that
+    # arbitrary URLs cannot grow the label set; requests shed by AdmissionMiddleware
+    # keep their (fixed, configured) path.
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                header = server_timing_header(timings, time.perf_counter() - started)
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            # The router adds the matched endpoint to the scope
+            known = scope.get("endpoint") is not None or scope.get("admission_shed") is not None
+            path = scope["path"] if known else "other"
+            REQUESTS.inc(path=path, status=str(status[0]))
+            REQUEST_SECONDS.observe(elapsed, path=path)
+            _request_timings.reset(token)
+
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def render_metrics() -> str:
+
+    # Prometheus text exposition of all metrics plus the query cache, admission and circuit counters.
+
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    cache_stats = {backend: cache.stats() for backend, cache in QUERY_CACHES.items()}
+    for field, kind, documentation in (
+        ("hits", "counter", "Query cache hits by backend."),
+        ("misses", "counter", "Query cache misses by backend."),
+        ("evictions", "counter", "Query cache LRU evictions by backend."),
+        ("invalidations", "counter", "Query cache entries dropped by writes, by backend."),
+        ("hit_ratio", "gauge", "Query cache hits / lookups by backend."),
+        ("entries", "gauge", "Query cache entries by backend."),
+    ):
+        name = f"chatdb_query_cache_{field}" + ("_total" if kind == "counter" else "")
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for backend, stats in cache_stats.items():
+            lines.append(f'{name}{{backend="{backend}"}} {stats[field]:g}')
+    admission = admission_stats()
+    for field, name, kind, documentation in (
+        ("limit", "chatdb_admission_limit", "gauge", "Concurrent holders allowed per resource."),
+        ("active", "chatdb_admission_active", "gauge", "Slots in use per resource."),
+        ("waiting", "chatdb_admission_queue_depth", "gauge", "Callers queued per resource."),
+        ("peak_waiting", "chatdb_admission_queue_depth_peak", "gauge", "Deepest queue seen per resource since start."),
+        ("admitted", "chatdb_admission_admitted_total", "counter", "Callers admitted per resource."),
+        ("wait_seconds", "chatdb_admission_wait_seconds_total", "counter", "Time spent queued per resource."),
+    ):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for resource, stats in admission.items():
+            lines.append(f'{name}{{resource="{resource}"}} {stats[field]:g}')
+    lines.append("# HELP chatdb_admission_shed_total Callers rejected per resource: queue_full (429) or deadline (503).")
+    lines.append("# TYPE chatdb_admission_shed_total counter")
+    for resource, stats in admission.items():
+        for reason in ("queue_full", "deadline"):
+            lines.append(f'chatdb_admission_shed_total{{resource="{resource}",reason="{reason}"}} {stats["shed_" + reason]:g}')
+    circuits = circuit_stats()
+    lines.append("# HELP chatdb_circuit_state Circuit breaker state per backend: 0 closed, 1 half-open, 2 open.")
+    lines.append("# TYPE chatdb_circuit_state gauge")
+    for backend, stats in circuits.items():
+        lines.append(f'chatdb_circuit_state{{backend="{backend}"}} {CIRCUIT_STATES[stats["state"]]}')
+    for field, name, documentation in (
+        ("opened_total", "chatdb_circuit_opened_total", "Times each backend's circuit opened."),
+        ("rejected_total", "chatdb_circuit_rejected_total", "Calls failed fast by an open circuit, per backend."),
+    ):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} counter")
+        for backend, stats in circuits.items():
+            lines.append(f'{name}{{backend="{backend}"}} {stats[field]:g}')
+    for collector in COLLECTORS:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
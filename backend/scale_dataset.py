@@ -0,0 +1,252 @@
+import argparse
+import bisect
+import csv
+import gzip
+import json
+import math
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+CSV_FILE_PATH = r"../sample_data/airbnb_listing_500.csv"
+
+# Synthetic dataset scaler: learns the column distributions of the sample listings CSV
+# and streams a statistically similar CSV of any size (10k .. 10M rows) with the same
+# header, so the load_airbnb_* loaders and the benchmarks can run at production sizes.
+#
+# Usage (from the backend folder):
+#   python scale_dataset.py --rows 100000 --output ../sample_data/airbnb_listing_100k.csv
+#   python scale_dataset.py --rows 10000000 --output ../sample_data/airbnb_listing_10m.csv.gz --compact
+#
+# Point a loader at the result with AIRBNB_CSV_PATH=../sample_data/airbnb_listing_100k.csv.
+#
+# How each group of columns is generated:
+# - hosts: the number of listings per host follows calculated_host_listings_count
+#   (re-weighted from per-listing to per-host), every listing of a host shares its
+#   host_* columns and host_id, and listing/host ids are unique and increasing
+# - location: neighbourhood, neighbourhood group and a base coordinate are drawn together
+#   from one sample row; the coordinate is jittered inside that neighbourhood
+# - room: property_type, room_type, accommodates, bedrooms, beds, bathrooms are drawn
+#   together from one sample row, price from a log-normal fitted per room_type
+# - availability: the availability_30/60/90/365 tuple is drawn from one sample row, so
+#   30 <= 60 <= 90 <= 365 still holds
+# - amenities: list length from the sample lengths, items by their sample frequency
+# - reviews, nights and everything else: drawn together from one sample row
+
+HOST_COLUMNS = [
+    "host_id", "host_url", "host_name", "host_since", "host_location", "host_about",
+    "host_response_time", "host_response_rate", "host_acceptance_rate", "host_is_superhost",
+    "host_thumbnail_url", "host_picture_url", "host_neighbourhood", "host_listings_count",
+    "host_total_listings_count", "host_verifications", "host_has_profile_pic",
+    "host_identity_verified", "calculated_host_listings_count",
+    "calculated_host_listings_count_entire_homes", "calculated_host_listings_count_private_rooms",
+    "calculated_host_listings_count_shared_rooms"
+]
+LOCATION_COLUMNS = ["neighbourhood", "neighbourhood_cleansed", "neighbourhood_group_cleansed", "latitude", "longitude"]
+ROOM_COLUMNS = ["property_type", "room_type", "accommodates", "bathrooms", "bathrooms_text", "bedrooms", "beds"]
+AVAILABILITY_COLUMNS = ["has_availability", "availability_30", "availability_60", "availability_90", "availability_365"]
+REVIEW_COLUMNS = [
+    "number_of_reviews", "number_of_reviews_ltm", "number_of_reviews_l30d", "first_review", "last_review",
+    "review_scores_rating", "review_scores_accuracy", "review_scores_cleanliness", "review_scores_checkin",
+    "review_scores_communication", "review_scores_location", "review_scores_value", "reviews_per_month"
+]
+# Long free-text columns emptied by --compact (they are ~80% of the file size)
+TEXT_COLUMNS = ["description", "neighborhood_overview", "host_about"]
+
+# Standard deviation, in degrees, of the jitter applied to a drawn coordinate
+COORDINATE_JITTER = 0.004
+FIRST_LISTING_ID = 10_000_000
+FIRST_HOST_ID = 500_000_000
+
+
+def to_float(value: str) -> Optional[float]:
+    try:
+        return float(value.replace("$", "").replace(",", "")) if value else None
+    except ValueError:
+        return None
+
+
+class WeightedChoice:
+
+    # O(log n) draws from a fixed discrete distribution.
+
+    def __init__(self, values: List[Any], weights: List[float]):
+        self.values = values
+        self.cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+        self.total = total
+
+    def draw(self, rng: random.Random) -> Any:
+        return self.values[bisect.bisect_right(self.cumulative, rng.random() * self.total)]
+
+
+class ListingModel:
+
+    # Distributions learned from the sample CSV.
+
+    def __init__(self, csv_path: str):
+        with open(csv_path, encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            self.header = reader.fieldnames
+            self.rows = [row for row in reader if to_float(row["id"]) is not None]
+        if not self.rows:
+            raise ValueError(f"No listings in {csv_path}")
+
+        # Hosts: the sample lists one row per listing, so a host with k listings is k times
+        # more likely to appear; dividing by k gives the per-host distribution.
+        listing_counts = Counter(int(to_float(r["calculated_host_listings_count"]) or 1) for r in self.rows)
+        counts = sorted(listing_counts)
+        self.listings_per_host = WeightedChoice(counts, [listing_counts[k] / k for k in counts])
+
+        # Price: log-normal per room_type
+        log_prices = defaultdict(list)
+        for r in self.rows:
+            price = to_float(r["price"])
+            if price:
+                log_prices[r["room_type"]].append(math.log(price))
+        all_log_prices = [p for values in log_prices.values() for p in values] or [math.log(100)]
+        self.price_params = {
+            room_type: self._log_normal(values if len(values) > 1 else all_log_prices)
+            for room_type, values in log_prices.items()
+        }
+        self.default_price_params = self._log_normal(all_log_prices)
+        self.price_bounds = (math.exp(min(all_log_prices)), math.exp(max(all_log_prices)))
+
+        # Amenities: list length and per-item frequency
+        self.amenity_lengths = []
+        amenity_counts = Counter()
+        for r in self.rows:
+            try:
+                amenities = json.loads(r["amenities"]) if r["amenities"] else []
+            except ValueError:
+                amenities = []
+            self.amenity_lengths.append(len(amenities))
+            amenity_counts.update(amenities)
+        names = list(amenity_counts)
+        self.amenities = WeightedChoice(names, [amenity_counts[n] for n in names]) if names else None
+
+    @staticmethod
+    def _log_normal(values: List[float]) -> tuple:
+        mean = sum(values) / len(values)
+        variance = sum((v - mean) ** 2 for v in values) / max(len(values) - 1, 1)
+        return mean, math.sqrt(variance)
+
+    def draw_price(self, rng: random.Random, room_type: str) -> str:
+        mean, sigma = self.price_params.get(room_type, self.default_price_params)
+        low, high = self.price_bounds
+        return f"${min(max(rng.lognormvariate(mean, sigma), low), high):,.2f}"
+
+    def draw_amenities(self, rng: random.Random) -> str:
+        length = rng.choice(self.amenity_lengths)
+        if not length or self.amenities is None:
+            return "[]"
+        length = min(length, len(self.amenities.values))
+        picked = {}
+        # Oversample then de-duplicate; frequent amenities are drawn more often, as in the sample
+        while len(picked) < length:
+            for _ in range(length - len(picked) + 4):
+                picked.setdefault(self.amenities.draw(rng))
+        return json.dumps(list(picked)[:length])
+
+
+def jitter_coordinate(rng: random.Random, value: str) -> str:
+    coordinate = to_float(value)
+    return value if coordinate is None else f"{coordinate + rng.gauss(0, COORDINATE_JITTER):.6f}"
+
+def host_columns(model: ListingModel, rng: random.Random, host_id: int, listing_count: int) -> Dict[str, str]:
+    template = rng.choice(model.rows)
+    host = {column: template[column] for column in HOST_COLUMNS if column in template}
+    host["host_id"] = str(host_id)
+    host["host_url"] = f"https://www.airbnb.com/users/show/{host_id}"
+    for column in ("host_listings_count", "host_total_listings_count", "calculated_host_listings_count"):
+        if column in host:
+            host[column] = str(listing_count)
+    return host
+
+def generate_rows(model: ListingModel, row_count: int, seed: int = 551, compact: bool = False):
+
+    # Yields row_count listing dicts one at a time; memory use does not grow with row_count.
+
+    rng = random.Random(seed)
+    listing_id = FIRST_LISTING_ID
+    host_id = FIRST_HOST_ID
+    emitted = 0
+    while emitted < row_count:
+        host_id += rng.randint(1, 50)
+        listing_count = min(model.listings_per_host.draw(rng), row_count - emitted)
+        host = host_columns(model, rng, host_id, listing_count)
+        room_types = Counter()
+        listings = []
+        for _ in range(listing_count):
+            listing_id += rng.randint(1, 20)
+            row = dict(rng.choice(model.rows))
+            row.update(host)
+            location = rng.choice(model.rows)
+            for column in LOCATION_COLUMNS:
+                row[column] = location[column]
+            row["latitude"] = jitter_coordinate(rng, location["latitude"])
+            row["longitude"] = jitter_coordinate(rng, location["longitude"])
+            room = rng.choice(model.rows)
+            for column in ROOM_COLUMNS:
+                row[column] = room[column]
+            availability = rng.choice(model.rows)
+            for column in AVAILABILITY_COLUMNS:
+                row[column] = availability[column]
+            reviews = rng.choice(model.rows)
+            for column in REVIEW_COLUMNS:
+                row[column] = reviews[column]
+            row["id"] = str(listing_id)
+            row["listing_url"] = f"https://www.airbnb.com/rooms/{listing_id}"
+            row["price"] = model.draw_price(rng, row["room_type"])
+            row["amenities"] = model.draw_amenities(rng)
+            if compact:
+                for column in TEXT_COLUMNS:
+                    row[column] = ""
+            room_types[row["room_type"]] += 1
+            listings.append(row)
+        # Per-host room type breakdowns must agree with the host's generated listings
+        breakdown = {
+            "calculated_host_listings_count_entire_homes": room_types["Entire home/apt"],
+            "calculated_host_listings_count_private_rooms": room_types["Private room"],
+            "calculated_host_listings_count_shared_rooms": room_types["Shared room"]
+        }
+        for row in listings:
+            for column, count in breakdown.items():
+                if column in row:
+                    row[column] = str(count)
+            yield row
+        emitted += listing_count
+
+def write_csv(model: ListingModel, output_path: str, row_count: int, seed: int = 551, compact: bool = False) -> None:
+    opener = gzip.open if output_path.endswith(".gz") else open
+    started = time.perf_counter()
+    with opener(output_path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=model.header)
+        writer.writeheader()
+        for i, row in enumerate(generate_rows(model, row_count, seed, compact), 1):
+            writer.writerow(row)
+            if i % 100_000 == 0:
+                print(f"  {i:,} rows ({i / (time.perf_counter() - started):,.0f} rows/s)", file=sys.stderr)
+    print(f"Wrote {row_count:,} rows to {output_path} in {time.perf_counter() - started:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic listings CSV shaped like the sample data")
+    parser.add_argument("--rows", type=int, required=True, help="number of listings to generate, e.g. 10000 to 10000000")
+    parser.add_argument("--output", required=True, help="output CSV path; a .gz suffix writes gzip")
+    parser.add_argument("--source", default=CSV_FILE_PATH, help="sample CSV to learn the distributions from")
+    parser.add_argument("--seed", type=int, default=551, help="random seed; the same seed gives the same file")
+    parser.add_argument("--compact", action="store_true", help="leave the long free-text columns empty")
+    args = parser.parse_args()
+    if args.rows <= 0:
+        parser.error("--rows must be positive")
+
+    model = ListingModel(args.source)
+    write_csv(model, args.output, args.rows, args.seed, args.compact)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+# Microbenchmarks for the CPU work done in the backend process rather than in the databases:
+# - query_firebase filtering/sorting (_execute_firebase_query on an in-memory node)
+# - convert_objectid_to_str
+# - the /query merge (merge_result_refs + build_merged_rows)
+# - extract_candidate_text + remove_code_fences on a fenced Gemini response
+# - the loader cleaning steps in loader_cleaning.py
+# Each runs at 1k / 100k / 1M synthetic rows (or --sizes) and keeps the best of --repeat runs.
+#
+# --save-baseline writes the timings to benchmark_baseline.json; later runs compare against it
+# and exit with status 1 when a benchmark is more than --threshold slower than its baseline,
+# or with status 2 when there is no baseline to compare against.
+# Baselines are machine specific: record them on the machine that runs the comparison.
+#
+# Usage (from the backend folder):
+#   python test_files/benchmark_hot_paths.py --save-baseline
+#   python test_files/benchmark_hot_paths.py --threshold 0.2
+#   python test_files/benchmark_hot_paths.py --sizes 1000 100000 --only merge firebase_filter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from bson import ObjectId
+
+import app
+import loader_cleaning
+from database import firebase_connector
+from database.mongodb_connector import convert_objectid_to_str
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+ROOM_TYPES = ["Entire home/apt", "Private room", "Shared room", "Hotel room"]
+NEIGHBOURHOODS = ["Downtown", "Mission", "SOMA", "Midtown", "Castro", "Nob Hill"]
+
+
+# Synthetic inputs, built once per size outside the timed region
+
+def make_firebase_node(count):
+    rng = random.Random(3)
+    return {
+        str(1000 + i): {
+            "pricing": {"price": rng.randint(20, 900) if i % 50 else None},
+            "availability": {"availability_30": rng.randint(0, 30), "availability_365": rng.randint(0, 365)},
+            "host": {"host_is_superhost": rng.choice(["t", "f"])}
+        }
+        for i in range(count)
+    }
+
+def make_mongo_docs(count):
+    rng = random.Random(2)
+    return [
+        {
+            "_id": 1000 + i,
+            "doc_id": ObjectId(),
+            "host_id": 5000 + i // 3,
+            "host_response_rate": float("nan") if i % 7 == 0 else rng.random(),
+            "neighbourhood_cleansed": rng.choice(NEIGHBOURHOODS),
+            "media": {"picture_url": f"https://example.com/{i}.jpg", "tags": ["a", "b"]}
+        }
+        for i in range(count)
+    ]
+
+def make_merge_results(count):
+    rng = random.Random(1)
+    mysql = [{"id": 1000 + i, "name": f"Listing {i}", "room_type": rng.choice(ROOM_TYPES)} for i in range(count)]
+    mongodb = [{"_id": 1000 + i, "host_id": 5000 + i // 3, "neighbourhood_cleansed": rng.choice(NEIGHBOURHOODS)} for i in range(count)]
+    # Firebase returns ids as strings and only has a subset of the listings
+    firebase = [{"id": str(1000 + i), "pricing": {"price": rng.randint(20, 900)}} for i in range(0, count, 2)]
+    rng.shuffle(mongodb)
+    return {"mysql": mysql, "mongodb": mongodb, "firebase": firebase}
+
+def make_gemini_candidate(count):
+    rows = ",\n".join(json.dumps({"id": 1000 + i, "name": f"Listing {i}"}) for i in range(count))
+    text = f"```json\n[\n{rows}\n]\n```"
+    return SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))
+
+def make_loader_frame(count):
+    # Ten string columns with padding, blanks and missing values, as read by pd.read_csv
+    rng = random.Random(4)
+    columns = {}
+    for c in range(10):
+        columns[f"col_{c}"] = [
+            None if i % 11 == 0 else ("" if i % 13 == 0 else f"  {rng.choice(NEIGHBOURHOODS)} {i % 97} ")
+            for i in range(count)
+        ]
+    return pd.DataFrame(columns)
+
+
+class FakeReference:
+    def __init__(self, data):
+        self.data = data
+
+    def get(self):
+        # A real download decodes fresh dicts on every call
+        return {key: dict(value) for key, value in self.data.items()}
+
+
+def bench_firebase_filter(count):
+    node = make_firebase_node(count)
+    query = {
+        "pricing": {"price": {"$lt": 400}},
+        "availability": {"availability_30": {"$gt": 5}},
+        "orderBy": "pricing/price",
+        "limitToFirst": 50
+    }
+    firebase_connector.initialize_firebase = lambda: None
+    firebase_connector.get_reference = lambda path: FakeReference(node)
+    return lambda: firebase_connector._execute_firebase_query("listings", query)
+
+def bench_convert_objectid(count):
+    docs = make_mongo_docs(count)
+    return lambda: convert_objectid_to_str(docs)
+
+def bench_merge(count):
+    results = make_merge_results(count)
+    def run():
+        refs = app.merge_result_refs(results)
+        return app.build_merged_rows(results, refs)
+    return run
+
+def bench_response_parsing(count):
+    candidate = make_gemini_candidate(count)
+    return lambda: app.remove_code_fences(app.extract_candidate_text(candidate))
+
+def bench_loader_cleaning(count):
+    frame = make_loader_frame(count)
+    def run():
+        loader_cleaning.blanks_to_none(loader_cleaning.strip_strings(frame))
+        loader_cleaning.nulls_to_none(frame)
+    return run
+
+BENCHMARKS = {
+    "firebase_filter": bench_firebase_filter,
+    "convert_objectid": bench_convert_objectid,
+    "merge": bench_merge,
+    "response_parsing": bench_response_parsing,
+    "loader_cleaning": bench_loader_cleaning,
+}
+
+
+def best_of(fn, repeat):
+    # Like timeit: the garbage collector is paused so collections triggered by
+    # earlier allocations do not land in a random run
+    timings = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+    return min(timings)
+
+def run_benchmarks(names, sizes, repeat):
+    timings = {}
+    for name in names:
+        for size in sizes:
+            fn = BENCHMARKS[name](size)
+            # Fast benchmarks get extra runs (about half a second's worth) since their minimum
+            # is noisier; the largest inputs get fewer so a full run takes a few minutes
+            estimate = best_of(fn, 1)
+            runs = max(repeat, min(200, int(0.5 / max(estimate, 1e-6)))) if size < 1000000 else max(1, repeat // 2)
+            elapsed = min(estimate, best_of(fn, runs))
+            timings[f"{name}/{size}"] = elapsed
+            print(f"  {name:<20}{size:>10,} rows {elapsed * 1000:>12.2f} ms")
+    return timings
+
+def compare(timings, baseline, threshold, min_ms):
+    regressions = []
+    print(f"\n{'benchmark':<30}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for key, elapsed in timings.items():
+        previous = baseline.get(key)
+        if previous is None:
+            print(f"{key:<30}{'-':>14}{elapsed * 1000:>14.2f}{'new':>10}")
+            continue
+        change = elapsed / previous - 1
+        # Timings below min_ms are too noisy to gate on
+        flagged = change > threshold and elapsed * 1000 >= min_ms
+        print(f"{key:<30}{previous * 1000:>14.2f}{elapsed * 1000:>14.2f}{change:>+10.1%}{'  REGRESSION' if flagged else ''}")
+        if flagged:
+            regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the in-process hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="synthetic row counts")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark; the fastest is kept")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON path")
+    parser.add_argument("--save-baseline", action="store_true", help="record these timings as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before failing, 0.25 = 25%%")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="ignore regressions in timings below this")
+    args = parser.parse_args()
+
+    print("=== HOT PATH BENCHMARKS ===")
+    timings = run_benchmarks(args.only, args.sizes, args.repeat)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f).get("timings", {})
+        baseline.update(timings)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.node(), "timings": baseline}, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        # A missing baseline must not pass silently, or the gate never runs
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline first")
+        sys.exit(2)
+    with open(args.baseline, encoding="utf-8") as f:
+        recorded = json.load(f)
+    baseline = recorded["timings"]
+    if recorded.get("machine") != platform.node():
+        print(f"\nNote: the baseline was recorded on {recorded.get('machine')!r} with Python {recorded.get('python')}; "
+              f"timings from another machine are only roughly comparable, so re-record it with --save-baseline there")
+    regressions = compare(timings, baseline, args.threshold, args.min_ms)
+    if regressions:
+        print(f"\nFAIL: {len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\nOK: no benchmark regressed more than {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import datetime
+import decimal
+import os
+import random
+import sys
+import time
+
+# Compares the previous /query serialisation path
+#   convert_objectid_to_str -> jsonable_encoder -> JSONResponse.render
+# with the single-pass fast_json encoder (orjson-backed and pure Python)
+# on synthetic MySQL and MongoDB result rows. No database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/benchmark_serialization.py [row_count ...]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import fast_json
+from database.mongodb_connector import convert_objectid_to_str
+
+ROOM_TYPES = ["Entire home/apt", "Private room", "Shared room", "Hotel room"]
+NEIGHBOURHOODS = ["Downtown", "Mission", "SOMA", "Midtown", "Castro", "Nob Hill"]
+AMENITIES = ["Wifi", "Kitchen", "Dishwasher", "Free parking on premises", "Heating", "Washer", "Dryer", "TV"]
+
+
+def make_mysql_rows(count):
+    rng = random.Random(1)
+    return [
+        {
+            "id": 1000 + i,
+            "name": f"Listing {i}",
+            "room_type": rng.choice(ROOM_TYPES),
+            "neighbourhood_cleansed": rng.choice(NEIGHBOURHOODS),
+            "first_review": datetime.date(2019, 1, 1) + datetime.timedelta(days=i % 1000),
+            "review_scores_rating": rng.random() * 5,
+            "avg_value": decimal.Decimal(f"{rng.random() * 5:.4f}")
+        }
+        for i in range(count)
+    ]
+
+def make_mongo_rows(count):
+    rng = random.Random(2)
+    return [
+        {
+            "_id": 1000 + i,
+            "doc_id": ObjectId(),
+            "host_id": 5000 + i // 3,
+            "host_response_rate": float("nan") if i % 7 == 0 else rng.random(),
+            "neighbourhood_cleansed": rng.choice(NEIGHBOURHOODS),
+            "amenities": rng.sample(AMENITIES, 5)
+        }
+        for i in range(count)
+    ]
+
+def previous_path(mysql_rows, mongo_rows):
+    mongo_rows = convert_objectid_to_str(mongo_rows)
+    content = {"converted_queries": {}, "results": {"mysql": mysql_rows, "mongodb": mongo_rows, "merged": mysql_rows}}
+    return JSONResponse(content=None).render(jsonable_encoder(content))
+
+def fast_path(mysql_rows, mongo_rows):
+    content = {"converted_queries": {}, "results": {"mysql": mysql_rows, "mongodb": mongo_rows, "merged": mysql_rows}}
+    return fast_json.dumps(content)
+
+def pure_python_path(mysql_rows, mongo_rows):
+    accelerator = fast_json.orjson
+    fast_json.orjson = None
+    try:
+        return fast_path(mysql_rows, mongo_rows)
+    finally:
+        fast_json.orjson = accelerator
+
+def best_of(fn, args, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def run(row_count, repeat=5):
+    mysql_rows = make_mysql_rows(row_count)
+    mongo_rows = make_mongo_rows(row_count)
+    args = (mysql_rows, mongo_rows)
+    baseline = best_of(previous_path, args, repeat)
+    print(f"\nRows per backend: {row_count}")
+    print(f"  {'previous path':<28}{baseline * 1000:>10.1f} ms")
+    paths = [("fast_json (pure Python)", pure_python_path)]
+    if fast_json.orjson is not None:
+        paths.append(("fast_json (orjson)", fast_path))
+    for label, fn in paths:
+        elapsed = best_of(fn, args, repeat)
+        print(f"  {label:<28}{elapsed * 1000:>10.1f} ms  ({baseline / elapsed:.1f}x)")
+
+def main():
+    print("=== QUERY RESULT SERIALISATION BENCHMARK ===")
+    row_counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    for row_count in row_counts:
+        run(row_count)
+
+if __name__ == "__main__":
+    main()
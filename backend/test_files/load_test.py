@@ -0,0 +1,382 @@
+import argparse
+import ast
+import contextlib
+import csv
+import io
+import json
+import os
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import bson
+import requests
+import uvicorn
+from bson.raw_bson import RawBSONDocument
+
+# Load-testing harness for /query, /explore and /modify.
+# Starts the FastAPI app in-process with a replaying stub in place of genai.Client
+# (translations come from recorded_translations.json, so no Gemini key is needed)
+# and, unless --live-backends is given, in-process stand-ins for MySQL, MongoDB and
+# Firebase serving rows from sample_data/airbnb_listing_500.csv with a fixed latency.
+# Reports throughput and p50/p95/p99 latency per endpoint, and exits with status 1
+# when a --max-* threshold is exceeded so it can gate a deploy.
+#
+# Usage (from the backend folder):
+#   python test_files/load_test.py --requests 600 --concurrency 16
+#   python test_files/load_test.py --live-backends --max-p95-ms 250
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import app
+from database import aggregate_store, amenity_index, geo_index, replication_log, text_index, write_journal
+
+RECORDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded_translations.json")
+CSV_FILE_PATH = os.path.join(os.path.dirname(BACKEND_DIR), "sample_data", "airbnb_listing_500.csv")
+
+# How the natural language text is embedded in each of the app's prompts
+PROMPT_PATTERNS = [
+    ("query", re.compile(r'You are given a natural language query: "(.*?)"\n')),
+    ("explore", re.compile(r'Analyze this database exploration question: "(.*?)"\n')),
+    ("modify", re.compile(r"natural language modification command:\s*'(.*)'\s*$", re.DOTALL)),
+]
+
+
+class ReplayGenAIClient:
+
+    # Drop-in for google.genai.Client that answers generate_content with a recorded
+    # translation for the natural language text found in the prompt.
+
+    recordings = {}
+    latency = 0.0
+
+    def __init__(self, api_key=None):
+        self.models = self
+
+    def generate_content(self, model, contents):
+        time.sleep(self.latency)
+        for kind, pattern in PROMPT_PATTERNS:
+            match = pattern.search(contents)
+            if match:
+                recorded = self.recordings.get(kind, {}).get(match.group(1).strip())
+                if recorded is not None:
+                    return self._response(json.dumps(recorded))
+                break
+        # Unrecorded prompts get an empty candidate list, which the app treats as a failed translation
+        return SimpleNamespace(candidates=[])
+
+    @staticmethod
+    def _response(text):
+        part = SimpleNamespace(text=text)
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+def to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def to_price(value):
+    return to_int((value or "").replace("$", "").replace(",", ""))
+
+def to_list(value):
+    # Amenities are stored as a list, parsed as load_airbnb_mongo.py does
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return [s.strip() for s in value.split(",")]
+
+
+class StandInBackends:
+
+    # In-process replacements for the connector functions app.py calls, answering from
+    # the sample CSV after a fixed per-call latency. They return realistic row shapes and
+    # sizes; they do not evaluate the generated SQL or filters beyond limits and id lists.
+
+    MYSQL_TABLES = ["Hosts", "Listings", "Reviews"]
+
+    def __init__(self, csv_path, latency):
+        self.latency = latency
+        with open(csv_path, encoding="utf-8") as f:
+            rows = [r for r in csv.DictReader(f) if to_int(r["id"]) is not None]
+        self.listings = [
+            {
+                "id": to_int(r["id"]), "name": r["name"], "room_type": r["room_type"],
+                "property_type": r["property_type"], "accommodates": to_int(r["accommodates"]),
+                "neighbourhood_cleansed": r["neighbourhood_cleansed"], "host_id": to_int(r["host_id"])
+            }
+            for r in rows
+        ]
+        self.listings_meta = [
+            {
+                "_id": to_int(r["id"]), "host_id": to_int(r["host_id"]), "source": r["source"],
+                "host_response_rate": r["host_response_rate"], "instant_bookable": r["instant_bookable"],
+                "neighbourhood_cleansed": r["neighbourhood_cleansed"]
+            }
+            for r in rows
+        ]
+        # Columns only the derived indexes read (geo, text and aggregate loaders)
+        self.listing_details = {
+            to_int(r["id"]): {
+                "latitude": r["latitude"], "longitude": r["longitude"], "description": r["description"],
+                "neighborhood_overview": r["neighborhood_overview"], "rating": r["review_scores_rating"] or None
+            }
+            for r in rows
+        }
+        self.amenities = [{"listing_id": to_int(r["id"]), "amenities": to_list(r["amenities"])} for r in rows if r["amenities"]]
+        self.firebase_listings = [
+            {
+                "id": str(to_int(r["id"])),
+                "pricing": {"price": to_price(r["price"])},
+                "availability": {c: to_int(r[c]) for c in ("availability_30", "availability_60", "availability_90", "availability_365")}
+            }
+            for r in rows
+        ]
+
+    def install(self):
+        app.query_mysql = self.query_mysql
+        app.query_mongodb = self.query_mongodb
+        app.stream_mongodb = self.stream_mongodb
+        app.query_firebase = self.query_firebase
+        app.modify_mysql = self.modify
+        app.modify_mongodb = self.modify
+        app.modify_firebase = self.modify
+        app.validate_table_exists = lambda table_name: table_name in self.MYSQL_TABLES
+        app.get_table_schema = self.get_table_schema
+        app.get_mongodb_collections = lambda: ["listings_meta", "amenities", "media"]
+        app.get_mongodb_schema = self.get_mongodb_schema
+        app.get_mongodb_sample = lambda collection_name, count=5: self.query_mongodb({"collection": collection_name, "limit": count})
+        app.get_firebase_nodes = lambda: ["listings", "hosts"]
+        app.get_firebase_sample = lambda node_path, count=5: self.firebase_listings[:count]
+        # The schema catalogue would introspect the real stores at startup
+        app.schema_catalog.refresh = lambda backend=None: None
+        # The Firebase mirror would subscribe to the real database at startup
+        app.start_firebase_mirror = lambda: None
+        # The derived indexes are built at startup by loaders that read the stores directly
+        for module in (geo_index, text_index, aggregate_store):
+            module.get_connection = self.connect
+        amenity_index.get_collection = self.get_collection
+        aggregate_store.initialize_firebase = lambda: None
+        aggregate_store.get_reference = lambda node: SimpleNamespace(get=lambda: {r["id"]: r for r in self.firebase_listings})
+        # The write-behind flusher and the replication applier write in batches
+        for module in (write_journal, replication_log):
+            module.modify_mysql_batch = self.modify_batch
+            module.modify_mongodb_batch = self.modify_batch
+        write_journal.modify_firebase_batch = self.modify_batch
+        replication_log.apply_firebase_updates = self.modify_batch
+
+    def connect(self):
+        # A pymysql connection whose cursor answers any SELECT with every listing
+        rows = [{**listing, **self.listing_details[listing["id"]]} for listing in self.listings]
+        cursor = SimpleNamespace(execute=lambda sql, params=None: time.sleep(self.latency), fetchall=lambda: rows)
+        return SimpleNamespace(cursor=lambda: contextlib.nullcontext(cursor), close=lambda: None)
+
+    def get_collection(self, collection_name):
+        rows = self.amenities if collection_name == "amenities" else self.listings_meta
+        return SimpleNamespace(find=lambda *args, **kwargs: [dict(r) for r in rows])
+
+    def query_mysql(self, sql_query):
+        time.sleep(self.latency)
+        if sql_query.strip().upper().startswith("SHOW TABLES"):
+            return [{"Tables_in_airbnb_db": t} for t in self.MYSQL_TABLES]
+        rows = self.listings
+        ids = re.search(r"\bid IN \(([^)]*)\)", sql_query)
+        if ids:
+            wanted = {to_int(v.strip(" '")) for v in ids.group(1).split(",")}
+            rows = [r for r in rows if r["id"] in wanted]
+        limit = re.search(r"\bLIMIT\s+(\d+)", sql_query, re.IGNORECASE)
+        return [dict(r) for r in rows[:int(limit.group(1)) if limit else None]]
+
+    def query_mongodb(self, mongo_filter, collection_name="listings_meta", convert=True):
+        time.sleep(self.latency)
+        limit = None
+        id_filter = None
+        if isinstance(mongo_filter, dict):
+            collection_name = mongo_filter.get("collection", collection_name)
+            limit = mongo_filter.get("limit")
+            id_filter = (mongo_filter.get("filter") or {}).get("_id") or (mongo_filter.get("filter") or {}).get("listing_id")
+        rows = self.amenities if collection_name == "amenities" else self.listings_meta
+        if isinstance(id_filter, dict) and "$in" in id_filter:
+            wanted = set(id_filter["$in"])
+            rows = [r for r in rows if r.get("_id", r.get("listing_id")) in wanted]
+        return [dict(r) for r in rows[:limit]]
+
+    def stream_mongodb(self, mongo_filter, collection_name="listings_meta"):
+        # A one-pass iterator of undecoded documents, like the raw_bson cursor
+        return (RawBSONDocument(bson.encode(r)) for r in self.query_mongodb(mongo_filter, collection_name))
+
+    def query_firebase(self, node, query_obj=None):
+        time.sleep(self.latency)
+        limit = (query_obj or {}).get("limitToFirst")
+        return [dict(r) for r in self.firebase_listings[:limit]]
+
+    def modify(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return {"message": "stand-in modification applied"}
+
+    def modify_batch(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return {"message": "stand-in batch applied", "errors": {}}
+
+    def get_table_schema(self, table_name):
+        rows = self.listings if table_name == "Listings" else [{"host_id": 1, "host_name": ""}]
+        return [{"Field": k, "Type": type(v).__name__, "Null": "YES", "Key": "", "Default": None, "Extra": ""} for k, v in rows[0].items()]
+
+    def get_mongodb_schema(self, collection_name):
+        return [{"Field": k, "Type": type(v).__name__, "Example": str(v)} for k, v in self.listings_meta[0].items()]
+
+
+def build_workload(recordings, endpoints):
+    workload = []
+    if "query" in endpoints:
+        workload += [("/query", {"query": q}) for q in recordings["query"]]
+        # The same MongoDB translations streamed as undecoded BSON
+        workload += [("/query", {"query": q, "db_type": "mongodb", "raw_bson": True})
+                     for q, translation in recordings["query"].items() if "mongodb" in translation]
+    if "explore" in endpoints:
+        workload += [("/explore", {"query": q}) for q in recordings["explore"]]
+    if "modify" in endpoints:
+        workload += [("/modify", {"modification": q}) for q in recordings["modify"]]
+    return workload
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def use_scratch_logs(folder):
+    # Keeps the write-behind journal and the replication log of a test run out of the backend folder
+    app.write_journal.journal_path = os.path.join(folder, "write_journal.jsonl")
+    app.write_journal.checkpoint_path = os.path.join(folder, "write_journal.checkpoint")
+    app.replication_log.log_path = os.path.join(folder, "replication_log.jsonl")
+    app.replication_log.checkpoint_path = os.path.join(folder, "replication_log.checkpoint")
+
+def start_server(port):
+    server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def run_load(base_url, workload, total_requests, concurrency):
+    local = threading.local()
+    samples = []  # (endpoint, seconds, ok)
+    samples_lock = threading.Lock()
+
+    def send(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        endpoint, payload = workload[i % len(workload)]
+        started = time.perf_counter()
+        try:
+            response = local.session.post(base_url + endpoint, json=payload, timeout=60)
+            # A streamed response that fails part way still has status 200, so the body must parse too
+            ok = response.status_code == 200 and response.json() is not None
+        except (requests.RequestException, ValueError):
+            ok = False
+        with samples_lock:
+            samples.append((endpoint, time.perf_counter() - started, ok))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(total_requests)))
+    return samples, time.perf_counter() - started
+
+def summarize(samples, elapsed):
+    report = {}
+    for endpoint in sorted({s[0] for s in samples}):
+        latencies = sorted(s[1] * 1000 for s in samples if s[0] == endpoint)
+        errors = sum(1 for s in samples if s[0] == endpoint and not s[2])
+        report[endpoint] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "error_rate": errors / len(latencies),
+            "throughput_rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": latencies[-1]
+        }
+    return report
+
+def print_report(report, elapsed, total):
+    print(f"\n{total} requests in {elapsed:.2f}s ({total / elapsed:.1f} req/s overall)")
+    print(f"{'endpoint':<10}{'reqs':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint, r in report.items():
+        print(f"{endpoint:<10}{r['requests']:>7}{r['errors']:>8}{r['throughput_rps']:>9.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}")
+
+def check_thresholds(report, max_p95_ms, max_p99_ms, max_error_rate):
+    failures = []
+    for endpoint, r in report.items():
+        if max_p95_ms is not None and r["p95_ms"] > max_p95_ms:
+            failures.append(f"{endpoint} p95 {r['p95_ms']:.1f} ms > {max_p95_ms} ms")
+        if max_p99_ms is not None and r["p99_ms"] > max_p99_ms:
+            failures.append(f"{endpoint} p99 {r['p99_ms']:.1f} ms > {max_p99_ms} ms")
+        if r["error_rate"] > max_error_rate:
+            failures.append(f"{endpoint} error rate {r['error_rate']:.1%} > {max_error_rate:.1%}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /query, /explore and /modify")
+    parser.add_argument("--requests", type=int, default=600, help="total requests to send")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client connections")
+    parser.add_argument("--endpoints", default="query,explore,modify", help="comma separated subset of query,explore,modify")
+    parser.add_argument("--recordings", default=RECORDINGS_PATH, help="recorded NL -> translation JSON")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated Gemini latency per call")
+    parser.add_argument("--backend-latency-ms", type=float, default=2.0, help="simulated latency per stand-in backend call")
+    parser.add_argument("--live-backends", action="store_true", help="use the configured MySQL/MongoDB/Firebase instead of stand-ins")
+    parser.add_argument("--max-p95-ms", type=float, default=None)
+    parser.add_argument("--max-p99-ms", type=float, default=None)
+    parser.add_argument("--max-error-rate", type=float, default=0.0)
+    parser.add_argument("--report", default=None, help="write the report as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's console output")
+    args = parser.parse_args()
+
+    with open(args.recordings, encoding="utf-8") as f:
+        recordings = json.load(f)
+    ReplayGenAIClient.recordings = recordings
+    ReplayGenAIClient.latency = args.llm_latency_ms / 1000
+    app.genai = SimpleNamespace(Client=ReplayGenAIClient)
+    if not args.live_backends:
+        StandInBackends(CSV_FILE_PATH, args.backend_latency_ms / 1000).install()
+
+    workload = build_workload(recordings, args.endpoints.split(","))
+    port = free_port()
+    with tempfile.TemporaryDirectory() as scratch:
+        use_scratch_logs(scratch)
+        server, thread = start_server(port)
+        print(f"=== LOAD TEST: {args.requests} requests, concurrency {args.concurrency}, "
+              f"{'live backends' if args.live_backends else 'stand-in backends'} ===")
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            samples, elapsed = run_load(f"http://127.0.0.1:{port}", workload, args.requests, args.concurrency)
+        server.should_exit = True
+        thread.join()
+
+    report = summarize(samples, elapsed)
+    print_report(report, elapsed, len(samples))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    failures = check_thresholds(report, args.max_p95_ms, args.max_p99_ms, args.max_error_rate)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
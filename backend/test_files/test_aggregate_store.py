@@ -0,0 +1,189 @@
+import os
+import random
+import sys
+
+# Checks the neighbourhood aggregate table against a GROUP BY computed from scratch, while
+# listings are changed through the MySQL statements and Firebase updates the write listeners
+# see, and which writes mysql_changes / firebase_changes turn into listing changes.
+# No database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_aggregate_store.py
+#   python -m pytest test_files/test_aggregate_store.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.aggregate_store import (GROUP_FIELDS, MEASURES, AggregateTable, InvalidAggregateQuery,
+                                      firebase_changes, mysql_changes, parse_aggregate)
+
+NEIGHBOURHOODS = ["Venice", "Hollywood", "Echo Park", "Downtown", None]
+ROOM_TYPES = ["Entire home/apt", "Private room", "Shared room"]
+OPS = {"count": len, "sum": sum, "avg": lambda values: sum(values) / len(values), "min": min, "max": max}
+
+
+def random_listings(rng, count):
+    listings = {}
+    for i in range(count):
+        entry = {"listed": True} if rng.random() < 0.9 else {}  # some listings are only in Firebase
+        if entry:
+            entry["neighbourhood_cleansed"] = rng.choice(NEIGHBOURHOODS)
+            entry["room_type"] = rng.choice(ROOM_TYPES)
+            # Quarter points add up exactly, so sums and averages can be compared exactly
+            entry["rating"] = rng.choice([None, rng.randint(12, 20) / 4])
+        entry["price"] = rng.choice([None, rng.randint(40, 400)])
+        entry["availability_30"] = rng.randint(0, 30)
+        listings[str(i)] = entry
+    return listings
+
+def random_spec(rng):
+    group_by = rng.sample(GROUP_FIELDS, rng.randint(0, 2))
+    metrics = ["count"] + rng.sample([f"{op}_{measure}" for op in OPS if op != "count" for measure in ("rating", "price", "availability_30")], 2)
+    spec = {"group_by": group_by, "metrics": metrics}
+    if rng.random() < 0.4:
+        spec["where"] = {"room_type": rng.sample(ROOM_TYPES, 2)} if rng.random() < 0.5 else {"neighbourhood_cleansed": "venice"}
+    if rng.random() < 0.4:
+        spec["having"] = {"count": {"$gte": rng.randint(1, 20)}}
+    sort_field = rng.choice(metrics + group_by)
+    spec["sort"] = {sort_field: rng.choice([1, -1])}
+    if rng.random() < 0.5:
+        spec["limit"] = rng.randint(0, 8)
+    return parse_aggregate(spec)
+
+def group_by(listings, spec):
+    # The aggregate computed from scratch, the way a GROUP BY would
+    groups = {}
+    for entry in listings.values():
+        if not entry.get("listed"):
+            continue
+        if any(str(entry.get(field)).casefold() not in {str(v).casefold() for v in (values if isinstance(values, list) else [values])}
+               or entry.get(field) is None for field, values in spec["where"].items()):
+            continue
+        groups.setdefault(tuple(entry.get(field) for field in spec["group_by"]), []).append(entry)
+    rows = []
+    for key, members in groups.items():
+        row = dict(zip(spec["group_by"], key))
+        for metric in spec["metrics"]:
+            if metric == "count":
+                row[metric] = len(members)
+                continue
+            op, measure = metric.split("_", 1)
+            values = [entry[measure] for entry in members if entry.get(measure) is not None]
+            row[metric] = OPS[op](values) if values else (0 if op == "count" else None)
+        rows.append(row)
+    for metric, condition in spec["having"].items():
+        rows = [row for row in rows if row[metric] is not None and row[metric] >= condition["$gte"]]
+    return rows
+
+def check(table, listings, spec):
+    rows = table.query(spec)
+    expected = group_by(listings, spec)
+    (field, direction), = spec["sort"].items()
+    # Sorted the same way as the table: missing values last either way
+    ordered = sorted((row for row in expected if row[field] is not None), key=lambda row: row[field], reverse=direction == -1)
+    ordered += [row for row in expected if row[field] is None]
+    if spec["limit"] is not None:
+        ordered = ordered[:spec["limit"]]
+    # Ties may be kept in a different order (or cut at a different group); the values must agree
+    assert [row[field] for row in rows] == [row[field] for row in ordered], spec
+    if spec["limit"] is None:
+        assert sorted(rows, key=str) == sorted(expected, key=str), spec
+
+def random_mysql_statement(rng, listings):
+    listing_id = rng.choice(list(listings) + ["9999"])
+    if rng.random() < 0.5:
+        value = rng.choice(ROOM_TYPES) if rng.random() < 0.5 else rng.choice(NEIGHBOURHOODS[:-1])
+        column = "room_type" if value in ROOM_TYPES else "neighbourhood_cleansed"
+        return f"UPDATE Listings SET {column} = '{value}' WHERE id = {listing_id}"
+    return f"UPDATE Reviews SET review_scores_rating = {rng.randint(12, 20) / 4} WHERE listing_id = {listing_id}"
+
+def random_firebase_update(rng, listings):
+    listing_id = rng.choice(list(listings) + [str(len(listings) + rng.randint(0, 5))])
+    roll = rng.random()
+    if roll < 0.1:
+        return {listing_id: None}
+    if roll < 0.3:
+        return {listing_id: {"pricing": {"price": rng.randint(40, 400)}, "availability": {"availability_30": rng.randint(0, 30)}}}
+    if roll < 0.5:
+        return {f"{listing_id}/pricing": {"price": rng.randint(40, 400), "cleaning_fee": 10}}
+    return {f"{listing_id}/pricing/price": rng.randint(40, 400), f"{listing_id}/availability/availability_30": rng.randint(0, 30)}
+
+def test_patched_table_matches_group_by():
+    rng = random.Random(50)
+    listings = random_listings(rng, 300)
+    table = AggregateTable().apply({key: dict(entry) for key, entry in listings.items()})
+    for _ in range(150):
+        if rng.random() < 0.5:
+            changes = mysql_changes([random_mysql_statement(rng, listings) for _ in range(rng.randint(1, 3))])
+            table.apply(changes, create=False)
+            for key, fields in changes.items():
+                if key in listings:
+                    listings[key].update(fields)
+        else:
+            changes = firebase_changes(random_firebase_update(rng, listings))
+            table.apply(changes)
+            for key, fields in changes.items():
+                listings.setdefault(key, {}).update(fields)
+        for _ in range(3):
+            check(table, listings, random_spec(rng))
+
+def test_removing_the_minimum_rescans_the_cell():
+    table = AggregateTable().apply({
+        "1": {"listed": True, "neighbourhood_cleansed": "Venice", "room_type": "Private room", "price": 50},
+        "2": {"listed": True, "neighbourhood_cleansed": "Venice", "room_type": "Private room", "price": 80},
+        "3": {"listed": True, "neighbourhood_cleansed": "Venice", "room_type": "Private room", "price": 120},
+    })
+    spec = parse_aggregate({"group_by": ["neighbourhood_cleansed"], "metrics": ["min_price", "max_price", "avg_price"]})
+    table.apply(firebase_changes({"1": None, "3/pricing/price": 100}))
+    assert table.query(spec) == [{"neighbourhood_cleansed": "Venice", "min_price": 80, "max_price": 100, "avg_price": 90}]
+    # Listings without a MySQL row are not counted, and an UPDATE of a missing row changes nothing
+    table.apply(firebase_changes({"4": {"pricing": {"price": 10}}}))
+    table.apply(mysql_changes(["UPDATE Listings SET room_type = 'Shared room' WHERE id = 5"]), create=False)
+    assert table.size() == (4, 1)
+
+def test_mysql_changes():
+    assert mysql_changes([
+        "UPDATE Listings SET room_type = 'Private room', name = 'Loft' WHERE id = 3",
+        "UPDATE `Reviews` SET `review_scores_rating` = 4.5 WHERE `listing_id` = 3",
+        "UPDATE Hosts SET host_name = 'Ann' WHERE host_id = 9",
+        "INSERT INTO Hosts (host_id) VALUES (10)",
+    ]) == {"3": {"room_type": "Private room", "rating": 4.5}}
+    assert mysql_changes(["UPDATE Listings SET name = 'Loft' WHERE id = 3"]) == {}
+    # Anything on Listings or Reviews that is not a keyed update by listing needs a rebuild
+    for statement in (
+        "UPDATE Listings SET room_type = 'Private room' WHERE host_id = 9",
+        "UPDATE Listings SET accommodates = accommodates + 1 WHERE id = 3",
+        "DELETE FROM Reviews WHERE listing_id = 3",
+        "INSERT INTO Listings (id, room_type) VALUES (3, 'Private room')",
+        "UPDATE Reviews SET review_scores_rating = 4 WHERE id = 3",
+        "UPDATE Listings l JOIN Hosts h ON l.host_id = h.host_id SET l.room_type = 'Private room'",
+    ):
+        assert mysql_changes([statement]) is None, statement
+
+def test_firebase_changes():
+    assert firebase_changes({"3": None})["3"] == {measure: None for measure in MEASURES if measure != "rating"}
+    assert firebase_changes({"3/pricing/price": "90"}) == {"3": {"price": 90.0}}
+    assert firebase_changes({"3/pricing": {"price": 90, "cleaning_fee": 5}}) == {"3": {"price": 90.0}}
+    assert firebase_changes({"3/availability/availability_30": 4, "4/pricing/cleaning_fee": 5}) == {"3": {"availability_30": 4.0}}
+    assert firebase_changes({"3/name": "Loft"}) == {}
+
+def test_invalid_aggregates_are_rejected():
+    for spec in ("count", {"group_by": ["city"]}, {"metrics": ["median_price"]}, {"metrics": "count"},
+                 {"where": {"price": 5}}, {"having": {"avg_price": {"$gt": 1}}}, {"having": {"count": {"$gt": "many"}}},
+                 {"sort": {"price": 1}}, {"limit": -1}):
+        try:
+            parse_aggregate(spec)
+        except InvalidAggregateQuery as e:
+            assert e.status_code == 400
+        else:
+            raise AssertionError(f"{spec!r} should be rejected")
+
+def main():
+    print("=== AGGREGATE STORE TEST ===")
+    for test in (test_patched_table_matches_group_by, test_removing_the_minimum_rescans_the_cell, test_mysql_changes,
+                 test_firebase_changes, test_invalid_aggregates_are_rejected):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import random
+import sys
+from array import array
+
+# Checks the amenity bitmap index against a plain scan of the same documents: all/any/none
+# filters on a built index, an index patched with with_listings against one rebuilt from the
+# patched documents, and which listings a MongoDB write names. No database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_amenity_index.py
+#   python -m pytest test_files/test_amenity_index.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.amenity_index import AmenityBitmaps, InvalidAmenityQuery, amenity_words, parse_amenities, written_listing_ids
+
+# Common amenities end up as int bitmaps, rare ones as arrays of listing numbers
+COMMON = ["Wifi", "Kitchen", "Smoke alarm", "Free parking on premises", "Hair dryer"]
+RARE = ["Free street parking", "Dishwasher", "Pool", "Hot tub", "Smoking allowed", "EV charger", "Private hot tub"]
+TERMS = ["wifi", "kitchen", "free parking", "parking", "dishwasher", "hot tub", "pool", "smoking allowed", "ev charger", "sauna"]
+
+
+def random_amenities(rng):
+    names = [name for name in COMMON if rng.random() < 0.6] + [name for name in RARE if rng.random() < 0.02]
+    # Spacing differences collapse to one amenity
+    return [name.replace(" ", "  ") if rng.random() < 0.1 else name for name in names]
+
+def random_documents(rng, count):
+    return {listing_id: random_amenities(rng) for listing_id in rng.sample(range(1000, 9000), count)}
+
+def random_spec(rng):
+    spec = {part: rng.sample(TERMS, rng.randint(0, 2)) for part in ("all", "any", "none")}
+    if not any(spec.values()):
+        spec["all"] = [rng.choice(TERMS)]
+    return spec
+
+def scan(documents, spec):
+    # The filter evaluated the slow, obvious way
+    def has(amenities, term):
+        return any(amenity_words(term) <= amenity_words(name) for name in amenities)
+
+    return {
+        listing_id for listing_id, amenities in documents.items()
+        if amenities is not None
+        and all(has(amenities, term) for term in spec["all"])
+        and (not spec["any"] or any(has(amenities, term) for term in spec["any"]))
+        and not any(has(amenities, term) for term in spec["none"])
+    }
+
+def matches(index, spec):
+    return set(index.listing_ids(index.evaluate(spec)))
+
+def test_build_and_evaluate_match_a_scan():
+    rng = random.Random(49)
+    documents = random_documents(rng, 600)
+    index = AmenityBitmaps.build(documents.items())
+    kinds = {type(posting) for posting in index.postings.values()}
+    assert kinds == {int, array}
+    assert "Free parking on premises" in index.postings and "Free  parking on premises" not in index.postings
+    for _ in range(300):
+        spec = random_spec(rng)
+        assert matches(index, spec) == scan(documents, spec), spec
+
+def test_build_skips_malformed_documents():
+    index = AmenityBitmaps.build([("7", ["Wifi"]), (7, ["Pool"]), (8, "Wifi, Pool"), (9, None), (10, [])])
+    assert index.ids == [7, 10]
+    assert matches(index, {"all": ["wifi"], "any": [], "none": []}) == {7}
+    assert matches(index, {"all": [], "any": [], "none": ["pool"]}) == {7, 10}
+    bits = index.evaluate({"all": ["wifi"], "any": [], "none": []})
+    assert index.contains(bits, "7") and not index.contains(bits, 10) and not index.contains(bits, 8)
+
+def test_patched_index_matches_rebuilt_index():
+    rng = random.Random(50)
+    documents = random_documents(rng, 400)
+    index = AmenityBitmaps.build(documents.items())
+    for _ in range(30):
+        changes = {}
+        for listing_id in rng.sample(sorted(documents), 10):
+            changes[listing_id] = None if rng.random() < 0.3 else random_amenities(rng)
+        for _ in range(5):
+            changes[str(rng.randint(9000, 9500))] = random_amenities(rng)
+        changes[rng.randint(20000, 30000)] = None  # removing a listing the index never had
+        before = index
+        index = index.with_listings(changes)
+        for listing_id, amenities in changes.items():
+            documents[int(listing_id)] = amenities
+        documents = {listing_id: amenities for listing_id, amenities in documents.items() if amenities is not None}
+        rebuilt = AmenityBitmaps.build(documents.items())
+        for _ in range(20):
+            spec = random_spec(rng)
+            assert matches(index, spec) == matches(rebuilt, spec) == scan(documents, spec), spec
+        # Each amenity lists the same listings in both
+        for amenity in set(index.postings) | set(rebuilt.postings):
+            patched = set(index.listing_ids(index.bitmap(index.postings.get(amenity, 0))))
+            assert patched == set(rebuilt.listing_ids(rebuilt.bitmap(rebuilt.postings.get(amenity, 0)))), amenity
+        # The snapshot that was patched is left as it was
+        assert before is not index and len(before.ids) <= len(index.ids)
+
+def test_written_listing_ids():
+    cases = [
+        ({"operation": "insert", "document": {"listing_id": 5, "amenities": []}}, [5]),
+        ({"operation": "insert", "documents": [{"listing_id": 5}, {"listing_id": 6}]}, [5, 6]),
+        ({"operation": "insert", "documents": [{"listing_id": 5}, {"amenities": []}]}, None),
+        ({"operation": "update", "filter": {"listing_id": 5}, "update": {"$push": {"amenities": "Pool"}}}, [5]),
+        ({"operation": "delete", "filter": {"listing_id": {"$in": [5, "6"]}}}, [5, "6"]),
+        ({"operation": "update", "filter": {"listing_id": {"$gt": 5}}}, None),
+        ({"operation": "update", "filter": {"listing_id": 5, "amenities": "Pool"}}, None),
+        ({"operation": "delete", "filter": {}}, None),
+        (None, None),
+    ]
+    for mod_query, expected in cases:
+        assert written_listing_ids(mod_query) == expected, mod_query
+
+def test_invalid_filters_are_rejected():
+    assert parse_amenities(["wifi"]) == {"all": ["wifi"], "any": [], "none": []}
+    for spec in ({}, {"all": []}, {"some": ["wifi"]}, {"all": "wifi"}, {"all": ["!!"]}, {"all": [1]},
+                 {"all": [f"amenity {i}" for i in range(21)]}, "wifi"):
+        try:
+            parse_amenities(spec)
+        except InvalidAmenityQuery as e:
+            assert e.status_code == 400
+        else:
+            raise AssertionError(f"{spec!r} should be rejected")
+
+def main():
+    print("=== AMENITY INDEX TEST ===")
+    for test in (test_build_and_evaluate_match_a_scan, test_build_skips_malformed_documents,
+                 test_patched_index_matches_rebuilt_index, test_written_listing_ids, test_invalid_filters_are_rejected):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
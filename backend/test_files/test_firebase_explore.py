@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Runs the Firebase exploration helpers against a local stub of the Realtime
+# Database REST API and checks how many bytes each call transfers.
+# No Firebase project or credentials are needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_firebase_explore.py
+#   python -m pytest test_files/test_firebase_explore.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firebase_admin
+from database import firebase_connector
+from database.firebase_connector import list_firebase_keys, sample_firebase_children
+
+
+def make_dataset(listing_count):
+    listings = {
+        str(1000 + i): {
+            "pricing": {"price": 100 + i % 50, "cleaning_fee": 25, "weekly_price": 650},
+            "availability": {"availability_30": i % 30, "availability_365": i % 365}
+        }
+        for i in range(listing_count)
+    }
+    hosts = {str(9000 + i): {"host_is_superhost": i % 2 == 0, "host_listings_count": 1} for i in range(listing_count // 4)}
+    return {"listings": listings, "hosts": hosts}
+
+
+class StubFirebase:
+
+    # Minimal Realtime Database REST server: GET /<path>.json with the shallow,
+    # orderBy="$key" and limitToFirst parameters, counting the response bytes.
+
+    def __init__(self):
+        self.data = {}
+        self.bytes_sent = 0
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                stub.requests.append((url.path, params))
+                body = json.dumps(stub.resolve(url.path, params)).encode("utf-8")
+                stub.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}?ns=stub"
+
+    def resolve(self, path, params):
+        node = self.data
+        for part in [p for p in path[:-len(".json")].split("/") if p]:
+            node = node.get(part) if isinstance(node, dict) else None
+        if not isinstance(node, dict):
+            return node
+        if params.get("shallow") == "true":
+            return {k: True for k in node}
+        if json.loads(params.get("orderBy", "null")) == "$key":
+            # Firebase orders integer-like keys numerically, before all other keys
+            keys = sorted(node, key=lambda k: (0, int(k), "") if k.isdigit() else (1, 0, k))
+            if "limitToFirst" in params:
+                keys = keys[:int(params["limitToFirst"])]
+            return {k: node[k] for k in keys}
+        return node
+
+    def measure(self, fn, *args):
+        self.bytes_sent = 0
+        result = fn(*args)
+        return result, self.bytes_sent
+
+
+_stub = None
+
+def get_stub():
+    global _stub
+    if _stub is None:
+        _stub = StubFirebase()
+        firebase_connector.FIREBASE_CONFIG["database_url"] = _stub.url
+        for app in list(firebase_admin._apps.values()):
+            firebase_admin.delete_app(app)
+    return _stub
+
+def test_shallow_node_listing_is_independent_of_data_size():
+    stub = get_stub()
+    transferred = []
+    for listing_count in (100, 20000):
+        stub.data = make_dataset(listing_count)
+        keys, size = stub.measure(list_firebase_keys, "/")
+        assert sorted(keys) == ["hosts", "listings"]
+        transferred.append(size)
+    print(f"Top-level key listing transferred {transferred} bytes for 100 / 20000 listings")
+    assert transferred[0] == transferred[1]
+    assert stub.requests[-1][1].get("shallow") == "true"
+
+def test_sample_reads_only_requested_children():
+    stub = get_stub()
+    transferred = []
+    for listing_count in (100, 20000):
+        stub.data = make_dataset(listing_count)
+        samples, size = stub.measure(sample_firebase_children, "listings", 3)
+        assert list(samples.keys()) == ["1000", "1001", "1002"]
+        transferred.append(size)
+    full_size = len(json.dumps(stub.data["listings"]).encode("utf-8"))
+    print(f"Sample of 3 transferred {transferred} bytes (full node: {full_size} bytes)")
+    assert transferred[0] == transferred[1]
+    assert transferred[1] * 1000 < full_size
+
+def main():
+    print("=== FIREBASE BOUNDED EXPLORATION TEST ===")
+    test_shallow_node_listing_is_independent_of_data_size()
+    test_sample_reads_only_requested_children()
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
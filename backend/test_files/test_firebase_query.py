@@ -0,0 +1,183 @@
+import os
+import random
+import sys
+
+from fastapi import HTTPException
+
+# Checks the compiled Firebase query filter against a straightforward filter-and-sort over
+# random listings: every operator, orderBy with limitToFirst (kept by a heap), keys, and the
+# 400 for operands that are not numbers. No database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_firebase_query.py
+#   python -m pytest test_files/test_firebase_query.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.firebase_connector import filter_firebase_data
+from database.firebase_query import FILTER_GROUPS, compile_firebase_query, run_firebase_query
+
+FIELDS = {"pricing": ("price", "cleaning_fee"), "availability": ("availability_30", "availability_365")}
+OPERATORS = ("$lt", "$lte", "$gt", "$gte", "$eq", "$ne", "$in", "$between")
+
+
+def number(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def holds(value, op, operand):
+    if op == "$lt":
+        return value < float(operand)
+    if op == "$lte":
+        return value <= float(operand)
+    if op == "$gt":
+        return value > float(operand)
+    if op == "$gte":
+        return value >= float(operand)
+    if op == "$eq":
+        return value == float(operand)
+    if op == "$ne":
+        return value != float(operand)
+    if op == "$in":
+        return value in [float(member) for member in operand]
+    return float(operand[0]) <= value <= float(operand[1])
+
+def expected(data, query):
+    # The query done the slow, obvious way: filter every child, sort all matches, then slice
+    def matches(child):
+        for group in FILTER_GROUPS:
+            for field, condition in query.get(group, {}).items():
+                value = number(child.get(group, {}).get(field)) if isinstance(child.get(group), dict) else None
+                if value is None:
+                    return False
+                conditions = condition if isinstance(condition, dict) else {"$eq": condition}
+                if not all(holds(value, op, operand) for op, operand in conditions.items()):
+                    return False
+        return True
+
+    def order(pair):
+        group, field = query["orderBy"].split("/")
+        value = number(pair[1].get(group, {}).get(field)) if isinstance(pair[1].get(group), dict) else None
+        return float("inf") if value is None else value
+
+    pairs = [(key, data[key]) for key in query["keys"] if key in data] if "keys" in query else list(data.items())
+    rows = [pair for pair in pairs if matches(pair[1])]
+    if "orderBy" in query:
+        rows = sorted(rows, key=order)
+    if "limitToFirst" in query:
+        rows = rows[:query["limitToFirst"]]
+    return [key for key, _ in rows]
+
+def random_value(rng):
+    # Small integers so that ties and $eq matches are common, plus values no condition matches
+    roll = rng.random()
+    if roll < 0.05:
+        return None
+    if roll < 0.08:
+        return "n/a"
+    if roll < 0.1:
+        return True
+    if roll < 0.2:
+        return str(rng.randint(0, 20))
+    return rng.randint(0, 20) + rng.choice((0, 0, 0.5))
+
+def random_listings(rng, count):
+    data = {}
+    for i in range(count):
+        child = {}
+        for group, fields in FIELDS.items():
+            if rng.random() < 0.05:
+                continue
+            child[group] = {field: random_value(rng) for field in fields if rng.random() < 0.95}
+        data[str(i)] = child
+    return data
+
+def random_condition(rng, op):
+    if op == "$in":
+        return [rng.randint(0, 20) for _ in range(rng.randint(1, 4))]
+    if op == "$between":
+        low = rng.randint(0, 20)
+        return [low, low + rng.randint(0, 8)]
+    return rng.choice((rng.randint(0, 20), str(rng.randint(0, 20)), rng.randint(0, 20) + 0.5))
+
+def random_query(rng, op):
+    group = rng.choice(FILTER_GROUPS)
+    query = {group: {rng.choice(FIELDS[group]): {op: random_condition(rng, op)}}}
+    if rng.random() < 0.5:
+        other = rng.choice(FILTER_GROUPS)
+        field = rng.choice(FIELDS[other])
+        extra = rng.choice(OPERATORS)
+        query.setdefault(other, {}).setdefault(field, {})[extra] = random_condition(rng, extra)
+    if rng.random() < 0.7:
+        order_group = rng.choice(FILTER_GROUPS)
+        query["orderBy"] = f"{order_group}/{rng.choice(FIELDS[order_group])}"
+    if rng.random() < 0.6:
+        query["limitToFirst"] = rng.randint(0, 40)
+    if rng.random() < 0.2:
+        query["keys"] = [str(rng.randint(0, 450)) for _ in range(rng.randint(0, 60))]
+    return query
+
+def test_every_operator_matches_filter_and_sort():
+    rng = random.Random(46)
+    data = random_listings(rng, 400)
+    for op in OPERATORS:
+        for _ in range(60):
+            query = random_query(rng, op)
+            assert [row["id"] for row in filter_firebase_data(data, query)] == expected(data, query), query
+
+def test_bare_value_means_eq():
+    data = {"1": {"pricing": {"price": 10}}, "2": {"pricing": {"price": "10"}}, "3": {"pricing": {"price": 11}}}
+    assert [row["id"] for row in filter_firebase_data(data, {"pricing": {"price": 10}})] == ["1", "2"]
+
+def test_heap_top_k_matches_full_sort():
+    rng = random.Random(7)
+    data = random_listings(rng, 1000)
+    for limit in (0, 1, 5, 50, 999, 5000):
+        query = {"orderBy": "pricing/price", "limitToFirst": limit}
+        compiled = compile_firebase_query(query)
+        top = [key for key, _ in run_firebase_query(compiled, data.items())]
+        assert top == expected(data, query), limit
+
+def test_keys_keep_their_order():
+    data = {str(i): {"pricing": {"price": i}} for i in range(10)}
+    query = {"keys": ["7", "2", "missing", "5", "9"], "pricing": {"price": {"$lt": 8}}}
+    assert [row["id"] for row in filter_firebase_data(data, query)] == ["7", "2", "5"]
+    # A list node (consecutive integer keys) is read the same way
+    as_list = [None] + [{"pricing": {"price": i}} for i in range(1, 10)]
+    assert [row["id"] for row in filter_firebase_data(as_list, query)] == ["7", "2", "5"]
+
+def test_non_numeric_operands_are_rejected():
+    data = {"1": {"pricing": {"price": 10}}}
+    for query in (
+        {"pricing": {"price": {"$lt": "cheap"}}},
+        {"pricing": {"price": {"$in": [10, "ten"]}}},
+        {"pricing": {"price": {"$in": 10}}},
+        {"pricing": {"price": {"$between": [1]}}},
+        {"pricing": {"price": {"$between": [1, None]}}},
+        {"pricing": {"price": {"$eq": True}}},
+        {"pricing": {"price": {"$regex": "1"}}},
+        {"pricing": "cheap"},
+        {"limitToFirst": -1},
+        {"keys": "1"},
+    ):
+        try:
+            filter_firebase_data(data, query)
+        except HTTPException as e:
+            assert e.status_code == 400, query
+        else:
+            raise AssertionError(f"{query} should be rejected")
+
+def main():
+    print("=== FIREBASE QUERY TEST ===")
+    for test in (test_every_operator_matches_filter_and_sort, test_bare_value_means_eq, test_heap_top_k_matches_full_sort,
+                 test_keys_keep_their_order, test_non_numeric_operands_are_rejected):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
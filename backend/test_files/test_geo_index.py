@@ -0,0 +1,102 @@
+import os
+import random
+import sys
+
+# Checks the geo grid against a full haversine scan of the same points: radius searches and
+# k-nearest searches (with and without a radius) around Los Angeles, from dense areas, sparse
+# ones and points outside the data, on grids of several cell sizes. No database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_geo_index.py
+#   python -m pytest test_files/test_geo_index.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.geo_index import GridIndex, InvalidNearQuery, haversine_m, parse_near
+
+# Most listings are in central Los Angeles, a few are spread across southern California
+DENSE = (33.95, 34.15, -118.45, -118.2)
+SPARSE = (32.5, 35.5, -120.0, -116.0)
+CELL_SIZES = (0.005, 0.01, 0.05)
+
+
+def random_points(rng, count):
+    points = []
+    for listing_id in range(count):
+        south, north, west, east = DENSE if rng.random() < 0.9 else SPARSE
+        points.append((listing_id, rng.uniform(south, north), rng.uniform(west, east)))
+    return points
+
+def random_center(rng):
+    roll = rng.random()
+    if roll < 0.1:
+        return rng.uniform(40, 45), rng.uniform(-80, -70)  # far from every point
+    south, north, west, east = DENSE if roll < 0.7 else SPARSE
+    return rng.uniform(south, north), rng.uniform(west, east)
+
+def scan(points, latitude, longitude, radius_m=None):
+    # Every point's distance, nearest first (ties broken by listing id, as the grid does)
+    found = [(haversine_m(latitude, longitude, lat, lon), listing_id) for listing_id, lat, lon in points]
+    return sorted(hit for hit in found if radius_m is None or hit[0] <= radius_m)
+
+def test_haversine():
+    # One degree of latitude, and Los Angeles City Hall to Santa Monica Pier (about 23.8 km)
+    assert abs(haversine_m(34.0, -118.0, 35.0, -118.0) - 111195.08) < 0.1
+    assert abs(haversine_m(34.0537, -118.2428, 34.0101, -118.4962) - 23850) < 100
+    assert haversine_m(34.0, -118.0, 34.0, -118.0) == 0.0
+
+def test_within_matches_a_scan():
+    rng = random.Random(47)
+    points = random_points(rng, 2000)
+    for cell_deg in CELL_SIZES:
+        grid = GridIndex(points, cell_deg)
+        assert grid.size == len(points)
+        for _ in range(100):
+            latitude, longitude = random_center(rng)
+            # Radii from inside one cell to wider than the whole data set
+            radius_m = rng.choice((50, 300, 1000, 5000, 40000, 1000000))
+            assert grid.within(latitude, longitude, radius_m) == scan(points, latitude, longitude, radius_m), \
+                (cell_deg, latitude, longitude, radius_m)
+
+def test_nearest_matches_a_scan():
+    rng = random.Random(48)
+    points = random_points(rng, 2000)
+    for cell_deg in CELL_SIZES:
+        grid = GridIndex(points, cell_deg)
+        for _ in range(100):
+            latitude, longitude = random_center(rng)
+            k = rng.choice((1, 5, 20, 300, 5000))
+            radius_m = rng.choice((None, None, 500, 5000))
+            assert grid.nearest(latitude, longitude, k, radius_m) == scan(points, latitude, longitude, radius_m)[:k], \
+                (cell_deg, latitude, longitude, k, radius_m)
+
+def test_empty_and_single_point_grids():
+    empty = GridIndex([], 0.01)
+    assert empty.within(34.0, -118.0, 1000) == [] and empty.nearest(34.0, -118.0, 5) == []
+    single = GridIndex([(7, 34.0, -118.0)], 0.01)
+    assert [listing_id for _, listing_id in single.nearest(36.0, -115.0, 3)] == [7]
+    assert single.within(36.0, -115.0, 1000) == []
+
+def test_invalid_near_queries_are_rejected():
+    assert parse_near({"latitude": "34.05", "longitude": -118.24, "k": 3}) == \
+        {"latitude": 34.05, "longitude": -118.24, "radius_km": None, "k": 3}
+    assert parse_near({"latitude": 34.05, "longitude": -118.24})["radius_km"] > 0
+    for near in ("Union Station", {"latitude": 34.05}, {"latitude": "north", "longitude": 0}, {"latitude": 91, "longitude": 0},
+                 {"latitude": 34.05, "longitude": -118.24, "radius_km": 0}, {"latitude": 34.05, "longitude": -118.24, "k": -1}):
+        try:
+            parse_near(near)
+        except InvalidNearQuery as e:
+            assert e.status_code == 400
+        else:
+            raise AssertionError(f"{near!r} should be rejected")
+
+def main():
+    print("=== GEO INDEX TEST ===")
+    for test in (test_haversine, test_within_matches_a_scan, test_nearest_matches_a_scan,
+                 test_empty_and_single_point_grids, test_invalid_near_queries_are_rejected):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
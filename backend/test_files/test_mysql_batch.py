@@ -0,0 +1,156 @@
+import os
+import sys
+from decimal import Decimal
+from unittest import mock
+
+import pymysql
+from fastapi import HTTPException
+from pymysql.converters import escape_item
+
+# Checks how modify_mysql_batch splits statements into %s templates and values, groups
+# same-shape statements into executemany calls and rolls the batch back on an error.
+# A fake connection stands in for MySQL, so no database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_mysql_batch.py
+#   python -m pytest test_files/test_mysql_batch.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import mysql_connector
+from database.mysql_connector import modify_mysql_batch, parameterize_sql
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, template, params):
+        self.connection.calls.append(("execute", template, [params]))
+        return self.connection.check(template)
+
+    def executemany(self, template, rows):
+        self.connection.calls.append(("executemany", template, rows))
+        return self.connection.check(template) * len(rows)
+
+
+class FakeConnection:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = []
+        self.committed = self.rolled_back = self.closed = False
+
+    def check(self, template):
+        if self.fail_on and self.fail_on in template:
+            raise pymysql.err.OperationalError(1213, "Deadlock found")
+        return 1
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = True
+
+
+def render(template, params):
+    # What pymysql sends to the server for a template and its values
+    return template % tuple(escape_item(value, "utf8") for value in params)
+
+def test_numbers_and_strings():
+    template, params = parameterize_sql("UPDATE Listings SET price = 120.50, name = 'Loft' WHERE id = 3003")
+    assert template == "UPDATE Listings SET price = %s, name = %s WHERE id = %s"
+    assert params == [Decimal("120.50"), "Loft", 3003]
+    assert isinstance(params[2], int)
+
+def test_quotes_inside_strings():
+    cases = {
+        "INSERT INTO Hosts (host_name) VALUES ('O''Brien')": "O'Brien",
+        "INSERT INTO Hosts (host_name) VALUES ('O\\'Brien')": "O'Brien",
+        "INSERT INTO Hosts (host_name) VALUES (\"say \"\"hi\"\"\")": 'say "hi"',
+        "INSERT INTO Hosts (host_name) VALUES ('a\\\\b')": "a\\b",
+        "INSERT INTO Hosts (host_name) VALUES ('')": "",
+        "INSERT INTO Hosts (host_name) VALUES ('it''s 100% ''real''')": "it's 100% 'real'",
+    }
+    for sql, value in cases.items():
+        template, params = parameterize_sql(sql)
+        assert template == "INSERT INTO Hosts (host_name) VALUES (%s)", sql
+        assert params == [value], sql
+
+def test_percent_and_functions_round_trip():
+    # MOD, the % operator, INTERVAL and numbers inside identifiers keep their meaning
+    # once pymysql fills the template back in
+    cases = [
+        "UPDATE Listings SET accommodates = accommodates % 4 WHERE MOD(id, 2) = 0",
+        "DELETE FROM Reviews WHERE date < NOW() - INTERVAL 30 DAY",
+        "UPDATE Listings SET availability_30 = -1, price = price * 1.1 WHERE id = 7",
+        "UPDATE Listings SET name = 'Room 2' WHERE neighbourhood_cleansed = 'Echo Park' AND id > 5",
+    ]
+    for sql in cases:
+        template, params = parameterize_sql(sql)
+        assert render(template, params) == sql, sql
+    assert parameterize_sql("DELETE FROM Reviews WHERE date < NOW() - INTERVAL 30 DAY")[1] == [30]
+    assert "%%" in parameterize_sql("UPDATE Listings SET accommodates = accommodates % 4")[0]
+    # Digits that are part of a name are not values
+    assert parameterize_sql("SELECT availability_30 FROM t1")[1] == []
+
+def test_executemany_grouping():
+    stmts = [
+        "INSERT INTO Hosts (host_id, host_name) VALUES (1, 'Ann');",
+        "INSERT INTO Hosts (host_id, host_name) VALUES (2, 'O''Neil')",
+        "UPDATE Listings SET price = '$120' WHERE id = 3",
+        "INSERT INTO Hosts (host_id, host_name) VALUES (3, 'Cy')",
+        "INSERT INTO Hosts (host_id, host_name) VALUES (4, 'Di')",
+    ]
+    connection = FakeConnection()
+    with mock.patch.object(mysql_connector, "get_connection", return_value=connection):
+        result = modify_mysql_batch(stmts)
+    assert result == {"statements": 5, "executemany_groups": 3, "rowcount": 5}
+    assert [call[0] for call in connection.calls] == ["executemany", "execute", "executemany"]
+    assert connection.calls[0][2] == [[1, "Ann"], [2, "O'Neil"]]
+    # '$120' is cleaned to a plain number before parameterizing
+    assert connection.calls[1][2] == [["120", 3]]
+    assert connection.calls[2][2] == [[3, "Cy"], [4, "Di"]]
+    assert connection.committed and not connection.rolled_back and connection.closed
+
+def test_error_rolls_back_the_whole_batch():
+    stmts = [
+        "INSERT INTO Hosts (host_id, host_name) VALUES (1, 'Ann')",
+        "UPDATE Listings SET price = 100 WHERE id = 3",
+    ]
+    connection = FakeConnection(fail_on="UPDATE")
+    invalidated = []
+    with mock.patch.object(mysql_connector, "get_connection", return_value=connection), \
+         mock.patch.object(mysql_connector, "invalidate_mysql_cache",
+                           side_effect=lambda s, committed=True: invalidated.append(committed)):
+        try:
+            modify_mysql_batch(stmts)
+        except HTTPException as e:
+            assert e.status_code == 500
+            assert "rolled back" in e.detail
+        else:
+            raise AssertionError("the failing batch should raise")
+    assert connection.rolled_back and not connection.committed and connection.closed
+    assert invalidated == [False]
+
+def main():
+    print("=== MYSQL BATCH TEST ===")
+    for test in (test_numbers_and_strings, test_quotes_inside_strings, test_percent_and_functions_round_trip,
+                 test_executemany_grouping, test_error_rolls_back_the_whole_batch):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+
+# Checks which tables a cached MySQL result depends on and which tables a write invalidates,
+# and the LRU / TTL / targeted invalidation of QueryCache. No database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_query_cache.py
+#   python -m pytest test_files/test_query_cache.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.query_cache import ANY_TARGET, QueryCache, mongo_read_collections, sql_read_tables, sql_write_tables
+
+
+def test_read_tables():
+    cases = {
+        "SELECT * FROM Listings WHERE id = 1": {"listings"},
+        "SELECT * FROM Listings l, Hosts h WHERE l.host_id = h.host_id": {"listings", "hosts"},
+        "SELECT * FROM Listings AS l, `Hosts` AS h, Reviews": {"listings", "hosts", "reviews"},
+        "SELECT * FROM airbnb.Listings l JOIN Reviews r ON r.listing_id = l.id": {"listings", "reviews"},
+        "SELECT * FROM Listings l LEFT JOIN Hosts h ON l.host_id = h.host_id": {"listings", "hosts"},
+        "SELECT * FROM (SELECT id FROM Listings) t, Hosts h": {"listings", "hosts"},
+        "SELECT id FROM Listings WHERE id IN (SELECT listing_id FROM Reviews)": {"listings", "reviews"},
+        # Words inside string literals are not table references
+        "SELECT id FROM Listings WHERE name = 'from Hosts'": {"listings"},
+    }
+    for sql, tables in cases.items():
+        assert sql_read_tables(sql) == tables, sql
+
+def test_read_tables_unknown_means_any():
+    assert sql_read_tables("SELECT 1") == {ANY_TARGET}
+    assert sql_read_tables("SELECT * FROM (SELECT id FROM Listings") == {ANY_TARGET}
+
+def test_write_tables():
+    cases = {
+        "INSERT INTO Hosts (host_id) VALUES (1)": {"hosts"},
+        "UPDATE `Listings` SET `room_type` = 'Private room' WHERE `id` = 3": {"listings"},
+        "DELETE FROM Reviews WHERE listing_id = 1": {"reviews"},
+        "UPDATE Listings l JOIN Hosts h ON l.host_id = h.host_id SET h.host_is_superhost = 1": {"listings", "hosts"},
+        "UPDATE Listings, Hosts SET Hosts.host_listings_count = 0 WHERE Listings.host_id = Hosts.host_id": {"listings", "hosts"},
+        "DELETE l FROM Listings l JOIN Reviews r ON r.listing_id = l.id": {"listings", "reviews"},
+    }
+    for sql, tables in cases.items():
+        assert sql_write_tables([sql]) == tables, sql
+    assert sql_write_tables(["INSERT INTO Hosts (host_id) VALUES (1)", "DELETE FROM Reviews"]) == {"hosts", "reviews"}
+
+def test_write_tables_unknown_means_all():
+    assert sql_write_tables(["CREATE INDEX idx ON Listings (name)"]) is None
+    assert sql_write_tables(["INSERT INTO Hosts (host_id) VALUES (1)", "CALL refresh()"]) is None
+
+def test_mongo_read_collections():
+    pipeline = {"collection": "listings_meta", "aggregate": [
+        {"$lookup": {"from": "amenities", "localField": "_id", "foreignField": "listing_id", "as": "a"}},
+        {"$unionWith": {"coll": "media"}}
+    ]}
+    assert mongo_read_collections(pipeline, "listings_meta") == {"listings_meta", "amenities", "media"}
+
+def test_lru_eviction():
+    cache = QueryCache("test", max_entries=2, ttl_seconds=60)
+    cache.put("a", 1, ["listings"])
+    cache.put("b", 2, ["listings"])
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3, ["listings"])
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry():
+    cache = QueryCache("test", max_entries=10, ttl_seconds=0.05)
+    cache.put("a", 1, ["listings"])
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+def test_invalidation_is_targeted():
+    cache = QueryCache("test", max_entries=10, ttl_seconds=60)
+    cache.put("listings", 1, sql_read_tables("SELECT * FROM Listings"))
+    cache.put("join", 2, sql_read_tables("SELECT * FROM Listings l, Hosts h WHERE l.host_id = h.host_id"))
+    cache.put("unknown", 3, sql_read_tables("SELECT 1"))
+    assert cache.invalidate(sql_write_tables(["UPDATE Listings l JOIN Hosts h ON l.host_id = h.host_id SET h.host_is_superhost = 1"])) == 3
+    cache.put("listings", 1, ["listings"])
+    cache.put("hosts", 2, ["hosts"])
+    assert cache.invalidate(["Hosts"]) == 1
+    assert cache.get("listings") == 1 and cache.get("hosts") is None
+    assert cache.invalidate(None) == 1
+    assert cache.get("listings") is None
+
+def main():
+    print("=== QUERY CACHE TEST ===")
+    for test in (test_read_tables, test_read_tables_unknown_means_any, test_write_tables,
+                 test_write_tables_unknown_means_all, test_mongo_read_collections, test_lru_eviction,
+                 test_ttl_expiry, test_invalidation_is_targeted):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
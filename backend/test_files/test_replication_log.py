@@ -0,0 +1,156 @@
+import os
+import sys
+import tempfile
+from unittest import mock
+
+# Checks the replication log for shared fields: which writes are recorded, the MySQL/Firebase
+# mapping of host_is_superhost, how a batch is propagated to the other copies, and that
+# checkpoints and replay() can be repeated safely. The batch writers the applier calls only
+# record what they are given, so no database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_replication_log.py
+#   python -m pytest test_files/test_replication_log.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import Overloaded
+from database import replication_log as replication_module
+from database.replication_log import ReplicationLog, store_value
+from database.write_journal import keyed_mongodb_write, keyed_mysql_write
+
+
+def recording_stores(outage=False):
+    # The writes each store was given, and a patch installing the recording batch writers.
+    # With outage=True, MySQL sheds every batch.
+    written = {"mysql": [], "mongodb": [], "firebase": []}
+
+    def modify_mysql_batch(stmts):
+        if outage:
+            raise Overloaded("mysql", "queue_full", 1)
+        written["mysql"].extend(stmts)
+        return {"statements": len(stmts)}
+
+    def modify_mongodb_batch(mods):
+        written["mongodb"].extend(mods)
+        return {"errors": {}}
+
+    def apply_firebase_updates(node, updates):
+        written["firebase"].append((node, dict(updates)))
+        return 1
+
+    return written, mock.patch.multiple(replication_module, modify_mysql_batch=modify_mysql_batch,
+                                        modify_mongodb_batch=modify_mongodb_batch, apply_firebase_updates=apply_firebase_updates)
+
+def log_in(folder):
+    return ReplicationLog(os.path.join(folder, "replication_log.jsonl"), os.path.join(folder, "replication_log.checkpoint"))
+
+def checkpoint_in(folder):
+    with open(os.path.join(folder, "replication_log.checkpoint"), encoding="utf-8") as f:
+        return int(f.read())
+
+# The writes production records: keyed MySQL updates of Hosts and Listings, and keyed
+# MongoDB updates of listings_meta. Firebase /hosts is only ever a copy that is written to.
+
+def mongodb_write(listing_id, fields):
+    return keyed_mongodb_write("listings_meta", {"operation": "update", "filter": {"_id": listing_id}, "update": {"$set": fields}})
+
+def test_superhost_mapping():
+    for value in (True, 1, "1", "t", "true"):
+        assert store_value("mysql", "host_is_superhost", value) == 1
+        assert store_value("firebase", "host_is_superhost", value) == "t"
+    for value in (False, 0, "0", "f", "false"):
+        assert store_value("mysql", "host_is_superhost", value) == 0
+        assert store_value("firebase", "host_is_superhost", value) == "f"
+    assert store_value("firebase", "host_is_superhost", None) is None
+    assert store_value("firebase", "host_listings_count", 3) == 3
+
+def test_record_keeps_shared_fields_only():
+    log = ReplicationLog(None, None)
+    recorded = log.record([
+        keyed_mysql_write("UPDATE Listings SET price = 100, neighbourhood_cleansed = 'Venice' WHERE id = 3"),
+        keyed_mysql_write("UPDATE Listings SET price = 90 WHERE id = 4"),
+        keyed_mysql_write("UPDATE Hosts SET host_is_superhost = 1 WHERE host_id = 7"),
+        # Not a copy of a shared entity
+        keyed_mysql_write("UPDATE Reviews SET review_scores_rating = 4 WHERE listing_id = 3"),
+        keyed_mongodb_write("amenities", {"operation": "update", "filter": {"_id": 3}, "update": {"$set": {"host_id": 7}}}),
+    ])
+    assert recorded == 2
+    entries = log._entries
+    assert [(e["entity"], e["key"], e["fields"]) for e in entries] == [
+        ("listing", 3, {"neighbourhood_cleansed": "Venice"}),
+        ("host", 7, {"host_is_superhost": 1}),
+    ]
+    assert [e["seq"] for e in entries] == [1, 2]
+
+def test_batch_propagates_to_the_other_copies():
+    log = ReplicationLog(None, None)
+    log.record([keyed_mysql_write("UPDATE Hosts SET host_is_superhost = 1, host_listings_count = 2 WHERE host_id = 7")])
+    log.record([keyed_mysql_write("UPDATE Hosts SET host_listings_count = 5 WHERE host_id = 7")])
+    log.record([keyed_mysql_write("UPDATE Hosts SET host_is_superhost = FALSE WHERE host_id = 8")])
+    log.record([mongodb_write(3, {"neighbourhood_cleansed": "Venice", "host_id": 7})])
+    log.record([keyed_mysql_write("UPDATE Listings SET neighbourhood_cleansed = 'Echo Park' WHERE id = 4")])
+    written, stores = recording_stores()
+    with stores:
+        batch = log.apply_batch()
+    assert batch["entries"] == 5 and not batch["retry"]
+    # The latest value of a field wins, and a copy is not written back to the store it came from
+    assert written["firebase"] == [("hosts", {"7/host_is_superhost": "t", "7/host_listings_count": 5, "8/host_is_superhost": "f"})]
+    assert written["mysql"] == ["UPDATE `Listings` SET `host_id` = 7, `neighbourhood_cleansed` = 'Venice' WHERE `id` = 3"]
+    assert written["mongodb"] == [
+        (0, "listings_meta", {"operation": "update", "filter": {"_id": 4}, "update": {"$set": {"neighbourhood_cleansed": "Echo Park"}}})
+    ]
+    assert log.stats()["pending_entries"] == 0 and log.stats()["applied_seq"] == 5
+
+def test_outage_keeps_the_batch_pending():
+    with tempfile.TemporaryDirectory() as folder:
+        log = log_in(folder)
+        log.record([mongodb_write(3, {"host_id": 7})])
+        with recording_stores(outage=True)[1]:
+            assert log.apply_batch()["retry"]
+        assert log.stats()["pending_entries"] == 1
+        assert not os.path.exists(os.path.join(folder, "replication_log.checkpoint"))
+        written, stores = recording_stores()
+        with stores:
+            assert not log.apply_batch()["retry"]
+        assert written["mysql"] == ["UPDATE `Listings` SET `host_id` = 7 WHERE `id` = 3"]
+        assert checkpoint_in(folder) == 1
+
+def test_checkpoint_and_replay_are_idempotent():
+    with tempfile.TemporaryDirectory() as folder:
+        log = log_in(folder)
+        log.record([keyed_mysql_write("UPDATE Hosts SET host_is_superhost = 1 WHERE host_id = 7")])
+        log.record([keyed_mysql_write("UPDATE Listings SET neighbourhood_cleansed = 'Venice' WHERE id = 3")])
+        first, stores = recording_stores()
+        with stores:
+            log.apply_batch()
+        assert checkpoint_in(folder) == 2
+
+        # A restart finds nothing left to apply
+        restarted = log_in(folder)
+        written, stores = recording_stores()
+        with stores:
+            assert restarted.apply_batch() == {"entries": 0}
+        assert written["firebase"] == written["mongodb"] == written["mysql"] == []
+
+        # Replaying writes the same values again and leaves the checkpoint where it was
+        restarted.replay(1)
+        replayed, stores = recording_stores()
+        with stores:
+            batch = restarted.apply_batch()
+            assert batch["replay"] and batch["entries"] == 2
+            assert restarted.apply_batch() == {"entries": 0}
+        assert replayed == first and first["firebase"] and first["mongodb"]
+        assert restarted.stats()["replaying_from"] is None
+        assert checkpoint_in(folder) == 2 and restarted.stats()["applied_seq"] == 2
+
+def main():
+    print("=== REPLICATION LOG TEST ===")
+    for test in (test_superhost_mapping, test_record_keeps_shared_fields_only, test_batch_propagates_to_the_other_copies,
+                 test_outage_keeps_the_batch_pending, test_checkpoint_and_replay_are_idempotent):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
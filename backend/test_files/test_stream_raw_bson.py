@@ -0,0 +1,71 @@
+import datetime
+import json
+import os
+import sys
+from unittest import mock
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from fastapi.testclient import TestClient
+
+# Streams a raw_bson /query response end to end: the MongoDB cursor is replaced by a
+# one-pass iterator of RawBSONDocument rows, as stream_mongodb returns them, and the
+# response must parse as JSON with every document in order. Gemini and MongoDB are
+# replaced by stand-ins, so no key or database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_stream_raw_bson.py
+#   python -m pytest test_files/test_stream_raw_bson.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from fast_json import dumps, iter_json_array
+
+MONGO_QUERY = {"collection": "listings_meta", "filter": {}}
+
+
+def raw_documents(count):
+    return [
+        RawBSONDocument(bson.encode({
+            "_id": ObjectId(), "listing_id": i, "name": f"Listing {i}",
+            "last_scraped": datetime.datetime(2024, 3, 1, 12, 30), "amenities": ["Wifi"] * (i % 3)
+        }))
+        for i in range(count)
+    ]
+
+def stream(docs):
+    # POSTs a raw_bson query whose MongoDB cursor yields docs once, and returns the parsed body
+    with mock.patch.object(app, "convert_nl_to_query", lambda nl_query: {"mongodb": MONGO_QUERY}), \
+         mock.patch.object(app, "stream_mongodb", lambda mongo_filter: iter(docs)):
+        response = TestClient(app.app).post("/query", json={"query": "Show listings", "db_type": "mongodb", "raw_bson": True})
+    assert response.status_code == 200, response.text
+    return json.loads(response.content)
+
+def test_raw_bson_response_has_every_document():
+    # 0 rows, less than one chunk, an exact number of chunks and a partial last chunk
+    for count in (0, 1, 256, 600):
+        docs = raw_documents(count)
+        body = stream(docs)
+        assert body["converted_queries"] == {"mongodb": MONGO_QUERY}
+        assert body["results"]["mongodb"] == json.loads(dumps(docs)), count
+        assert [row["listing_id"] for row in body["results"]["mongodb"]] == list(range(count))
+
+def test_iter_json_array_matches_dumps():
+    rows = [{"i": i, "tags": ["a"] * (i % 2)} for i in range(10)]
+    for chunk_size in (1, 3, 10, 50):
+        expected = dumps(rows)
+        assert b"".join(iter_json_array(rows, chunk_size)) == expected
+        assert b"".join(iter_json_array(iter(rows), chunk_size)) == expected
+        assert b"".join(iter_json_array(row for row in rows if row["i"] > 99)) == b"[]"
+
+def main():
+    print("=== RAW BSON STREAM TEST ===")
+    for test in (test_raw_bson_response_has_every_document, test_iter_json_array_matches_dumps):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import math
+import os
+import random
+import sys
+from collections import Counter
+
+# Checks the inverted text index against a straightforward BM25 scorer that reads every
+# document for every search: ranking, ties, limits, and that stopwords, short words and HTML
+# tags are neither indexed nor searched. No database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_text_index.py
+#   python -m pytest test_files/test_text_index.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.text_index import TEXT_INDEX_CONFIG, InvalidSearchQuery, InvertedIndex, parse_search, tokenize
+
+# A small vocabulary, so that terms repeat, documents tie and some terms are in most documents
+WORDS = ["rooftop", "view", "pool", "quiet", "beach", "walk", "downtown", "cozy", "loft", "garden", "parking", "2br"]
+NOISE = ["the", "a", "of", "with", "is", "TV", "ac", "<br />", "<b>", "Rooftop", "VIEW,", "pool."]
+
+
+def random_text(rng):
+    return " ".join(rng.choice(WORDS) if rng.random() < 0.7 else rng.choice(NOISE) for _ in range(rng.randint(0, 30)))
+
+def bm25(documents, text):
+    # Every document scored against every query term, the textbook way
+    k1, b = TEXT_INDEX_CONFIG["k1"], TEXT_INDEX_CONFIG["b"]
+    tokens = [Counter(tokenize(document)) for _, document in documents]
+    lengths = [sum(counts.values()) for counts in tokens]
+    average_length = (sum(lengths) / len(lengths) if lengths else 0.0) or 1.0
+    terms = set(tokenize(text))
+    scored = []
+    for number, counts in enumerate(tokens):
+        if not terms & set(counts):
+            continue
+        score = 0.0
+        for term in terms:
+            frequency = counts[term]
+            if frequency:
+                containing = sum(1 for other in tokens if term in other)
+                idf = math.log(1 + (len(tokens) - containing + 0.5) / (containing + 0.5))
+                score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * lengths[number] / average_length))
+        scored.append((score, number))
+    # Most relevant first; equal scores keep the order the documents were indexed in
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [(score, documents[number][0]) for score, number in scored]
+
+def assert_same_ranking(found, expected, context):
+    assert len(found) == len(expected), context
+    for (score, listing_id), (expected_score, expected_id) in zip(found, expected):
+        assert math.isclose(score, expected_score, rel_tol=1e-9), context
+        # Scores equal up to rounding may be ordered either way
+        tied = [other for s, other in expected if math.isclose(s, expected_score, rel_tol=1e-9)]
+        assert listing_id == expected_id or listing_id in tied, context
+
+def test_tokenize():
+    assert tokenize("The <b>Rooftop</b> VIEW, with a pool.<br />2BR loft & TV/AC of 1960s") == \
+        ["rooftop", "view", "pool", "2br", "loft", "1960s"]
+    assert tokenize(None) == tokenize("") == tokenize("the a of is") == []
+
+def test_search_matches_a_full_scorer():
+    rng = random.Random(48)
+    documents = [(listing_id, random_text(rng)) for listing_id in rng.sample(range(1000, 9000), 400)]
+    index = InvertedIndex(documents)
+    for _ in range(200):
+        text = " ".join(rng.choice(WORDS + NOISE) for _ in range(rng.randint(1, 4)))
+        limit = rng.choice((1, 5, 50, 1000))
+        expected = bm25(documents, text)
+        found = index.search(text, limit)
+        assert_same_ranking(found, expected[:limit], (text, limit))
+        if limit >= len(expected):
+            assert {listing_id for _, listing_id in found} == {listing_id for _, listing_id in expected}, text
+
+def test_stopwords_and_short_words_are_not_searched():
+    index = InvertedIndex([(1, "The quiet loft with a TV"), (2, "A loft by the beach"), (3, "<br /> quiet")])
+    assert index.search("the a with by", 10) == []
+    assert index.search("tv", 10) == [] and index.search("br", 10) == []
+    # Stopwords in the query change nothing, and do not count towards a document's length
+    assert index.search("the quiet loft", 10) == index.search("quiet loft", 10)
+    assert [listing_id for _, listing_id in index.search("quiet", 10)] == [3, 1]
+    assert InvertedIndex([]).search("loft", 10) == []
+
+def test_invalid_searches_are_rejected():
+    assert parse_search("  rooftop view ") == {"text": "rooftop view", "k": None}
+    assert parse_search({"text": "pool", "k": "5"}) == {"text": "pool", "k": 5}
+    for search in ({}, {"text": "   "}, {"text": 5}, {"text": "pool", "k": "many"}, {"text": "pool", "k": 0}, ["pool"]):
+        try:
+            parse_search(search)
+        except InvalidSearchQuery as e:
+            assert e.status_code == 400
+        else:
+            raise AssertionError(f"{search!r} should be rejected")
+
+def main():
+    print("=== TEXT INDEX TEST ===")
+    for test in (test_tokenize, test_search_matches_a_full_scorer, test_stopwords_and_short_words_are_not_searched,
+                 test_invalid_searches_are_rejected):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import copy
+import os
+import sys
+import tempfile
+from unittest import mock
+
+# Checks the write-behind journal: which modifications are keyed writes, coalescing of pending
+# writes, replay after a restart and checkpointing, and that the read-your-writes overlay leaves
+# the query results it is given alone. The journal lives in a temporary folder and the stores
+# are replaced by recording stand-ins, so no database is needed.
+#
+# Usage (from the backend folder):
+#   python test_files/test_write_journal.py
+#   python -m pytest test_files/test_write_journal.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import Overloaded
+from database import write_journal as journal_module
+from database.replication_log import ReplicationLog
+from database.write_journal import WriteJournal, keyed_firebase_write, keyed_mongodb_write, keyed_mysql_write
+
+
+class RecordingStores:
+
+    # Stand-ins for the modify_*_batch functions the flusher calls
+
+    def __init__(self, outage=False):
+        self.outage = outage
+        self.mysql = []
+        self.mongodb = []
+        self.firebase = []
+
+    def modify_mysql_batch(self, stmts):
+        if self.outage:
+            raise Overloaded("mysql", "queue_full", 1)
+        self.mysql.append(list(stmts))
+        return {"statements": len(stmts)}
+
+    def modify_mongodb_batch(self, mods):
+        self.mongodb.append(list(mods))
+        return {"errors": {}}
+
+    def modify_firebase_batch(self, node, mods):
+        self.firebase.append((node, list(mods)))
+        return {"errors": {}}
+
+    def patch(self):
+        return mock.patch.multiple(
+            journal_module,
+            modify_mysql_batch=self.modify_mysql_batch,
+            modify_mongodb_batch=self.modify_mongodb_batch,
+            modify_firebase_batch=self.modify_firebase_batch,
+            # Keep the shared replication log (and its files) out of the test
+            replication_log=ReplicationLog(None, None)
+        )
+
+
+def journal_in(folder):
+    return WriteJournal(os.path.join(folder, "write_journal.jsonl"), os.path.join(folder, "write_journal.checkpoint"))
+
+def read_checkpoint(folder):
+    with open(os.path.join(folder, "write_journal.checkpoint"), encoding="utf-8") as f:
+        return int(f.read())
+
+def test_keyed_writes():
+    assert keyed_mysql_write("UPDATE Listings SET price = 120, name = 'Loft' WHERE id = 3") == {
+        "backend": "mysql", "target": "Listings", "key_field": "id", "key": 3, "fields": {"price": 120, "name": "Loft"}}
+    assert keyed_mysql_write("UPDATE Listings SET price = price + 1 WHERE id = 3") is None
+    assert keyed_mysql_write("UPDATE Listings SET price = 1 WHERE neighbourhood_cleansed = 'Venice' AND id = 3") is None
+    # Only the primary key selects one record; other columns may match several rows
+    assert keyed_mysql_write("UPDATE Listings SET room_type = 'A' WHERE neighbourhood_cleansed = 'Hollywood'") is None
+    assert keyed_mysql_write("UPDATE Listings SET room_type = 'A' WHERE host_id = 7") is None
+    assert keyed_mysql_write("UPDATE `Hosts` SET host_name = 'Ann' WHERE `HOST_ID` = 7")["key_field"] == "HOST_ID"
+    assert keyed_mongodb_write("listings_meta", {"operation": "update", "filter": {"_id": "7"}, "update": {"$set": {"name": "A"}}})["key"] == 7
+    assert keyed_mongodb_write("listings_meta", {"operation": "update", "filter": {"_id": 7}, "update": {"$inc": {"n": 1}}}) is None
+    assert keyed_firebase_write("listings", {"operation": "update", "key": "7", "data": {"price": 10}})["fields"] == {"price": 10}
+    assert keyed_firebase_write("listings", {"operation": "update", "key": "7", "increment": {"price": 10}}) is None
+
+def test_coalescing():
+    with tempfile.TemporaryDirectory() as folder:
+        journal = journal_in(folder)
+        journal.append([keyed_mysql_write("UPDATE Listings SET price = 100, name = 'Loft' WHERE id = 3")])
+        journal.append([keyed_mysql_write("UPDATE Listings SET price = 120 WHERE id = 3")])
+        journal.append([keyed_mysql_write("UPDATE Listings SET price = 90 WHERE id = 4")])
+        stats = journal.stats()
+        assert stats["pending_keys"] == 2 and stats["pending_fields"] == 3 and stats["coalesced"] == 1
+
+        stores = RecordingStores()
+        with stores.patch():
+            assert journal.flush()["keys"] == 2
+        # One batch, one statement per record, the last write to a field wins
+        assert len(stores.mysql) == 1
+        assert sorted(stores.mysql[0]) == [
+            "UPDATE `Listings` SET `name` = 'Loft', `price` = 120 WHERE `id` = 3",
+            "UPDATE `Listings` SET `price` = 90 WHERE `id` = 4",
+        ]
+        assert journal.stats()["pending_keys"] == 0
+        assert read_checkpoint(folder) == 3
+
+def test_outage_keeps_writes_pending():
+    with tempfile.TemporaryDirectory() as folder:
+        journal = journal_in(folder)
+        journal.append([keyed_mysql_write("UPDATE Listings SET price = 100 WHERE id = 3")])
+        with RecordingStores(outage=True).patch():
+            assert journal.flush()["retry"] == 1
+        assert journal.stats()["pending_keys"] == 1
+        assert read_checkpoint(folder) == 0
+
+def test_replay_after_restart_is_idempotent():
+    with tempfile.TemporaryDirectory() as folder:
+        first = journal_in(folder)
+        first.append([keyed_mysql_write("UPDATE Listings SET price = 100 WHERE id = 3")])
+        first.append([keyed_mongodb_write("listings_meta", {"operation": "update", "filter": {"_id": 3}, "update": {"name": "Loft"}})])
+        stores = RecordingStores()
+        with stores.patch():
+            first.flush()
+        first.append([keyed_firebase_write("listings", {"operation": "update", "key": "3", "data": {"price": 100}})])
+        # A restart before the Firebase write was flushed: only it is replayed
+        second = journal_in(folder)
+        stores = RecordingStores()
+        with stores.patch():
+            second.flush()
+        assert stores.mysql == [] and stores.mongodb == []
+        assert stores.firebase == [("listings", [(0, "update", "3", {"price": 100})])]
+        assert read_checkpoint(folder) == 3
+        # Another restart finds nothing left to apply
+        third = journal_in(folder)
+        stores = RecordingStores()
+        with stores.patch():
+            assert third.flush() == {"keys": 0}
+        assert stores.mysql == stores.mongodb == stores.firebase == []
+        assert third.stats()["last_seq"] == 3
+
+def test_torn_last_line_is_skipped():
+    with tempfile.TemporaryDirectory() as folder:
+        journal_in(folder).append([keyed_mysql_write("UPDATE Listings SET price = 100 WHERE id = 3")])
+        with open(os.path.join(folder, "write_journal.jsonl"), "a", encoding="utf-8") as f:
+            f.write('{"seq": 2, "time": 0, "wri')
+        restarted = journal_in(folder)
+        stores = RecordingStores()
+        with stores.patch():
+            restarted.flush()
+        assert stores.mysql == [["UPDATE `Listings` SET `price` = 100 WHERE `id` = 3"]]
+
+def test_overlay_does_not_mutate_rows():
+    journal = WriteJournal(None, None)
+    journal.append([keyed_mysql_write("UPDATE Listings SET price = 120 WHERE id = 3")])
+    journal.append([keyed_firebase_write("listings", {"operation": "update", "key": "3", "data": {"price": 80}})])
+    mysql_rows = [{"id": 3, "price": 100, "name": "Loft"}, {"id": 4, "price": 90, "name": "Den"}]
+    firebase_rows = [{"id": 3, "pricing": {"price": 50, "cleaning_fee": 10}}]
+    originals = copy.deepcopy((mysql_rows, firebase_rows))
+
+    overlaid = journal.overlay("mysql", mysql_rows)
+    assert overlaid[0] == {"id": 3, "price": 120, "name": "Loft"}
+    assert overlaid[1] is mysql_rows[1]
+    overlaid = journal.overlay("firebase", firebase_rows)
+    assert overlaid[0] == {"id": 3, "pricing": {"price": 80, "cleaning_fee": 10}}
+    assert (mysql_rows, firebase_rows) == originals
+    # MySQL rows only get the columns they were selected with
+    assert journal.overlay("mysql", [{"id": 3, "name": "Loft"}]) == [{"id": 3, "name": "Loft"}]
+
+def main():
+    print("=== WRITE JOURNAL TEST ===")
+    for test in (test_keyed_writes, test_coalescing, test_outage_keeps_writes_pending,
+                 test_replay_after_restart_is_idempotent, test_torn_last_line_is_skipped,
+                 test_overlay_does_not_mutate_rows):
+        test()
+        print(f"{test.__name__}: ok")
+    print("\n=== TEST COMPLETED ===")
+
+if __name__ == "__main__":
+    main()
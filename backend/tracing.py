@@ -0,0 +1,251 @@
+import heapq
+import itertools
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+# Lightweight request tracing and structured logging.
+# - Every HTTP request gets a request id (the client's X-Request-ID, or a new one), which is
+#   echoed in the X-Request-ID response header and attached to every log record.
+# - A sampled fraction of requests (head-based: decided when the request starts) is traced:
+#   each metrics.stage() and each span() opened while handling it becomes a span with its
+#   parent, start offset, duration, attributes and error. Send "X-Trace-Sample: 1" to force
+#   tracing of one request.
+# - Finished traces are kept in memory: the most recent ones in a ring buffer and the slowest
+#   ones in a bounded heap, both served by GET /debug/traces.
+# Outside a sampled request span() only reads one ContextVar.
+
+# sample_rate: fraction of requests traced
+# recent_traces / slowest_traces: how many finished traces are kept in each list
+# max_spans: spans kept per trace; further spans are counted but dropped
+# log_level / log_json: level of the "chatdb" loggers and one-JSON-object-per-line output
+TRACING_CONFIG = {
+    "sample_rate": 0.05,
+    "recent_traces": 200,
+    "slowest_traces": 20,
+    "max_spans": 500,
+    "log_level": "INFO",
+    "log_json": False
+}
+
+# Paths never traced (scrapes and the trace viewer itself)
+UNTRACED_PATHS = ("/metrics", "/debug/")
+
+_request_id: ContextVar[str] = ContextVar("request_id", default="-")
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Trace:
+
+    # One sampled request: its spans are plain dicts appended as they finish.
+
+    def __init__(self, trace_id: str, name: str):
+        self.trace_id = trace_id
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.status = None
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped_spans = 0
+
+    def to_dict(self, spans: bool = True) -> Dict[str, Any]:
+        trace = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "span_count": len(self.spans),
+            "dropped_spans": self.dropped_spans
+        }
+        if spans:
+            trace["spans"] = sorted(self.spans, key=lambda s: s["start_ms"])
+        return trace
+
+
+class TraceStore:
+
+    # Finished traces: a ring buffer of the most recent and a min-heap of the slowest.
+
+    def __init__(self, recent: int, slowest: int):
+        self._recent = deque(maxlen=recent)
+        self._slowest = []  # (duration_ms, sequence, trace)
+        self._slowest_limit = slowest
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._recent.append(trace)
+            entry = (trace.duration_ms, next(self._sequence), trace)
+            if len(self._slowest) < self._slowest_limit:
+                heapq.heappush(self._slowest, entry)
+            elif entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def recent(self, limit: int) -> List[Trace]:
+        with self._lock:
+            return list(reversed(self._recent))[:limit]
+
+    def slowest(self, limit: int) -> List[Trace]:
+        with self._lock:
+            return [entry[2] for entry in sorted(self._slowest, reverse=True)][:limit]
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self._lock:
+            for trace in itertools.chain(self._recent, (entry[2] for entry in self._slowest)):
+                if trace.trace_id == trace_id:
+                    return trace
+        return None
+
+
+trace_store = TraceStore(TRACING_CONFIG["recent_traces"], TRACING_CONFIG["slowest_traces"])
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Dict[str, Any]]]:
+
+    # Records the enclosed block as a span of the current trace. Yields the span dict
+    # (add to span["attributes"] to annotate it) or None when the request is not sampled.
+
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    span_id = next(_span_ids)
+    record = {
+        "span_id": span_id,
+        "parent_id": _current_span.get(),
+        "name": name,
+        "start_ms": round((time.perf_counter() - trace.start) * 1000, 3),
+        "attributes": {k: v for k, v in attributes.items() if v is not None}
+    }
+    token = _current_span.set(span_id)
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        _current_span.reset(token)
+        if len(trace.spans) < TRACING_CONFIG["max_spans"]:
+            trace.spans.append(record)
+        else:
+            trace.dropped_spans += 1
+
+
+class TracingMiddleware:
+
+    # ASGI middleware: assigns the request id, makes the sampling decision and stores
+    # the finished trace.
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        path = scope["path"]
+        sampled = not path.startswith(UNTRACED_PATHS) and (
+            headers.get(b"x-trace-sample") == b"1" or random.random() < TRACING_CONFIG["sample_rate"])
+        trace = Trace(request_id, f"{scope['method']} {path}") if sampled else None
+        request_token = _request_id.set(request_id)
+        trace_token = _current_trace.set(trace)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                if trace is not None:
+                    trace.status = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            _current_trace.reset(trace_token)
+            _request_id.reset(request_token)
+            if trace is not None:
+                trace.duration_ms = round((time.perf_counter() - trace.start) * 1000, 3)
+                trace.status = trace.status or 500
+                trace_store.add(trace)
+
+
+def traces_summary(limit: int = 50) -> Dict[str, Any]:
+    return {
+        "sample_rate": TRACING_CONFIG["sample_rate"],
+        "recent": [t.to_dict(spans=False) for t in trace_store.recent(limit)],
+        "slowest": [t.to_dict(spans=False) for t in trace_store.slowest(limit)]
+    }
+
+
+# Structured logging
+
+class lazy_json:
+
+    # Defers json.dumps of a log argument until a handler actually formats the record:
+    #   logger.debug("MongoDB query: %s", lazy_json(mongo_filter))
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(self.value, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class JSONLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging() -> None:
+
+    # Sends the "chatdb.*" loggers to stderr with the request id on every line.
+
+    logger = logging.getLogger("chatdb")
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(RequestIdFilter())
+    if TRACING_CONFIG["log_json"]:
+        handler.setFormatter(JSONLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(TRACING_CONFIG["log_level"])
+    logger.propagate = False
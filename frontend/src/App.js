@@ -249,6 +249,7 @@ function App() {
   const [showMySQL, setShowMySQL] = useState(true);
   const [showMongo, setShowMongo] = useState(true);
   const [showFirebase, setShowFirebase] = useState(true);
+  const [showAggregate, setShowAggregate] = useState(true);
   const [activeTab, setActiveTab] = useState(0);
   const [modifyResult, setModifyResult] = useState(null);
 
@@ -296,12 +297,14 @@ function App() {
   // Regular query response handling
   const converted = !isExploration && result ? result.converted_queries : null;
   const results = !isExploration && result ? result.results : null;
-  const { mysql, mongodb, firebase } = results || {};
+  const { mysql, mongodb, firebase, aggregate } = results || {};
 
   // Modified result checking logic
   const hasMySQL = mysql && (Array.isArray(mysql) ? mysql.length > 0 : true);
   const hasMongoDB = mongodb && (typeof mongodb === 'object' && Object.keys(mongodb).length > 0);
   const hasFirebase = firebase && (typeof firebase === 'object' && Object.keys(firebase).length > 0);
+  // Per-neighbourhood statistics answered from the backend's aggregate table instead of one database
+  const hasAggregate = Array.isArray(aggregate);
 
   // Debug logging
   console.log('Result:', result);
@@ -565,11 +568,41 @@ function App() {
                 </Box>
               )}
 
-              <Typography variant="subtitle1" gutterBottom>
-                Individual Database Results
-              </Typography>
+              {/* Aggregate Result */}
+              {hasAggregate && (
+                <Accordion expanded={showAggregate} onChange={() => setShowAggregate(!showAggregate)}>
+                  <AccordionSummary expandIcon={<ExpandMoreIcon />}>
+                    <Typography variant="subtitle1">Aggregate Results</Typography>
+                  </AccordionSummary>
+                  <AccordionDetails>
+                    {aggregate.length > 0 ? (
+                      <>
+                        {converted && converted.aggregate && (
+                          <Box sx={{ mb: 2 }}>
+                            <Typography variant="subtitle2" gutterBottom>Executed Aggregate:</Typography>
+                            <Paper elevation={0} sx={{ p: 2, bgcolor: '#f8f9fa', mb: 2 }}>
+                              <pre style={{ margin: 0 }}>
+                                {JSON.stringify(converted.aggregate, null, 2)}
+                              </pre>
+                            </Paper>
+                          </Box>
+                        )}
+                        <DataTable data={aggregate} title="Aggregate" />
+                      </>
+                    ) : (
+                      <Typography variant="body2">No matching neighbourhoods.</Typography>
+                    )}
+                  </AccordionDetails>
+                </Accordion>
+              )}
+
+              {!hasAggregate && (
+                <Typography variant="subtitle1" gutterBottom>
+                  Individual Database Results
+                </Typography>
+              )}
               {/* MySQL Result */}
-              {database === 'mysql' && (
+              {database === 'mysql' && !hasAggregate && (
                 <Accordion expanded={showMySQL} onChange={() => setShowMySQL(!showMySQL)}>
                   <AccordionSummary expandIcon={<ExpandMoreIcon />}>
                     <Typography variant="subtitle1">MySQL Results</Typography>
@@ -595,7 +628,7 @@ function App() {
               )}
 
               {/* MongoDB Result */}
-              {database === 'mongodb' && (
+              {database === 'mongodb' && !hasAggregate && (
                 <Accordion expanded={showMongo} onChange={() => setShowMongo(!showMongo)}>
                   <AccordionSummary expandIcon={<ExpandMoreIcon />}>
                     <Typography variant="subtitle1">MongoDB Results</Typography>
@@ -628,7 +661,7 @@ function App() {
               )}
 
               {/* Firebase Result */}
-              {database === 'firebase' && (
+              {database === 'firebase' && !hasAggregate && (
                 <Accordion expanded={showFirebase} onChange={() => setShowFirebase(!showFirebase)}>
                   <AccordionSummary expandIcon={<ExpandMoreIcon />}>
                     <Typography variant="subtitle1">Firebase Results</Typography>